@@ -8,9 +8,11 @@ from datetime import datetime
 from typing import List, Optional
 import json
 import logging
+import sqlite3
 
-from database import SessionLocal, engine, Base
+from database import SessionLocal, engine, Base, PRAGMAS_SQLITE, pragmas_efectivos, estado_pool, estado_hilos_bd
 import models
+import versiones
 
 router = APIRouter(
     prefix="/api/admin/database",
@@ -27,6 +29,23 @@ def get_db():
     finally:
         db.close()
 
+def copiar_base_de_datos(destino: str):
+    """
+    Copia consistente con la API de backup de SQLite. En modo WAL las últimas transacciones
+    pueden estar todavía en tracer.db-wal, así que copiar solo el .db no basta.
+    """
+    conexion = engine.raw_connection()
+    try:
+        copia = sqlite3.connect(destino)
+        try:
+            conexion.driver_connection.backup(copia)
+            # La copia queda como un único archivo autocontenido, sin -wal/-shm
+            copia.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            copia.close()
+    finally:
+        conexion.close()
+
 def get_backups_list():
     """Obtiene la lista de backups disponibles"""
     backup_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backups')
@@ -35,7 +54,7 @@ def get_backups_list():
     
     backups = []
     for f in os.listdir(backup_dir):
-        if f.startswith('tracer_backup_'):
+        if f.startswith('tracer_backup_') and f.endswith('.db'):
             full_path = os.path.join(backup_dir, f)
             timestamp = f.replace('tracer_backup_', '').replace('.db', '')
             backups.append({
@@ -83,7 +102,13 @@ def get_database_status(db: Session = Depends(get_db)):
             "tables": tables,
             "size_bytes": size_bytes,
             "last_backup": last_backup,
-            "backups_count": len(backups)
+            "backups_count": len(backups),
+            "engine": {
+                "sqlite_pragmas": PRAGMAS_SQLITE,
+                "effective_pragmas": pragmas_efectivos(db.connection()),
+                "pool": estado_pool(),
+                "async_db_threads": estado_hilos_bd(),
+            }
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -102,8 +127,8 @@ def create_backup(background_tasks: BackgroundTasks):
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         backup_path = os.path.join(backup_dir, f'tracer_backup_{timestamp}.db')
         
-        # Copiar archivo de base de datos
-        shutil.copy2(db_path, backup_path)
+        # Copiar archivo de base de datos (incluye lo pendiente en el WAL)
+        copiar_base_de_datos(backup_path)
         
         return {"message": "Backup creado exitosamente", "backup_path": backup_path}
     except Exception as e:
@@ -130,9 +155,16 @@ async def restore_database(backup_file: UploadFile = File(...)):
             raise HTTPException(status_code=400, detail="El archivo no es una base de datos SQLite válida")
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         current_backup = f"pre_restore_backup_{timestamp}.db"
-        shutil.copy2(db_path, current_backup)
+        copiar_base_de_datos(current_backup)
+        # Cerrar las conexiones del pool (vuelca el WAL) y descartar -wal/-shm antes de sobrescribir
+        engine.dispose()
+        for sufijo in ("-wal", "-shm"):
+            if os.path.exists(db_path + sufijo):
+                os.remove(db_path + sufijo)
         shutil.copy2(temp_path, db_path)
         os.remove(temp_path)
+        # La base restaurada no pasa por sentencias DML: invalidar todos los ETag
+        versiones.incrementar_todo()
         return {"message": "Base de datos restaurada exitosamente"}
     except Exception as e:
         logger.error(f"Error inesperado al restaurar la base de datos: {e}", exc_info=True)
@@ -164,6 +196,7 @@ def reset_database(db: Session = Depends(get_db)):
         Base.metadata.drop_all(bind=engine)
         # Crear las tablas nuevamente
         Base.metadata.create_all(bind=engine)
+        versiones.incrementar_todo()
         # Ejecutar VACUUM para compactar la base de datos
         db.execute(text("VACUUM"))
         db.commit()
@@ -207,9 +240,10 @@ def clear_except_lectores(db: Session = Depends(get_db)):
     """Elimina todos los datos de todas las tablas excepto la de lectores."""
     try:
         lector_table = 'lector'
-        for table in Base.metadata.tables:
-            if table != lector_table:
-                db.execute(text(f"DELETE FROM {table}"))
+        # De hijas a padres, para no violar las claves foráneas
+        for table in reversed(Base.metadata.sorted_tables):
+            if table.name != lector_table:
+                db.execute(text(f"DELETE FROM {table.name}"))
         db.commit()
         # Ejecutar VACUUM para compactar la base de datos
         db.execute(text("VACUUM"))
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Depends
+
+import metricas
+
+router = APIRouter(
+    prefix="/api/admin/metricas",
+    tags=["admin"],
+    dependencies=[Depends(metricas.comprobar_cliente)],
+    responses={404: {"description": "Not found"}},
+)
+
+@router.get("")
+def get_resumen_metricas():
+    """Resumen por endpoint (latencias, tamaños, SQL), de mayor a menor tiempo total."""
+    return metricas.registro.resumen()
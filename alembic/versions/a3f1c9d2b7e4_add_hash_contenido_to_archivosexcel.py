@@ -0,0 +1,32 @@
+"""add Hash_Contenido to ArchivosExcel
+
+Revision ID: a3f1c9d2b7e4
+Revises: 01167a50721b
+Create Date: 2026-10-17 10:12:41.532118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3f1c9d2b7e4'
+down_revision: Union[str, None] = '01167a50721b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('ArchivosExcel', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('Hash_Contenido', sa.String(length=64), nullable=True))
+        batch_op.create_index(batch_op.f('ix_ArchivosExcel_Hash_Contenido'), ['Hash_Contenido'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('ArchivosExcel', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_ArchivosExcel_Hash_Contenido'))
+        batch_op.drop_column('Hash_Contenido')
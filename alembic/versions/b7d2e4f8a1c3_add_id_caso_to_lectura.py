@@ -0,0 +1,48 @@
+"""add ID_Caso to lectura with composite indexes
+
+Revision ID: b7d2e4f8a1c3
+Revises: a3f1c9d2b7e4
+Create Date: 2026-10-17 12:05:18.204511
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d2e4f8a1c3'
+down_revision: Union[str, None] = 'a3f1c9d2b7e4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('lectura', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ID_Caso', sa.Integer(), nullable=True))
+
+    # Rellenar con el caso del archivo de cada lectura
+    op.execute(
+        'UPDATE lectura SET "ID_Caso" = ('
+        'SELECT "ArchivosExcel"."ID_Caso" FROM "ArchivosExcel" '
+        'WHERE "ArchivosExcel"."ID_Archivo" = lectura."ID_Archivo")'
+    )
+
+    with op.batch_alter_table('lectura', schema=None) as batch_op:
+        batch_op.alter_column('ID_Caso', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('fk_lectura_ID_Caso_Casos', 'Casos', ['ID_Caso'], ['ID_Caso'])
+        batch_op.create_index('ix_lectura_caso_matricula_fecha', ['ID_Caso', 'Matricula', 'Fecha_y_Hora'], unique=False)
+        batch_op.create_index('ix_lectura_caso_lector_fecha', ['ID_Caso', 'ID_Lector', 'Fecha_y_Hora'], unique=False)
+        batch_op.create_index('ix_lectura_caso_fecha', ['ID_Caso', 'Fecha_y_Hora'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('lectura', schema=None) as batch_op:
+        batch_op.drop_index('ix_lectura_caso_fecha')
+        batch_op.drop_index('ix_lectura_caso_lector_fecha')
+        batch_op.drop_index('ix_lectura_caso_matricula_fecha')
+        batch_op.drop_constraint('fk_lectura_ID_Caso_Casos', type_='foreignkey')
+        batch_op.drop_column('ID_Caso')
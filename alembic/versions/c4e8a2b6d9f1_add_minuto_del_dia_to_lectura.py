@@ -0,0 +1,43 @@
+"""add Minuto_del_Dia to lectura
+
+Revision ID: c4e8a2b6d9f1
+Revises: b7d2e4f8a1c3
+Create Date: 2026-10-17 13:20:44.918302
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e8a2b6d9f1'
+down_revision: Union[str, None] = 'b7d2e4f8a1c3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('lectura', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('Minuto_del_Dia', sa.Integer(), nullable=True))
+
+    # hora*60 + minuto a partir del texto ISO de Fecha_y_Hora
+    op.execute(
+        'UPDATE lectura SET "Minuto_del_Dia" = '
+        'CAST(strftime(\'%H\', "Fecha_y_Hora") AS INTEGER) * 60 + CAST(strftime(\'%M\', "Fecha_y_Hora") AS INTEGER)'
+    )
+
+    with op.batch_alter_table('lectura', schema=None) as batch_op:
+        batch_op.alter_column('Minuto_del_Dia', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_index('ix_lectura_caso_minuto', ['ID_Caso', 'Minuto_del_Dia'], unique=False)
+        batch_op.create_index('ix_lectura_caso_lector_minuto', ['ID_Caso', 'ID_Lector', 'Minuto_del_Dia'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('lectura', schema=None) as batch_op:
+        batch_op.drop_index('ix_lectura_caso_lector_minuto')
+        batch_op.drop_index('ix_lectura_caso_minuto')
+        batch_op.drop_column('Minuto_del_Dia')
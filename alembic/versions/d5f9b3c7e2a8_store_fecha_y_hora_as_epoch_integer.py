@@ -0,0 +1,64 @@
+"""store lectura.Fecha_y_Hora as integer epoch microseconds
+
+Revision ID: d5f9b3c7e2a8
+Revises: c4e8a2b6d9f1
+Create Date: 2026-10-17 14:02:37.551840
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5f9b3c7e2a8'
+down_revision: Union[str, None] = 'c4e8a2b6d9f1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Índices de 'lectura' que incluyen Fecha_y_Hora: se recrean sobre la nueva columna
+INDICES_FECHA = {
+    'ix_lectura_Fecha_y_Hora': ['Fecha_y_Hora'],
+    'ix_lectura_caso_matricula_fecha': ['ID_Caso', 'Matricula', 'Fecha_y_Hora'],
+    'ix_lectura_caso_lector_fecha': ['ID_Caso', 'ID_Lector', 'Fecha_y_Hora'],
+    'ix_lectura_caso_fecha': ['ID_Caso', 'Fecha_y_Hora'],
+}
+
+
+def _cambiar_columna_fecha(tipo_nuevo, expresion) -> None:
+    with op.batch_alter_table('lectura', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('Fecha_y_Hora_nueva', tipo_nuevo, nullable=True))
+
+    op.execute(f'UPDATE lectura SET "Fecha_y_Hora_nueva" = {expresion}')
+
+    with op.batch_alter_table('lectura', schema=None) as batch_op:
+        for nombre in INDICES_FECHA:
+            batch_op.drop_index(nombre)
+        batch_op.drop_column('Fecha_y_Hora')
+        batch_op.alter_column('Fecha_y_Hora_nueva', new_column_name='Fecha_y_Hora', existing_type=tipo_nuevo, nullable=False)
+
+    with op.batch_alter_table('lectura', schema=None) as batch_op:
+        for nombre, columnas in INDICES_FECHA.items():
+            batch_op.create_index(nombre, columnas, unique=False)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Texto ISO 'YYYY-MM-DD HH:MM:SS[.ffffff]' -> microsegundos desde 1970
+    _cambiar_columna_fecha(
+        sa.BigInteger(),
+        'CAST(strftime(\'%s\', "Fecha_y_Hora") AS INTEGER) * 1000000 + '
+        'CASE WHEN instr("Fecha_y_Hora", \'.\') > 0 '
+        'THEN CAST(substr("Fecha_y_Hora" || \'000000\', instr("Fecha_y_Hora", \'.\') + 1, 6) AS INTEGER) '
+        'ELSE 0 END'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    _cambiar_columna_fecha(
+        sa.DateTime(),
+        'strftime(\'%Y-%m-%d %H:%M:%S\', "Fecha_y_Hora" / 1000000, \'unixepoch\') || '
+        'printf(\'.%06d\', "Fecha_y_Hora" % 1000000)'
+    )
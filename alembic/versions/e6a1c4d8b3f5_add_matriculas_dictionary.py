@@ -0,0 +1,69 @@
+"""add matriculas dictionary and lectura.ID_Matricula
+
+Revision ID: e6a1c4d8b3f5
+Revises: d5f9b3c7e2a8
+Create Date: 2026-10-17 15:11:09.302716
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6a1c4d8b3f5'
+down_revision: Union[str, None] = 'd5f9b3c7e2a8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('matriculas',
+        sa.Column('ID_Matricula', sa.Integer(), nullable=False),
+        sa.Column('Matricula', sa.String(length=20), nullable=False),
+        sa.PrimaryKeyConstraint('ID_Matricula'),
+        sa.UniqueConstraint('Matricula')
+    )
+    op.execute('INSERT INTO matriculas ("Matricula") SELECT DISTINCT "Matricula" FROM lectura')
+
+    with op.batch_alter_table('lectura', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ID_Matricula', sa.Integer(), nullable=True))
+
+    op.execute(
+        'UPDATE lectura SET "ID_Matricula" = ('
+        'SELECT matriculas."ID_Matricula" FROM matriculas WHERE matriculas."Matricula" = lectura."Matricula")'
+    )
+
+    with op.batch_alter_table('lectura', schema=None) as batch_op:
+        batch_op.drop_index('ix_lectura_caso_matricula_fecha')
+        batch_op.drop_index('ix_lectura_Matricula')
+        batch_op.alter_column('ID_Matricula', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('fk_lectura_ID_Matricula_matriculas', 'matriculas', ['ID_Matricula'], ['ID_Matricula'])
+        batch_op.create_index(batch_op.f('ix_lectura_ID_Matricula'), ['ID_Matricula'], unique=False)
+        batch_op.create_index('ix_lectura_caso_matricula_fecha', ['ID_Caso', 'ID_Matricula', 'Fecha_y_Hora'], unique=False)
+        # El texto queda solo en el diccionario
+        batch_op.drop_column('Matricula')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('lectura', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('Matricula', sa.String(length=20), nullable=True))
+
+    op.execute(
+        'UPDATE lectura SET "Matricula" = ('
+        'SELECT matriculas."Matricula" FROM matriculas WHERE matriculas."ID_Matricula" = lectura."ID_Matricula")'
+    )
+
+    with op.batch_alter_table('lectura', schema=None) as batch_op:
+        batch_op.alter_column('Matricula', existing_type=sa.String(length=20), nullable=False)
+        batch_op.drop_index('ix_lectura_caso_matricula_fecha')
+        batch_op.drop_index(batch_op.f('ix_lectura_ID_Matricula'))
+        batch_op.drop_constraint('fk_lectura_ID_Matricula_matriculas', type_='foreignkey')
+        batch_op.drop_column('ID_Matricula')
+        batch_op.create_index('ix_lectura_Matricula', ['Matricula'], unique=False)
+        batch_op.create_index('ix_lectura_caso_matricula_fecha', ['ID_Caso', 'Matricula', 'Fecha_y_Hora'], unique=False)
+
+    op.drop_table('matriculas')
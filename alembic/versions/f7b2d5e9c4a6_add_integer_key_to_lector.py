@@ -0,0 +1,113 @@
+"""add integer surrogate key to lector and lectura.ID_Interno_Lector
+
+Revision ID: f7b2d5e9c4a6
+Revises: e6a1c4d8b3f5
+Create Date: 2026-10-17 16:24:51.640193
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7b2d5e9c4a6'
+down_revision: Union[str, None] = 'e6a1c4d8b3f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Para poder eliminar en modo batch la FK sin nombre lectura.ID_Lector -> lector.ID_Lector
+CONVENCION_NOMBRES = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+
+COLUMNAS_LECTOR = [
+    'ID_Lector', 'Nombre', 'Carretera', 'Provincia', 'Localidad', 'Sentido', 'Orientacion',
+    'Organismo_Regulador', 'Contacto', 'Coordenada_X', 'Coordenada_Y', 'Texto_Libre', 'Imagen_Path',
+]
+
+
+def _columnas_lector() -> list:
+    return [
+        sa.Column('ID_Lector', sa.String(length=50), nullable=False),
+        sa.Column('Nombre', sa.String(length=100), nullable=True),
+        sa.Column('Carretera', sa.String(length=100), nullable=True),
+        sa.Column('Provincia', sa.String(length=50), nullable=True),
+        sa.Column('Localidad', sa.String(length=100), nullable=True),
+        sa.Column('Sentido', sa.String(length=50), nullable=True),
+        sa.Column('Orientacion', sa.String(length=100), nullable=True),
+        sa.Column('Organismo_Regulador', sa.String(length=100), nullable=True),
+        sa.Column('Contacto', sa.String(length=255), nullable=True),
+        sa.Column('Coordenada_X', sa.Float(), nullable=True),
+        sa.Column('Coordenada_Y', sa.Float(), nullable=True),
+        sa.Column('Texto_Libre', sa.Text(), nullable=True),
+        sa.Column('Imagen_Path', sa.String(length=255), nullable=True),
+    ]
+
+
+def _reemplazar_lector(*columnas_extra, orden: str) -> None:
+    """Recrea 'lector' con otra clave primaria copiando las filas en el orden indicado."""
+    op.create_table('lector_nueva', *columnas_extra, *_columnas_lector())
+    lista = ', '.join(f'"{c}"' for c in COLUMNAS_LECTOR)
+    op.execute(f'INSERT INTO lector_nueva ({lista}) SELECT {lista} FROM lector ORDER BY {orden}')
+    op.drop_table('lector')
+    op.rename_table('lector_nueva', 'lector')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Las claves internas siguen el orden de inserción original (rowid)
+    _reemplazar_lector(
+        sa.Column('ID_Interno', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('ID_Interno'),
+        orden='rowid',
+    )
+    with op.batch_alter_table('lector', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_lector_ID_Lector'), ['ID_Lector'], unique=True)
+        batch_op.create_index(batch_op.f('ix_lector_Organismo_Regulador'), ['Organismo_Regulador'], unique=False)
+
+    with op.batch_alter_table('lectura', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ID_Interno_Lector', sa.Integer(), nullable=True))
+
+    op.execute(
+        'UPDATE lectura SET "ID_Interno_Lector" = ('
+        'SELECT lector."ID_Interno" FROM lector WHERE lector."ID_Lector" = lectura."ID_Lector")'
+    )
+
+    with op.batch_alter_table('lectura', schema=None, naming_convention=CONVENCION_NOMBRES) as batch_op:
+        batch_op.drop_index('ix_lectura_caso_lector_minuto')
+        batch_op.drop_index('ix_lectura_caso_lector_fecha')
+        batch_op.drop_index('ix_lectura_ID_Lector')
+        batch_op.drop_constraint('fk_lectura_ID_Lector_lector', type_='foreignkey')
+        batch_op.create_foreign_key('fk_lectura_ID_Interno_Lector_lector', 'lector', ['ID_Interno_Lector'], ['ID_Interno'])
+        batch_op.create_index(batch_op.f('ix_lectura_ID_Interno_Lector'), ['ID_Interno_Lector'], unique=False)
+        batch_op.create_index('ix_lectura_caso_lector_fecha', ['ID_Caso', 'ID_Interno_Lector', 'Fecha_y_Hora'], unique=False)
+        batch_op.create_index('ix_lectura_caso_lector_minuto', ['ID_Caso', 'ID_Interno_Lector', 'Minuto_del_Dia'], unique=False)
+        # El ID_Lector público queda solo en 'lector'
+        batch_op.drop_column('ID_Lector')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('lectura', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ID_Lector', sa.String(length=50), nullable=True))
+
+    op.execute(
+        'UPDATE lectura SET "ID_Lector" = ('
+        'SELECT lector."ID_Lector" FROM lector WHERE lector."ID_Interno" = lectura."ID_Interno_Lector")'
+    )
+
+    with op.batch_alter_table('lectura', schema=None) as batch_op:
+        batch_op.drop_index('ix_lectura_caso_lector_minuto')
+        batch_op.drop_index('ix_lectura_caso_lector_fecha')
+        batch_op.drop_index(batch_op.f('ix_lectura_ID_Interno_Lector'))
+        batch_op.drop_constraint('fk_lectura_ID_Interno_Lector_lector', type_='foreignkey')
+        batch_op.drop_column('ID_Interno_Lector')
+        batch_op.create_foreign_key('fk_lectura_ID_Lector_lector', 'lector', ['ID_Lector'], ['ID_Lector'])
+        batch_op.create_index(batch_op.f('ix_lectura_ID_Lector'), ['ID_Lector'], unique=False)
+        batch_op.create_index('ix_lectura_caso_lector_fecha', ['ID_Caso', 'ID_Lector', 'Fecha_y_Hora'], unique=False)
+        batch_op.create_index('ix_lectura_caso_lector_minuto', ['ID_Caso', 'ID_Lector', 'Minuto_del_Dia'], unique=False)
+
+    _reemplazar_lector(sa.PrimaryKeyConstraint('ID_Lector'), orden='"ID_Interno"')
+    with op.batch_alter_table('lector', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_lector_ID_Lector'), ['ID_Lector'], unique=False)
+        batch_op.create_index(batch_op.f('ix_lector_Organismo_Regulador'), ['Organismo_Regulador'], unique=False)
@@ -0,0 +1,199 @@
+"""
+Caché de resultados de las consultas de lecturas (/lecturas/por_filtros, /casos/{id}/lecturas).
+
+Guarda el cuerpo JSON ya serializado, así que un acierto se ahorra la consulta y la
+serialización. La clave combina el endpoint, los filtros normalizados y las versiones de
+versiones.py de los casos consultados (o la versión total si la consulta abarca todos los
+casos) y de las tablas que aparecen en la respuesta: tras una escritura confirmada las claves
+cambian solas. Además, al incrementarse la versión de un caso se purgan sus entradas para
+liberar memoria.
+
+Nivel en memoria con expulsión LRU por número de entradas y por bytes. Opcionalmente
+(CACHE_LECTURAS_DIR) las entradas expulsadas de memoria, o demasiado grandes para ella, pasan
+a un nivel en disco, también LRU y limitado en bytes.
+"""
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import versiones
+
+logger = logging.getLogger(__name__)
+
+# --- Configuración (variables de entorno) ---
+CACHE_LECTURAS_MB = int(os.getenv("CACHE_LECTURAS_MB", "256"))  # 0 desactiva la caché
+CACHE_LECTURAS_ENTRADAS = int(os.getenv("CACHE_LECTURAS_ENTRADAS", "256"))
+CACHE_LECTURAS_DIR = os.getenv("CACHE_LECTURAS_DIR")  # sin definir: solo memoria
+CACHE_LECTURAS_DISCO_MB = int(os.getenv("CACHE_LECTURAS_DISCO_MB", "2048"))
+
+# Tablas cuyos datos aparecen en las respuestas de lecturas (lector, archivo y caso anidados)
+TABLAS_RESPUESTA = ("lector", "archivosexcel", "casos")
+
+
+def _normalizar(valor):
+    """Listas sin orden ni repeticiones (son conjuntos de filtros); el resto tal cual."""
+    if isinstance(valor, (list, tuple, set)):
+        return sorted({_normalizar(v) for v in valor}, key=repr)
+    return valor
+
+
+def _vacio(valor) -> bool:
+    return valor is None or valor is False or (isinstance(valor, (list, tuple)) and not valor)
+
+
+def clave(endpoint: str, caso_ids: Optional[Iterable[int]], filtros: dict) -> str:
+    """
+    Clave de caché de una consulta. Los filtros vacíos (None, False, listas vacías) se omiten,
+    así que pedir un filtro sin valor y no pedirlo comparten entrada.
+    """
+    filtros = {nombre: _normalizar(valor) for nombre, valor in sorted(filtros.items()) if not _vacio(valor)}
+    if caso_ids:
+        version_datos = [[caso_id, *versiones.version_caso(caso_id)] for caso_id in sorted(set(caso_ids))]
+    else:
+        version_datos = versiones.version_total()
+    version_tablas = [versiones.version_tabla(tabla) for tabla in TABLAS_RESPUESTA]
+    texto = json.dumps([endpoint, filtros, version_datos, version_tablas], sort_keys=True, default=str)
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+class CacheResultados:
+    """Caché LRU de cuerpos de respuesta (bytes) con un nivel opcional en disco."""
+
+    def __init__(self, max_bytes: int, max_entradas: int, directorio: Optional[str] = None, max_bytes_disco: int = 0):
+        self.max_bytes = max_bytes
+        self.max_entradas = max_entradas
+        # Una sola entrada no puede ocupar más de un cuarto de la memoria
+        self.max_bytes_entrada = max_bytes // 4
+        self.max_bytes_disco = max_bytes_disco
+        self.directorio = pathlib.Path(directorio) if directorio and max_bytes_disco > 0 else None
+        self._lock = threading.Lock()
+        # clave -> (contenido, casos); casos None = la consulta abarca todos los casos
+        self._memoria: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        # clave -> (tamaño, casos); el contenido está en <directorio>/<clave>.json
+        self._disco: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes_disco = 0
+        self._estadisticas = {"aciertos": 0, "aciertos_disco": 0, "fallos": 0, "expulsiones": 0, "invalidaciones": 0}
+        if self.directorio is not None:
+            # Las claves de una ejecución anterior no valen: las versiones empiezan de cero
+            shutil.rmtree(self.directorio, ignore_errors=True)
+            self.directorio.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def activa(self) -> bool:
+        return self.max_bytes > 0 and self.max_entradas > 0
+
+    def _ruta(self, clave_cache: str) -> pathlib.Path:
+        return self.directorio / f"{clave_cache}.json"
+
+    def obtener(self, clave_cache: str) -> Optional[bytes]:
+        if not self.activa:
+            return None
+        with self._lock:
+            entrada = self._memoria.get(clave_cache)
+            if entrada is not None:
+                self._memoria.move_to_end(clave_cache)
+                self._estadisticas["aciertos"] += 1
+                return entrada[0]
+            en_disco = self._disco.pop(clave_cache, None)
+            if en_disco is None:
+                self._estadisticas["fallos"] += 1
+                return None
+            self._bytes_disco -= en_disco[0]
+            try:
+                ruta = self._ruta(clave_cache)
+                contenido = ruta.read_bytes()
+                ruta.unlink()
+            except OSError as e:
+                logger.warning(f"No se pudo leer la entrada de caché en disco {clave_cache}: {e}")
+                self._estadisticas["fallos"] += 1
+                return None
+            self._estadisticas["aciertos_disco"] += 1
+            # Vuelve a memoria (o, si no cabe, de nuevo a disco)
+            self._guardar(clave_cache, contenido, en_disco[1])
+            return contenido
+
+    def guardar(self, clave_cache: str, contenido: bytes, caso_ids: Optional[Iterable[int]]) -> None:
+        if not self.activa:
+            return
+        casos = frozenset(caso_ids) if caso_ids else None
+        with self._lock:
+            self._guardar(clave_cache, contenido, casos)
+
+    def _guardar(self, clave_cache: str, contenido: bytes, casos) -> None:
+        self._eliminar(clave_cache)
+        if len(contenido) > self.max_bytes_entrada:
+            self._guardar_en_disco(clave_cache, contenido, casos)
+            return
+        self._memoria[clave_cache] = (contenido, casos)
+        self._bytes += len(contenido)
+        while self._bytes > self.max_bytes or len(self._memoria) > self.max_entradas:
+            clave_lru, (contenido_lru, casos_lru) = self._memoria.popitem(last=False)
+            self._bytes -= len(contenido_lru)
+            self._estadisticas["expulsiones"] += 1
+            self._guardar_en_disco(clave_lru, contenido_lru, casos_lru)
+
+    def _guardar_en_disco(self, clave_cache: str, contenido: bytes, casos) -> None:
+        if self.directorio is None or len(contenido) > self.max_bytes_disco:
+            return
+        try:
+            self._ruta(clave_cache).write_bytes(contenido)
+        except OSError as e:
+            logger.warning(f"No se pudo escribir la entrada de caché en disco {clave_cache}: {e}")
+            return
+        self._disco[clave_cache] = (len(contenido), casos)
+        self._bytes_disco += len(contenido)
+        while self._bytes_disco > self.max_bytes_disco:
+            clave_lru, (tamano, _) = self._disco.popitem(last=False)
+            self._bytes_disco -= tamano
+            self._estadisticas["expulsiones"] += 1
+            self._ruta(clave_lru).unlink(missing_ok=True)
+
+    def _eliminar(self, clave_cache: str) -> None:
+        entrada = self._memoria.pop(clave_cache, None)
+        if entrada is not None:
+            self._bytes -= len(entrada[0])
+        en_disco = self._disco.pop(clave_cache, None)
+        if en_disco is not None:
+            self._bytes_disco -= en_disco[0]
+            self._ruta(clave_cache).unlink(missing_ok=True)
+
+    def invalidar_caso(self, caso_id: Optional[int]) -> None:
+        """Purga las entradas que dependen de 'caso_id' (None = todas las de lecturas)."""
+        with self._lock:
+            afectadas = [
+                clave_cache for nivel in (self._memoria, self._disco)
+                for clave_cache, (_, casos) in nivel.items()
+                if caso_id is None or casos is None or caso_id in casos
+            ]
+            for clave_cache in afectadas:
+                self._eliminar(clave_cache)
+            self._estadisticas["invalidaciones"] += len(afectadas)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            consultas = self._estadisticas["aciertos"] + self._estadisticas["aciertos_disco"] + self._estadisticas["fallos"]
+            return {
+                **self._estadisticas,
+                "tasa_aciertos": round((consultas - self._estadisticas["fallos"]) / consultas, 4) if consultas else None,
+                "entradas": len(self._memoria),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entradas": self.max_entradas,
+                "entradas_disco": len(self._disco),
+                "bytes_disco": self._bytes_disco,
+                "max_bytes_disco": self.max_bytes_disco if self.directorio is not None else 0,
+            }
+
+
+cache = CacheResultados(
+    CACHE_LECTURAS_MB * 1024 * 1024, CACHE_LECTURAS_ENTRADAS,
+    CACHE_LECTURAS_DIR, CACHE_LECTURAS_DISCO_MB * 1024 * 1024,
+)
+versiones.al_cambiar_caso(cache.invalidar_caso)
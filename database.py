@@ -1,4 +1,9 @@
-from sqlalchemy import create_engine
+import functools
+import logging
+import os
+
+import anyio
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -8,11 +13,78 @@ DATABASE_URL = "sqlite:///./tracer.db"
 # Crea la clase base para los modelos
 Base = declarative_base()
 
+logger = logging.getLogger(__name__)
+
+# --- Perfil del motor SQLite (configurable por variables de entorno) ---
+# Se aplica a cada conexión nueva. busy_timeout va primero para que el cambio a WAL
+# espere si otra conexión tiene la base bloqueada.
+PRAGMAS_SQLITE = {
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "30000")),
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),  # WAL: las lecturas no esperan a las importaciones
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),  # seguro en WAL; solo se arriesga la última transacción ante un corte de luz
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),  # negativo = KiB (~64 MB por conexión)
+    "foreign_keys": os.getenv("SQLITE_FOREIGN_KEYS", "ON"),
+}
+
+CONFIG_POOL = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+}
+
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False} # Necesario para SQLite con FastAPI/async
+    connect_args={"check_same_thread": False}, # Necesario para SQLite con FastAPI/async
+    **CONFIG_POOL
 )
 
+
+@event.listens_for(engine, "connect")
+def _aplicar_perfil_sqlite(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for nombre, valor in PRAGMAS_SQLITE.items():
+            try:
+                cursor.execute(f"PRAGMA {nombre} = {valor}")
+            except Exception as e:
+                logger.warning(f"No se pudo aplicar PRAGMA {nombre}={valor}: {e}")
+    finally:
+        cursor.close()
+
+
+def pragmas_efectivos(conexion) -> dict:
+    """Valores de PRAGMAS_SQLITE vigentes en una conexión (para diagnóstico)."""
+    return {nombre: conexion.exec_driver_sql(f"PRAGMA {nombre}").scalar() for nombre in PRAGMAS_SQLITE}
+
+
+def estado_pool() -> dict:
+    return {**CONFIG_POOL, "checked_out": engine.pool.checkedout(), "checked_in": engine.pool.checkedin()}
+
+# --- Acceso a la base de datos desde endpoints async ---
+# La sesión es síncrona: un endpoint async que la usa directamente bloquea el bucle de eventos
+# mientras dura la consulta. en_hilo_bd ejecuta ese trabajo en el pool de hilos con un límite
+# propio (por defecto, tantos hilos como conexiones admite el pool), así que una consulta
+# pesada no congela al resto y los hilos no se quedan esperando conexión.
+HILOS_BD_ASYNC = int(os.getenv("DB_HILOS_ASYNC", str(CONFIG_POOL["pool_size"] + CONFIG_POOL["max_overflow"])))
+_limitador_bd = None
+
+
+async def en_hilo_bd(funcion, *args, **kwargs):
+    """Ejecuta funcion(*args, **kwargs) en un hilo, con como mucho HILOS_BD_ASYNC a la vez."""
+    global _limitador_bd
+    if _limitador_bd is None:
+        # Se crea dentro del bucle de eventos, en la primera llamada
+        _limitador_bd = anyio.CapacityLimiter(HILOS_BD_ASYNC)
+    return await anyio.to_thread.run_sync(functools.partial(funcion, *args, **kwargs), limiter=_limitador_bd)
+
+
+def estado_hilos_bd() -> dict:
+    if _limitador_bd is None:
+        return {"max": HILOS_BD_ASYNC, "en_uso": 0, "en_espera": 0}
+    estadisticas = _limitador_bd.statistics()
+    return {"max": HILOS_BD_ASYNC, "en_uso": estadisticas.borrowed_tokens, "en_espera": estadisticas.tasks_waiting}
+
 # Crea una fábrica de sesiones
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -0,0 +1,159 @@
+"""
+Servicio del frontend compilado (dist/) desde el backend.
+
+Los archivos de dist/assets llevan un hash de contenido en el nombre, así que se sirven con
+caché inmutable de un año; index.html se revalida en cada carga. Para los archivos de texto se
+generan una vez variantes .br (si está instalado brotli) y .gz con la compresión máxima, que se
+envían tal cual según Accept-Encoding en lugar de comprimir en cada petición.
+"""
+import gzip
+import logging
+import mimetypes
+import os
+import pathlib
+import shutil
+import sys
+from typing import Optional
+
+from fastapi import FastAPI
+from fastapi.responses import FileResponse
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+try:  # Opcional: variantes brotli; sin él solo se generan y sirven las .gz
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Extensiones que merece la pena comprimir (las imágenes y fuentes ya van comprimidas)
+EXTENSIONES_COMPRIMIBLES = {".js", ".mjs", ".css", ".html", ".svg", ".json", ".map", ".txt"}
+# Por debajo de este tamaño la variante comprimida no compensa
+TAMANO_MINIMO_PRECOMPRESION = 1024
+
+CACHE_INMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDAR = "no-cache"
+
+# Codificación -> extensión de la variante, por orden de preferencia
+VARIANTES = [("br", ".br"), ("gzip", ".gz")]
+
+
+def _comprimir_brotli(origen: pathlib.Path, destino: pathlib.Path) -> None:
+    destino.write_bytes(brotli.compress(origen.read_bytes(), quality=11))
+
+
+def _comprimir_gzip(origen: pathlib.Path, destino: pathlib.Path) -> None:
+    # mtime=0 para que la variante sea reproducible entre compilaciones
+    with open(origen, "rb") as entrada, open(destino, "wb") as salida:
+        with gzip.GzipFile(filename="", mode="wb", fileobj=salida, compresslevel=9, mtime=0) as comprimido:
+            shutil.copyfileobj(entrada, comprimido)
+
+
+def precomprimir(directorio: pathlib.Path) -> int:
+    """
+    Genera las variantes .br/.gz de los archivos comprimibles de 'directorio' (recursivo).
+    Las que ya existen y son más recientes que el original no se regeneran.
+    Devuelve el número de variantes escritas.
+    """
+    compresores = [(".gz", _comprimir_gzip)]
+    if brotli is not None:
+        compresores.insert(0, (".br", _comprimir_brotli))
+    escritas = 0
+    for origen in pathlib.Path(directorio).rglob("*"):
+        if not origen.is_file() or origen.suffix not in EXTENSIONES_COMPRIMIBLES:
+            continue
+        estado = origen.stat()
+        if estado.st_size < TAMANO_MINIMO_PRECOMPRESION:
+            continue
+        for extension, comprimir in compresores:
+            destino = origen.with_name(origen.name + extension)
+            if destino.exists() and destino.stat().st_mtime >= estado.st_mtime:
+                continue
+            temporal = destino.with_name(destino.name + ".tmp")
+            comprimir(origen, temporal)
+            os.replace(temporal, destino)
+            escritas += 1
+    return escritas
+
+
+def _codificaciones_aceptadas(headers: Headers) -> set:
+    aceptadas = set()
+    for parte in headers.get("accept-encoding", "").split(","):
+        nombre, _, parametros = parte.strip().partition(";")
+        if parametros.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        aceptadas.add(nombre.strip().lower())
+    return aceptadas
+
+
+class ArchivosPrecomprimidos(StaticFiles):
+    """
+    StaticFiles que envía la variante .br o .gz del archivo pedido si existe y el cliente la
+    acepta, con el Content-Type del original, y añade las cabeceras de caché.
+    """
+
+    def __init__(self, *args, cache_control: str = CACHE_INMUTABLE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = cache_control
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        ruta = pathlib.Path(full_path)
+        cabeceras = {"Cache-Control": self.cache_control}
+        comprimible = ruta.suffix in EXTENSIONES_COMPRIMIBLES
+        if comprimible:
+            cabeceras["Vary"] = "Accept-Encoding"
+            aceptadas = _codificaciones_aceptadas(request_headers)
+            for codificacion, extension in VARIANTES:
+                variante = ruta.with_name(ruta.name + extension)
+                if codificacion not in aceptadas or not variante.is_file():
+                    continue
+                estado_variante = variante.stat()
+                if estado_variante.st_mtime < stat_result.st_mtime:
+                    continue  # Variante desfasada respecto al original
+                cabeceras["Content-Encoding"] = codificacion
+                response = FileResponse(
+                    variante, status_code=status_code, stat_result=estado_variante, headers=cabeceras,
+                    media_type=mimetypes.guess_type(ruta.name)[0] or "application/octet-stream",
+                )
+                break
+            else:
+                response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=cabeceras)
+        else:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=cabeceras)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def montar_frontend(app: FastAPI, directorio: pathlib.Path) -> Optional[pathlib.Path]:
+    """
+    Monta dist/assets en /assets y devuelve la ruta de index.html para que la sirva el
+    endpoint raíz. Si no hay frontend compilado no monta nada y devuelve None.
+    """
+    directorio = pathlib.Path(directorio)
+    index = directorio / "index.html"
+    assets = directorio / "assets"
+    if not index.is_file() or not assets.is_dir():
+        logger.info(f"No hay frontend compilado en {directorio}; no se sirve desde el backend.")
+        return None
+    app.mount("/assets", ArchivosPrecomprimidos(directory=assets), name="assets")
+    logger.info(f"Frontend compilado servido desde {directorio}")
+    return index
+
+
+def respuesta_index(index: pathlib.Path, request_headers: Headers) -> Response:
+    """index.html (o su variante comprimida), siempre revalidado: apunta a los assets con hash."""
+    estaticos = ArchivosPrecomprimidos(directory=index.parent, cache_control=CACHE_REVALIDAR)
+    scope = {"type": "http", "method": "GET", "headers": request_headers.raw}
+    return estaticos.file_response(index, index.stat(), scope)
+
+
+if __name__ == "__main__":
+    # Paso de compilación: python estaticos.py [directorio]  (por defecto dist/ junto a este archivo)
+    logging.basicConfig(level=logging.INFO)
+    destino = pathlib.Path(sys.argv[1]) if len(sys.argv) > 1 else pathlib.Path(__file__).resolve().parent / "dist"
+    logger.info(f"Variantes comprimidas escritas en {destino}: {precomprimir(destino)} (brotli {'sí' if brotli else 'no disponible'})")
@@ -0,0 +1,1057 @@
+"""
+Motor de importación de lecturas (LPR/GPS) a partir de DataFrames de pandas.
+
+Todas las normalizaciones trabajan por columnas (operaciones vectorizadas de
+pandas/NumPy) en lugar de recorrer el DataFrame fila a fila, y los archivos se
+leen y procesan por bloques de tamaño fijo para que la memoria no dependa del
+tamaño del archivo.
+"""
+import csv
+import datetime
+import functools
+import hashlib
+import logging
+import os
+import pathlib
+import pickle
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+try:  # Opcional: solo necesario para importar archivos Parquet
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+from sqlalchemy import event, func, insert, literal, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+import models
+import versiones
+from database import engine
+
+logger = logging.getLogger(__name__)
+
+# Origen de las fechas serie de Excel (número de días desde 1899-12-30)
+EXCEL_ORIGEN = "1899-12-30"
+MICROSEGUNDOS_DIA = 24 * 60 * 60 * 1_000_000
+
+# Formatos aceptados para la hora en texto: "HH:MM", "HH:MM:SS", "HH:MM:SS.sss" o "HH:MM:SS,sss"
+PATRON_HORA = r"^(\d{1,2}):(\d{2})(?::(\d{2})(?:[.,](\d{1,6}))?)?$"
+PATRON_NUMERO = r"([-+]?[0-9]*\.?[0-9]+)"
+
+# Tamaño de lectura al copiar la subida a disco (y calcular su hash)
+TAMANO_BLOQUE_COPIA = 1024 * 1024
+
+# Filas por bloque al leer el archivo (la memoria de la importación es proporcional a este valor)
+TAMANO_BLOQUE_LECTURA = 50_000
+
+# Vista previa: filas por defecto y cabeceras recordadas por hash de contenido
+FILAS_VISTA_PREVIA = 20
+# Bytes del principio de un CSV con los que la vista previa estima su número de filas
+TAMANO_MUESTRA_CSV = 1024 * 1024
+MAX_CABECERAS_EN_CACHE = 256
+
+# Firmas (primeros bytes) para reconocer el formato por el contenido y no por la extensión
+FIRMAS_FORMATO = [
+    (b"PK\x03\x04", "xlsx"),                          # contenedor ZIP de Office Open XML
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "xls"),   # OLE2 (Excel 97-2003)
+    (b"PAR1", "parquet"),
+]
+
+# Clave que identifica una lectura repetida dentro de un caso
+CLAVE_DUPLICADO = ["Matricula", "Fecha_y_Hora", "ID_Lector"]
+
+# Inserción masiva: tamaño de cada executemany. Los índices de 'lectura' se eliminan durante
+# la carga y se reconstruyen al final solo si la carga es grande en términos absolutos y
+# respecto a la tabla: la reconstrucción recorre toda la tabla con el bloqueo de escritura
+# tomado y, mientras dura, las consultas se quedan sin esos índices
+TAMANO_LOTE_INSERCION = 20_000
+UMBRAL_INDICES_DIFERIDOS = 500_000
+PROPORCION_INDICES_DIFERIDOS = 1.0  # filas a insertar / filas ya existentes
+INDICE_DEDUPLICACION = "ix_lectura_caso_fecha"  # no se difiere: lo consulta cada bloque
+
+# PRAGMAs de SQLite aplicados solo mientras dura una importación ('synchronous' y el resto
+# del perfil de conexión están en database.PRAGMAS_SQLITE)
+PRAGMAS_IMPORTACION = {
+    "cache_size": -262144,  # ~256 MB de caché de páginas
+    "temp_store": "MEMORY",
+}
+
+COLUMNAS_OBLIGATORIAS = {
+    "LPR": ["Matricula", "Fecha", "Hora", "ID_Lector"],
+    "GPS": ["Matricula", "Fecha", "Hora"],
+}
+
+COLUMNAS_LECTURA = [
+    "Matricula", "Fecha_y_Hora", "Carril", "Velocidad",
+    "ID_Lector", "Coordenada_X", "Coordenada_Y",
+]
+# Las que se copian tal cual a 'lectura': matrícula y lector se guardan como ID_Matricula e ID_Interno_Lector
+COLUMNAS_INSERCION = [c for c in COLUMNAS_LECTURA if c not in ("Matricula", "ID_Lector")]
+
+
+# --- Helpers de tipos ---
+def _tipos_por_valor(serie: pd.Series) -> pd.Series:
+    """Clasifica cada valor de una columna 'object' como num, str, datetime, date, time u otro."""
+    tipos = serie.map(type)
+    clases = {}
+    for tipo in tipos.unique():
+        if issubclass(tipo, bool):
+            clases[tipo] = "otro"
+        elif issubclass(tipo, (int, float, np.integer, np.floating)):
+            clases[tipo] = "num"
+        elif issubclass(tipo, str):
+            clases[tipo] = "str"
+        elif issubclass(tipo, datetime.datetime):
+            clases[tipo] = "datetime"
+        elif issubclass(tipo, datetime.date):
+            clases[tipo] = "date"
+        elif issubclass(tipo, datetime.time):
+            clases[tipo] = "time"
+        else:
+            clases[tipo] = "otro"
+    return tipos.map(clases)
+
+
+def _por_valores_unicos(conversion):
+    """
+    Aplica la conversión solo sobre los valores distintos de la columna y expande el resultado.
+    Las exportaciones LPR repiten mucho fechas, horas, lectores o velocidades, así que el trabajo
+    de texto/regex se reduce a unos pocos miles de valores en lugar de millones.
+    """
+    @functools.wraps(conversion)
+    def envoltura(serie: pd.Series) -> pd.Series:
+        codigos, unicos = pd.factorize(serie)
+        if len(unicos) * 2 > len(serie):
+            return conversion(serie)
+        convertidos = conversion(pd.Series(unicos)).reset_index(drop=True)
+        # Los nulos tienen código -1, que no existe en el índice y queda como NA
+        return convertidos.reindex(codigos).set_axis(serie.index)
+    return envoltura
+
+
+def _es_numerica(serie: pd.Series) -> bool:
+    return pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie)
+
+
+def _a_float(serie: pd.Series) -> pd.Series:
+    """Convierte a float64 de NumPy (NaN para nulos), también desde tipos nullable (Int64/Float64)."""
+    valores = pd.to_numeric(serie, errors="coerce")
+    return pd.Series(valores.to_numpy(dtype="float64", na_value=np.nan), index=serie.index)
+
+
+@_por_valores_unicos
+def _texto(serie: pd.Series) -> pd.Series:
+    """Convierte a texto recortado conservando los nulos."""
+    return serie.astype("string").str.strip()
+
+
+# --- Hora ---
+def _micro_desde_datetime(serie: pd.Series) -> pd.Series:
+    serie = pd.to_datetime(serie, errors="coerce")
+    return (serie - serie.dt.normalize()) // pd.Timedelta(microseconds=1)
+
+
+def _micro_desde_fraccion_dia(serie: pd.Series) -> pd.Series:
+    # Excel guarda las horas como fracción de día; se trunca al segundo como hacía el importador original
+    return np.floor(_a_float(serie) * 86400) * 1_000_000
+
+
+@_por_valores_unicos
+def _micro_desde_texto(serie: pd.Series) -> pd.Series:
+    partes = _texto(serie).str.extract(PATRON_HORA)
+    h = _a_float(partes[0])
+    m = _a_float(partes[1])
+    s = _a_float(partes[2]).fillna(0)
+    fraccion = _a_float("0." + partes[3].fillna("0")).fillna(0)
+    validos = (h < 24) & (m < 60) & (s < 60)
+    micro = ((h * 60 + m) * 60 + s) * 1_000_000 + np.floor(fraccion * 1_000_000)
+    return micro.where(validos)
+
+
+@_por_valores_unicos
+def _micro_desde_time(serie: pd.Series) -> pd.Series:
+    # Objetos datetime.time de Python (openpyxl): no hay conversión vectorizada posible,
+    # np.fromiter es bastante más rápido que pasar por texto y to_timedelta
+    valores = np.fromiter(
+        (((t.hour * 60 + t.minute) * 60 + t.second) * 1_000_000 + t.microsecond for t in serie.tolist()),
+        dtype="float64", count=len(serie)
+    )
+    return pd.Series(valores, index=serie.index)
+
+
+def microsegundos_hora(serie: pd.Series) -> pd.Series:
+    """
+    Normaliza la columna Hora a microsegundos desde medianoche.
+    Acepta objetos time/datetime, fracciones de día de Excel y texto "HH:MM[:SS[.ffffff]]".
+    Los valores no reconocidos quedan como NaN.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        micro = _micro_desde_datetime(serie)
+    elif _es_numerica(serie):
+        micro = _micro_desde_fraccion_dia(serie)
+    else:
+        micro = pd.Series(np.nan, index=serie.index, dtype="float64")
+        clases = _tipos_por_valor(serie)
+        convertidores = {
+            "time": _micro_desde_time,
+            "datetime": _micro_desde_datetime,
+            "num": _micro_desde_fraccion_dia,
+            "str": _micro_desde_texto,
+        }
+        for clase, convertir in convertidores.items():
+            mascara = clases == clase
+            if mascara.any():
+                micro[mascara] = _a_float(convertir(serie[mascara]))
+    micro = _a_float(micro)
+    return micro.where((micro >= 0) & (micro < MICROSEGUNDOS_DIA))
+
+
+# --- Fecha ---
+def _fecha_desde_serie_excel(serie: pd.Series) -> pd.Series:
+    return pd.to_datetime(_a_float(serie), unit="D", origin=EXCEL_ORIGEN, errors="coerce").dt.normalize()
+
+
+@_por_valores_unicos
+def _fecha_desde_texto(serie: pd.Series) -> pd.Series:
+    texto = _texto(serie)
+    # Primer intento con formato inferido (rápido); los restos se parsean valor a valor.
+    # Mismo orden que el importador original (pd.to_datetime sin dayfirst: 01/02/2024 es 2 de enero),
+    # para que las fechas ambiguas coincidan con las ya guardadas
+    fechas = pd.to_datetime(texto, errors="coerce")
+    pendientes = fechas.isna() & texto.notna() & (texto != "")
+    if pendientes.any():
+        try:
+            fechas[pendientes] = pd.to_datetime(texto[pendientes], errors="coerce", format="mixed")
+        except (TypeError, ValueError):
+            fechas[pendientes] = texto[pendientes].map(lambda v: pd.to_datetime(v, errors="coerce"))
+    return fechas.dt.normalize()
+
+
+def fechas_normalizadas(serie: pd.Series) -> pd.Series:
+    """
+    Normaliza la columna Fecha a datetime64 a medianoche.
+    Acepta datetime/date, números de serie de Excel y texto; los no reconocidos quedan como NaT.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.dt.tz_localize(None).dt.normalize() if serie.dt.tz is not None else serie.dt.normalize()
+    if _es_numerica(serie):
+        return _fecha_desde_serie_excel(serie)
+    fechas = pd.Series(pd.NaT, index=serie.index, dtype="datetime64[ns]")
+    clases = _tipos_por_valor(serie)
+    mascara = clases.isin(["datetime", "date"])
+    if mascara.any():
+        fechas[mascara] = pd.to_datetime(serie[mascara], errors="coerce").dt.normalize()
+    mascara = clases == "num"
+    if mascara.any():
+        fechas[mascara] = _fecha_desde_serie_excel(serie[mascara])
+    mascara = clases.isin(["str", "otro"])
+    if mascara.any():
+        fechas[mascara] = _fecha_desde_texto(serie[mascara])
+    return fechas
+
+
+# --- Numéricos y texto opcionales ---
+def floats_opcionales(serie: pd.Series) -> pd.Series:
+    """Equivalente vectorizado de get_optional_float: extrae el primer número de los textos."""
+    if _es_numerica(serie):
+        return _a_float(serie)
+    textos = _tipos_por_valor(serie) == "str"
+    resultado = _a_float(serie.where(~textos))
+    if textos.any():
+        resultado[textos] = _numero_en_texto(serie[textos])
+    return resultado
+
+
+@_por_valores_unicos
+def _numero_en_texto(serie: pd.Series) -> pd.Series:
+    # Los textos que ya son números se convierten directamente; la regex solo para el resto
+    numeros = _a_float(serie)
+    pendientes = numeros.isna() & serie.notna()
+    if pendientes.any():
+        numeros[pendientes] = _a_float(serie[pendientes].astype("string").str.extract(PATRON_NUMERO, expand=False))
+    return numeros
+
+
+def textos_opcionales(serie: pd.Series) -> pd.Series:
+    """Equivalente vectorizado de get_optional_str (texto recortado o None)."""
+    return _texto(serie).astype(object).where(serie.notna(), None)
+
+
+def _columna(df: pd.DataFrame, nombre: str) -> pd.Series:
+    if nombre in df.columns:
+        return df[nombre]
+    return pd.Series(np.nan, index=df.index, dtype="float64")
+
+
+# --- Archivo subido: copia a disco y detección de contenido repetido ---
+def guardar_con_hash(origen, destino) -> str:
+    """Copia el archivo subido a 'destino' calculando su SHA-256 en la misma pasada."""
+    sha256 = hashlib.sha256()
+    with open(destino, "wb") as buffer:
+        for bloque in iter(lambda: origen.read(TAMANO_BLOQUE_COPIA), b""):
+            sha256.update(bloque)
+            buffer.write(bloque)
+    return sha256.hexdigest()
+
+
+def buscar_archivo_identico(db: Session, hash_contenido: str, caso_id: Optional[int] = None) -> Optional[models.ArchivoExcel]:
+    """ArchivoExcel ya importado con el mismo contenido; si se indica caso, se prefiere uno de ese caso."""
+    consulta = db.query(models.ArchivoExcel).filter(models.ArchivoExcel.Hash_Contenido == hash_contenido)
+    if caso_id is not None:
+        mismo_caso = consulta.filter(models.ArchivoExcel.ID_Caso == caso_id).first()
+        if mismo_caso is not None:
+            return mismo_caso
+    return consulta.order_by(models.ArchivoExcel.ID_Archivo).first()
+
+
+def vincular_lecturas(db: Session, id_archivo_origen: int, db_archivo: models.ArchivoExcel) -> int:
+    """
+    Copia en 'db_archivo' las lecturas de otro archivo con el mismo contenido con un único
+    INSERT ... SELECT, sin volver a leer el archivo. Se omiten las que ya existen en el caso
+    destino con el mismo criterio que separar_duplicados. Devuelve el número de lecturas copiadas.
+    """
+    lectura = models.Lectura.__table__
+    previa = lectura.alias("previa")
+    columnas = [c.name for c in lectura.columns if c.name not in ("ID_Lectura", "ID_Archivo", "ID_Caso")]
+    ya_en_caso = select(previa.c.ID_Lectura)\
+        .where(
+            previa.c.ID_Caso == db_archivo.ID_Caso,
+            previa.c.ID_Matricula == lectura.c.ID_Matricula,
+            previa.c.Fecha_y_Hora == lectura.c.Fecha_y_Hora,
+            previa.c.ID_Interno_Lector == lectura.c.ID_Interno_Lector
+        ).exists()
+    seleccion = select(
+        literal(db_archivo.ID_Archivo), literal(db_archivo.ID_Caso), *[lectura.c[nombre] for nombre in columnas]
+    ).where(lectura.c.ID_Archivo == id_archivo_origen, ~ya_en_caso)
+    # El INSERT ... SELECT no lleva ID_Caso en los parámetros: se indica para las versiones del caso
+    versiones.asignar_caso(db, db_archivo.ID_Caso)
+    resultado = db.execute(insert(lectura).from_select(["ID_Archivo", "ID_Caso", *columnas], seleccion))
+    return resultado.rowcount
+
+
+# --- Lectura por bloques ---
+def _nombres_columnas(cabecera: Iterable) -> List[str]:
+    """Nombres de columna con el mismo criterio que pandas ('Unnamed: i', sufijo '.n' en repetidas)."""
+    nombres = []
+    vistos = {}
+    for posicion, valor in enumerate(cabecera):
+        nombre = f"Unnamed: {posicion}" if valor is None or str(valor).strip() == "" else str(valor)
+        if nombre in vistos:
+            vistos[nombre] += 1
+            nombre = f"{nombre}.{vistos[nombre]}"
+        else:
+            vistos[nombre] = 0
+        nombres.append(nombre)
+    return nombres
+
+
+def _bloques_xlsx(libro, tamano_bloque: int) -> Iterator[pd.DataFrame]:
+    try:
+        filas = libro.active.iter_rows(values_only=True)
+        cabecera = next(filas, None)
+        columnas = _nombres_columnas(cabecera or [])
+        ancho = len(columnas)
+        datos, posiciones = [], []
+        emitido = False
+        for posicion, fila in enumerate(filas):
+            # Igual que read_excel: las filas completamente vacías se ignoran
+            if all(valor is None for valor in fila):
+                continue
+            fila = tuple(fila[:ancho])
+            datos.append(fila + (None,) * (ancho - len(fila)))
+            posiciones.append(posicion)
+            if len(datos) >= tamano_bloque:
+                yield pd.DataFrame(datos, columns=columnas, index=posiciones)
+                emitido = True
+                datos, posiciones = [], []
+        if datos or not emitido:
+            yield pd.DataFrame(datos, columns=columnas, index=pd.Index(posiciones, dtype="int64"))
+    finally:
+        libro.close()
+
+
+def _codificacion_texto(ruta: pathlib.Path) -> str:
+    with open(ruta, "rb") as f:
+        muestra = f.read(64 * 1024)
+    try:
+        muestra.decode("utf-8-sig")
+        return "utf-8-sig"
+    except UnicodeDecodeError as e:
+        # Un carácter multibyte cortado al final de la muestra no invalida UTF-8
+        if e.start >= len(muestra) - 3:
+            return "utf-8-sig"
+        return "latin-1"
+
+
+def _contar_filas_csv(ruta: pathlib.Path, codificacion: str, separador: str) -> int:
+    """Filas de datos exactas: csv.reader respeta los saltos de línea dentro de campos entre comillas."""
+    with open(ruta, "r", encoding=codificacion, errors="replace", newline="") as f:
+        # Las líneas en blanco no son filas (read_csv las omite)
+        return max(sum(1 for fila in csv.reader(f, delimiter=separador) if fila) - 1, 0)
+
+
+def _estimar_filas_csv(ruta: pathlib.Path, codificacion: str, separador: str) -> int:
+    """Filas de datos estimadas con el tamaño del archivo y la longitud media de las primeras líneas."""
+    tamano = ruta.stat().st_size
+    with open(ruta, "rb") as f:
+        muestra = f.read(TAMANO_MUESTRA_CSV)
+    lineas = muestra.count(b"\n")
+    if len(muestra) >= tamano or not lineas:
+        # El archivo entero cabe en la muestra (o es una sola línea): se cuenta sin coste
+        return _contar_filas_csv(ruta, codificacion, separador)
+    return max(round(tamano * lineas / len(muestra)) - 1, 0)
+
+
+def _bloques_csv(ruta: pathlib.Path, tamano_bloque: int, contar_filas: bool = True) -> Tuple[Iterator[pd.DataFrame], int]:
+    codificacion = _codificacion_texto(ruta)
+    with open(ruta, "r", encoding=codificacion, newline="") as f:
+        primera_linea = f.readline()
+    try:
+        separador = csv.Sniffer().sniff(primera_linea, delimiters=";,\t|").delimiter
+    except csv.Error:
+        separador = ","
+    contar = _contar_filas_csv if contar_filas else _estimar_filas_csv
+    filas = contar(ruta, codificacion, separador)
+    # dtype=str: fechas, horas y números se interpretan después igual que los textos de Excel
+    lector = pd.read_csv(
+        ruta, sep=separador, encoding=codificacion, dtype=str, engine="c",
+        skipinitialspace=True, chunksize=tamano_bloque
+    )
+    return lector, filas
+
+
+def _bloques_parquet(ruta: pathlib.Path, tamano_bloque: int) -> Tuple[Iterator[pd.DataFrame], int]:
+    if pq is None:
+        raise ValueError("Para importar archivos Parquet es necesario instalar 'pyarrow'.")
+    archivo = pq.ParquetFile(ruta)
+
+    def bloques():
+        inicio = 0
+        for lote in archivo.iter_batches(batch_size=tamano_bloque):
+            df = lote.to_pandas()
+            df.index = pd.RangeIndex(inicio, inicio + len(df))
+            inicio += len(df)
+            yield df
+        if inicio == 0:
+            yield archivo.schema_arrow.empty_table().to_pandas()
+    return bloques(), archivo.metadata.num_rows
+
+
+def detectar_formato(ruta) -> str:
+    """Devuelve 'xlsx', 'xls', 'parquet' o 'csv' según los primeros bytes del archivo."""
+    with open(ruta, "rb") as f:
+        cabecera = f.read(8)
+    for firma, formato in FIRMAS_FORMATO:
+        if cabecera.startswith(firma):
+            return formato
+    return "csv"
+
+
+def abrir_bloques(ruta, tamano_bloque: int = TAMANO_BLOQUE_LECTURA, formato: Optional[str] = None,
+                  contar_filas: bool = True) -> Tuple[Iterator[pd.DataFrame], Optional[int]]:
+    """
+    Abre un archivo de lecturas y devuelve (bloques, filas_estimadas).
+
+    El formato se detecta por el contenido (ver detectar_formato). Los bloques son DataFrames
+    con las columnas de la cabecera y como índice la posición 0-based de cada fila de datos en
+    el archivo. Los .xlsx se recorren con openpyxl en modo solo lectura, los CSV con el motor C
+    de read_csv(chunksize=...) y los Parquet por row groups con pyarrow, de modo que la memoria
+    depende del tamaño de bloque y no del archivo. Los .xls (sin lector incremental) se leen
+    completos. Siempre se emite al menos un bloque, aunque sea vacío, para conocer las columnas.
+    'formato' permite saltar la detección cuando ya se conoce (p.ej. desde la vista previa).
+    En CSV, contar_filas=False estima las filas a partir de las primeras líneas en lugar de
+    recorrer todo el archivo para contarlas (el resto de formatos las leen de sus metadatos).
+    """
+    ruta = pathlib.Path(ruta)
+    formato = formato or detectar_formato(ruta)
+    if formato == "xlsx":
+        libro = openpyxl.load_workbook(ruta, read_only=True, data_only=True)
+        hoja = libro.active
+        filas_estimadas = max(hoja.max_row - 1, 0) if hoja.max_row else None
+        return _bloques_xlsx(libro, tamano_bloque), filas_estimadas
+    if formato == "parquet":
+        return _bloques_parquet(ruta, tamano_bloque)
+    if formato == "csv":
+        return _bloques_csv(ruta, tamano_bloque, contar_filas)
+
+    df = pd.read_excel(ruta)
+    df.index = pd.RangeIndex(len(df))
+
+    def trocear():
+        yield df.iloc[:tamano_bloque]
+        for inicio in range(tamano_bloque, len(df), tamano_bloque):
+            yield df.iloc[inicio:inicio + tamano_bloque]
+    return trocear(), len(df)
+
+
+def bloques_diferidos(ruta, tamano_bloque: int = TAMANO_BLOQUE_LECTURA, formato: Optional[str] = None) -> Iterator[pd.DataFrame]:
+    """Los bloques de abrir_bloques, sin abrir el archivo hasta pedir el primero (en el hilo que los consume)."""
+    bloques, _ = abrir_bloques(ruta, tamano_bloque, formato)
+    yield from bloques
+
+
+# --- Vista previa y caché de cabeceras ---
+@dataclass
+class CabeceraArchivo:
+    formato: str
+    columnas: List[str]
+    filas_estimadas: Optional[int]  # en CSV, estimada (ver abrir_bloques)
+
+
+_cabeceras: "OrderedDict[str, CabeceraArchivo]" = OrderedDict()
+_cabeceras_lock = threading.Lock()
+
+
+def guardar_cabecera(hash_contenido: str, cabecera: CabeceraArchivo) -> None:
+    with _cabeceras_lock:
+        _cabeceras[hash_contenido] = cabecera
+        _cabeceras.move_to_end(hash_contenido)
+        while len(_cabeceras) > MAX_CABECERAS_EN_CACHE:
+            _cabeceras.popitem(last=False)
+
+
+def cabecera_en_cache(hash_contenido: str) -> Optional[CabeceraArchivo]:
+    """Cabecera leída en una vista previa del mismo contenido, si sigue en la caché."""
+    with _cabeceras_lock:
+        cabecera = _cabeceras.get(hash_contenido)
+        if cabecera is not None:
+            _cabeceras.move_to_end(hash_contenido)
+        return cabecera
+
+
+def inferir_tipos(df: pd.DataFrame) -> Dict[str, str]:
+    """Tipo predominante de cada columna: numero, texto, fecha_hora, fecha, hora, vacio o mixto."""
+    nombres = {"num": "numero", "str": "texto", "datetime": "fecha_hora", "date": "fecha", "time": "hora"}
+    tipos = {}
+    for columna in df.columns:
+        serie = df[columna].dropna()
+        if serie.empty:
+            tipos[columna] = "vacio"
+        elif pd.api.types.is_datetime64_any_dtype(serie):
+            tipos[columna] = "fecha_hora"
+        elif _es_numerica(serie):
+            tipos[columna] = "numero"
+        else:
+            clases = _tipos_por_valor(serie).value_counts()
+            tipos[columna] = nombres.get(clases.index[0], "mixto") if len(clases) == 1 else "mixto"
+    return tipos
+
+
+def vista_previa(ruta, hash_contenido: str, tipo_archivo: str, map_cliente_a_interno: Optional[dict] = None,
+                 filas: int = FILAS_VISTA_PREVIA) -> dict:
+    """
+    Lee solo la cabecera y las primeras 'filas' filas (en streaming, salvo .xls) y, si se
+    indica un mapeo, las normaliza como lo haría la importación. La cabecera queda en caché
+    por hash para que la importación del mismo archivo pueda validar el mapeo sin abrirlo.
+    """
+    formato = detectar_formato(ruta)
+    # Solo una estimación de las filas: contar un CSV exige leerlo entero (lo hace la importación)
+    bloques, filas_estimadas = abrir_bloques(ruta, tamano_bloque=filas, formato=formato, contar_filas=False)
+    try:
+        muestra = next(bloques)
+    finally:
+        cerrar = getattr(bloques, "close", None)
+        if cerrar is not None:
+            cerrar()
+    columnas = [str(c) for c in muestra.columns]
+    guardar_cabecera(hash_contenido, CabeceraArchivo(formato, columnas, filas_estimadas))
+
+    vista = {
+        "hash_contenido": hash_contenido,
+        "formato": formato,
+        "columnas": columnas,
+        "tipos": inferir_tipos(muestra),
+        "filas_estimadas": filas_estimadas,
+        "muestra": muestra.astype(object).where(muestra.notna(), None).to_dict("records"),
+    }
+    if map_cliente_a_interno is not None:
+        map_interno_a_cliente = {v: k for k, v in map_cliente_a_interno.items()}
+        mapeada = muestra.rename(columns={k: v for k, v in map_interno_a_cliente.items() if k in muestra.columns})
+        vista["columnas_faltantes"] = columnas_faltantes(mapeada.columns, tipo_archivo, map_cliente_a_interno)
+        if not vista["columnas_faltantes"]:
+            lecturas, errores = normalizar_lecturas(mapeada, tipo_archivo)
+            fechas = [None if pd.isna(v) else v.to_pydatetime() for v in lecturas["Fecha_y_Hora"]]
+            lecturas = lecturas.astype(object).where(lecturas.notna(), None)
+            lecturas["Fecha_y_Hora"] = fechas
+            vista["lecturas"] = lecturas.to_dict("records")
+            vista["errores"] = errores
+    return vista
+
+
+# --- Validación de columnas ---
+def columnas_faltantes(columnas: Iterable[str], tipo_archivo: str, map_cliente_a_interno: dict) -> List[str]:
+    """Campos obligatorios que no están entre las columnas (ya renombradas), descritos para el usuario."""
+    columnas = set(columnas)
+    faltantes = []
+    for campo_interno in COLUMNAS_OBLIGATORIAS.get(tipo_archivo, COLUMNAS_OBLIGATORIAS["GPS"]):
+        if campo_interno not in columnas:
+            col_excel_mapeada = map_cliente_a_interno.get(campo_interno)
+            faltantes.append(f"{campo_interno} (mapeada desde '{col_excel_mapeada}')" if col_excel_mapeada else f"{campo_interno} (no mapeada)")
+    return faltantes
+
+
+# --- Normalización completa ---
+def normalizar_lecturas(df: pd.DataFrame, tipo_archivo: str) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    Normaliza un DataFrame ya renombrado a los campos internos (Matricula, Fecha, Hora, ...).
+    El índice del DataFrame es la posición 0-based de la fila de datos en el archivo.
+
+    Devuelve (lecturas_validas, errores):
+    - lecturas_validas: DataFrame con COLUMNAS_LECTURA y la columna 'Fila' (número de fila 1-based)
+    - errores: mensajes "Fila N: motivo" con el mismo formato que UploadResponse.errores
+    """
+    filas = pd.Series(np.asarray(df.index, dtype="int64") + 1, index=df.index)
+
+    matriculas = _texto(_columna(df, "Matricula"))
+    fechas = fechas_normalizadas(_columna(df, "Fecha"))
+    micro_hora = microsegundos_hora(_columna(df, "Hora"))
+    fecha_y_hora = fechas + pd.to_timedelta(micro_hora, unit="us")
+
+    if tipo_archivo == "LPR":
+        lectores = _texto(_columna(df, "ID_Lector"))
+        falta_lector = lectores.isna() | (lectores == "")
+    else:
+        lectores = pd.Series(None, index=df.index, dtype=object)
+        falta_lector = pd.Series(False, index=df.index)
+
+    # Errores en el mismo orden de prioridad que el importador fila a fila
+    falta_matricula = matriculas.isna() | (matriculas == "")
+    hora_invalida = micro_hora.isna()
+    fecha_invalida = fechas.isna()
+    motivos = pd.Series(None, index=df.index, dtype=object)
+    motivos[falta_lector.to_numpy(dtype=bool)] = "Falta ID_Lector para LPR"
+    if fecha_invalida.any():
+        motivos[fecha_invalida] = "Error combinando/parseando Fecha/Hora: Formato de fecha no reconocido: " + _columna(df, "Fecha")[fecha_invalida].astype(str)
+    if hora_invalida.any():
+        motivos[hora_invalida] = "Error combinando/parseando Fecha/Hora: Formato de hora no reconocido: " + _columna(df, "Hora")[hora_invalida].astype(str)
+    motivos[falta_matricula.to_numpy(dtype=bool)] = "Matrícula vacía"
+
+    con_error = motivos.notna()
+    errores = [
+        f"Fila {fila}: {motivo}"
+        for fila, motivo in zip(filas[con_error].tolist(), motivos[con_error].tolist())
+    ]
+
+    validas = ~con_error
+    lecturas = pd.DataFrame({
+        "Fila": filas[validas],
+        "Matricula": matriculas[validas].astype(object),
+        "Fecha_y_Hora": fecha_y_hora[validas],
+        "Carril": textos_opcionales(_columna(df, "Carril"))[validas],
+        "Velocidad": floats_opcionales(_columna(df, "Velocidad"))[validas],
+        "ID_Lector": lectores[validas].astype(object),
+        "Coordenada_X": floats_opcionales(_columna(df, "Coordenada_X"))[validas],
+        "Coordenada_Y": floats_opcionales(_columna(df, "Coordenada_Y"))[validas],
+    })
+    return lecturas, errores
+
+
+def registros_lectura(lecturas: pd.DataFrame, id_archivo: int, id_caso: int, tipo_archivo: str) -> List[dict]:
+    """
+    Convierte el DataFrame normalizado (con 'ID_Matricula' e 'ID_Interno_Lector' ya resueltos,
+    ver ResolutorMatriculas y ResolutorLectores) en diccionarios listos para insertar en 'lectura'.
+    """
+    columnas = []
+    for nombre in COLUMNAS_INSERCION:
+        if nombre == "Fecha_y_Hora":
+            # Ya en microsegundos desde 1970 (formato de FechaHoraEpoch), sin pasar por datetime de Python
+            columnas.append(lecturas[nombre].astype("datetime64[us]").astype("int64").tolist())
+        else:
+            serie = lecturas[nombre].astype(object)
+            columnas.append(serie.where(serie.notna(), None).tolist())
+    fechas = lecturas["Fecha_y_Hora"].dt
+    columnas.append((fechas.hour * 60 + fechas.minute).tolist())
+    columnas.append(lecturas["ID_Matricula"].tolist())
+    internos = lecturas["ID_Interno_Lector"].astype(object)
+    columnas.append(internos.where(internos.notna(), None).tolist())
+    nombres = COLUMNAS_INSERCION + ["Minuto_del_Dia", "ID_Matricula", "ID_Interno_Lector"]
+    return [
+        dict(zip(nombres, valores), ID_Archivo=id_archivo, ID_Caso=id_caso, Tipo_Fuente=tipo_archivo)
+        for valores in zip(*columnas)
+    ]
+
+
+# --- Detección de duplicados ---
+def claves_existentes(db: Session, caso_id: int, desde: datetime.datetime, hasta: datetime.datetime) -> pd.MultiIndex:
+    """Carga en una sola consulta las claves (Matricula, Fecha_y_Hora, ID_Lector) del caso en el intervalo dado."""
+    # El JOIN con lector descarta las lecturas sin lector
+    filas = db.query(models.Matricula.Matricula, models.Lectura.Fecha_y_Hora, models.Lector.ID_Lector)\
+        .join(models.Matricula, models.Matricula.ID_Matricula == models.Lectura.ID_Matricula)\
+        .join(models.Lector, models.Lector.ID_Interno == models.Lectura.ID_Interno_Lector)\
+        .filter(
+            models.Lectura.ID_Caso == caso_id,
+            models.Lectura.Fecha_y_Hora >= desde,
+            models.Lectura.Fecha_y_Hora <= hasta
+        ).all()
+    if not filas:
+        return pd.MultiIndex.from_arrays([[], pd.DatetimeIndex([]), []], names=CLAVE_DUPLICADO)
+    existentes = pd.DataFrame(filas, columns=CLAVE_DUPLICADO)
+    existentes["Fecha_y_Hora"] = pd.to_datetime(existentes["Fecha_y_Hora"])
+    return pd.MultiIndex.from_frame(existentes)
+
+
+def separar_duplicados(db: Session, caso_id: int, lecturas: pd.DataFrame) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    Separa las lecturas que ya existen en el caso o que se repiten dentro del propio archivo.
+
+    Se hace una única consulta por importación (acotada al rango temporal del archivo) y la
+    comparación se resuelve en memoria con un índice hash. Igual que la comprobación SQL
+    original, las lecturas sin ID_Lector nunca se consideran duplicadas.
+
+    Devuelve (lecturas_nuevas, mensajes) con mensajes "Fila N: Matrícula X - fecha".
+    """
+    if lecturas.empty:
+        return lecturas, []
+    con_lector = lecturas["ID_Lector"].notna()
+    if not con_lector.any():
+        return lecturas, []
+
+    existentes = claves_existentes(
+        db, caso_id,
+        lecturas.loc[con_lector, "Fecha_y_Hora"].min().to_pydatetime(),
+        lecturas.loc[con_lector, "Fecha_y_Hora"].max().to_pydatetime()
+    )
+    claves = pd.MultiIndex.from_frame(lecturas[CLAVE_DUPLICADO])
+    en_bd = pd.Series(claves.isin(existentes), index=lecturas.index)
+    en_archivo = lecturas.duplicated(subset=CLAVE_DUPLICADO, keep="first")
+    duplicadas = (en_bd | en_archivo) & con_lector
+
+    repetidas = lecturas[duplicadas]
+    mensajes = [
+        f"Fila {fila}: Matrícula {matricula} - {fecha_hora}"
+        for fila, matricula, fecha_hora in zip(
+            repetidas["Fila"].tolist(),
+            repetidas["Matricula"].tolist(),
+            list(repetidas["Fecha_y_Hora"].dt.to_pydatetime())
+        )
+    ]
+    return lecturas[~duplicadas], mensajes
+
+
+# --- Inserción masiva ---
+def activar_pragmas_importacion(db: Session) -> None:
+    """
+    Aplica PRAGMAS_IMPORTACION a la conexión de la sesión. Los valores previos se guardan en
+    la conexión y se restauran automáticamente cuando vuelve al pool (ver _restaurar_pragmas).
+    """
+    conexion = db.connection()
+    if conexion.dialect.name != "sqlite":
+        return
+    previos = conexion.info.setdefault("pragmas_previos", {})
+    for nombre, valor in PRAGMAS_IMPORTACION.items():
+        if nombre in previos:
+            continue
+        anterior = conexion.exec_driver_sql(f"PRAGMA {nombre}").scalar()
+        try:
+            conexion.exec_driver_sql(f"PRAGMA {nombre} = {valor}")
+            previos[nombre] = anterior
+        except OperationalError as e:
+            logger.warning(f"No se pudo aplicar PRAGMA {nombre}={valor} para la importación: {e}")
+
+
+@event.listens_for(engine, "checkin")
+def _restaurar_pragmas(dbapi_connection, connection_record):
+    previos = connection_record.info.pop("pragmas_previos", None)
+    if not previos or dbapi_connection is None:
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        for nombre, valor in previos.items():
+            cursor.execute(f"PRAGMA {nombre} = {valor}")
+    except Exception as e:
+        logger.warning(f"No se pudieron restaurar los PRAGMAs tras la importación: {e}")
+    finally:
+        cursor.close()
+
+
+def debe_diferir_indices(db: Session, total_filas: int) -> bool:
+    """
+    Si compensa eliminar y reconstruir los índices de 'lectura' para insertar 'total_filas':
+    solo cuando superan UMBRAL_INDICES_DIFERIDOS y PROPORCION_INDICES_DIFERIDOS veces las
+    filas existentes (estimadas con max(ID_Lectura), que no recorre la tabla).
+    """
+    if total_filas < UMBRAL_INDICES_DIFERIDOS:
+        return False
+    existentes = db.query(func.max(models.Lectura.ID_Lectura)).scalar() or 0
+    diferir = total_filas >= PROPORCION_INDICES_DIFERIDOS * existentes
+    logger.info(f"Carga de ~{total_filas} lecturas sobre ~{existentes} existentes: índices {'diferidos' if diferir else 'mantenidos'}.")
+    return diferir
+
+
+class CargadorLecturas:
+    """
+    Inserta lecturas en lotes con executemany de SQLAlchemy Core dentro de la transacción
+    de la sesión, sin crear objetos ORM. Para cargas muy grandes respecto a la tabla (ver
+    debe_diferir_indices) elimina los índices de 'lectura' al empezar y los reconstruye al salir.
+    El DROP INDEX se hace siempre dentro de una transacción abierta (ver __enter__), así que un
+    rollback los restaura. 'diferir_indices' fuerza la decisión.
+    El índice (ID_Caso, Fecha_y_Hora) se mantiene: lo usa la detección de duplicados de cada bloque.
+
+        with CargadorLecturas(db, total_filas=len(df)) as cargador:
+            cargador.insertar(registros)
+        db.commit()
+    """
+
+    def __init__(self, db: Session, total_filas: int = 0, diferir_indices: Optional[bool] = None):
+        self.db = db
+        self.total = 0
+        es_sqlite = db.get_bind().dialect.name == "sqlite"
+        if diferir_indices is None:
+            diferir_indices = es_sqlite and debe_diferir_indices(db, total_filas)
+        self.diferir_indices = diferir_indices and es_sqlite
+        self._indices = [
+            indice for indice in models.Lectura.__table__.indexes
+            if indice.name != INDICE_DEDUPLICACION
+        ]
+        self._sentencia = insert(models.Lectura.__table__)
+
+    def _conexion_en_transaccion(self):
+        # pysqlite solo abre la transacción antes de un INSERT/UPDATE/DELETE: un DROP INDEX en una
+        # sesión sin escrituras pendientes se confirmaría en el acto y el rollback no lo desharía
+        self.db.flush()
+        conexion = self.db.connection()
+        if not conexion.connection.dbapi_connection.in_transaction:
+            conexion.exec_driver_sql("BEGIN")
+        return conexion
+
+    def __enter__(self):
+        if self.diferir_indices:
+            conexion = self._conexion_en_transaccion()
+            for indice in self._indices:
+                indice.drop(conexion, checkfirst=True)
+            logger.info(f"Índices de 'lectura' eliminados durante la carga: {[i.name for i in self._indices]}")
+        return self
+
+    def insertar(self, registros: List[dict]) -> None:
+        if not registros:
+            return
+        # Volcar objetos pendientes de la sesión (p.ej. el ArchivoExcel) antes de las lecturas
+        self.db.flush()
+        for inicio in range(0, len(registros), TAMANO_LOTE_INSERCION):
+            self.db.execute(self._sentencia, registros[inicio:inicio + TAMANO_LOTE_INSERCION])
+        self.total += len(registros)
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and self.diferir_indices:
+            conexion = self.db.connection()
+            for indice in self._indices:
+                indice.create(conexion, checkfirst=True)
+            logger.info(f"Índices de 'lectura' reconstruidos tras insertar {self.total} lecturas.")
+        return False
+
+
+# --- Importación por bloques ---
+@dataclass
+class ResultadoImportacion:
+    """Acumulado de una importación; se actualiza al terminar cada bloque."""
+    filas_procesadas: int = 0
+    total: int = 0
+    errores: List[str] = field(default_factory=list)
+    duplicadas: List[str] = field(default_factory=list)
+    lectores_no_encontrados: Set[str] = field(default_factory=set)
+    nuevos_lectores: Set[str] = field(default_factory=set)
+
+
+class ResolutorLectores:
+    """
+    Resuelve los lectores LPR de una importación con una consulta por bloque (solo para los
+    ID_Lector que aún no están en su caché): crea en bloque los que no existen, con las
+    coordenadas de su primera lectura, completa las coordenadas que falten en las lecturas
+    con las del lector y añade la clave interna del lector ('ID_Interno_Lector').
+    """
+
+    # Límite de parámetros por consulta IN (SQLite antiguo admite 999 variables)
+    TAMANO_CONSULTA = 500
+
+    def __init__(self, db: Session, resultado: ResultadoImportacion):
+        self.db = db
+        self.resultado = resultado
+        self._coordenadas: Dict[str, Tuple[float, float]] = {}
+        self._ids: Dict[str, int] = {}
+
+    def _cargar(self, ids: List[str]) -> None:
+        for inicio in range(0, len(ids), self.TAMANO_CONSULTA):
+            filas = self.db.query(models.Lector.ID_Lector, models.Lector.ID_Interno, models.Lector.Coordenada_X, models.Lector.Coordenada_Y)\
+                .filter(models.Lector.ID_Lector.in_(ids[inicio:inicio + self.TAMANO_CONSULTA])).all()
+            for id_lector, id_interno, x, y in filas:
+                self._ids[id_lector] = id_interno
+                self._coordenadas[id_lector] = (x, y)
+
+    def _crear(self, lecturas: pd.DataFrame, ids: List[str]) -> None:
+        primeras = lecturas[lecturas["ID_Lector"].isin(ids)].drop_duplicates("ID_Lector")
+        nuevos = [
+            {
+                "ID_Lector": id_lector,
+                "Coordenada_X": None if pd.isna(x) else x,
+                "Coordenada_Y": None if pd.isna(y) else y,
+            }
+            for id_lector, x, y in zip(
+                primeras["ID_Lector"].tolist(), primeras["Coordenada_X"].tolist(), primeras["Coordenada_Y"].tolist()
+            )
+        ]
+        self.db.execute(insert(models.Lector.__table__), nuevos)
+        # Las claves internas las asigna SQLite: se leen de vuelta junto con las coordenadas
+        self._cargar(ids)
+        self.resultado.lectores_no_encontrados.update(ids)
+        self.resultado.nuevos_lectores.update(ids)
+        logger.info(f"{len(ids)} lectores no encontrados, creados: {ids}")
+
+    def resolver(self, lecturas: pd.DataFrame) -> pd.DataFrame:
+        ids = lecturas["ID_Lector"].dropna().unique().tolist()
+        pendientes = [i for i in ids if i not in self._coordenadas]
+        if pendientes:
+            self._cargar(pendientes)
+            faltan = [i for i in pendientes if i not in self._coordenadas]
+            if faltan:
+                self._crear(lecturas, faltan)
+        lecturas = lecturas.copy()
+        lecturas["ID_Interno_Lector"] = lecturas["ID_Lector"].map(self._ids)
+        if not ids:
+            return lecturas
+
+        coordenadas = pd.DataFrame.from_dict(
+            {i: self._coordenadas[i] for i in ids}, orient="index",
+            columns=["Coordenada_X", "Coordenada_Y"], dtype="float64"
+        )
+        for columna in ("Coordenada_X", "Coordenada_Y"):
+            lecturas[columna] = lecturas[columna].fillna(lecturas["ID_Lector"].map(coordenadas[columna]))
+        return lecturas
+
+
+class ResolutorMatriculas:
+    """
+    Traduce las matrículas de cada bloque a su ID en el diccionario 'matriculas': inserta en
+    bloque las nuevas (ignorando las existentes) y consulta solo las que aún no están en la caché.
+    """
+
+    TAMANO_CONSULTA = ResolutorLectores.TAMANO_CONSULTA
+
+    def __init__(self, db: Session):
+        self.db = db
+        self._ids: Dict[str, int] = {}
+
+    def resolver(self, lecturas: pd.DataFrame) -> pd.DataFrame:
+        tabla = models.Matricula.__table__
+        pendientes = [m for m in lecturas["Matricula"].unique().tolist() if m not in self._ids]
+        for inicio in range(0, len(pendientes), self.TAMANO_CONSULTA):
+            lote = pendientes[inicio:inicio + self.TAMANO_CONSULTA]
+            self.db.execute(sqlite_insert(tabla).on_conflict_do_nothing(), [{"Matricula": m} for m in lote])
+            filas = self.db.execute(select(tabla.c.Matricula, tabla.c.ID_Matricula).where(tabla.c.Matricula.in_(lote)))
+            self._ids.update(filas.all())
+        lecturas = lecturas.copy()
+        lecturas["ID_Matricula"] = lecturas["Matricula"].map(self._ids)
+        return lecturas
+
+
+def normalizar_bloques(bloques: Iterable[pd.DataFrame], tipo_archivo: str) -> Iterator[Tuple[pd.DataFrame, List[str], int]]:
+    """Aplica normalizar_lecturas a cada bloque: emite (lecturas_validas, errores, filas_del_bloque)."""
+    for bloque in bloques:
+        lecturas_df, errores = normalizar_lecturas(bloque, tipo_archivo)
+        yield lecturas_df, errores, len(bloque)
+
+
+def importar_normalizadas(
+    db: Session,
+    caso_id: int,
+    db_archivo: models.ArchivoExcel,
+    normalizadas: Iterable[Tuple[pd.DataFrame, List[str], int]],
+    tipo_archivo: str,
+    filas_estimadas: Optional[int] = None,
+    al_procesar_bloque: Optional[Callable[[ResultadoImportacion], None]] = None,
+) -> ResultadoImportacion:
+    """
+    Descarta duplicados e inserta bloques ya normalizados (ver normalizar_bloques) dentro de
+    la transacción de la sesión; el commit lo hace quien llama.
+
+    'al_procesar_bloque' se invoca con el resultado acumulado tras cada bloque; si lanza una
+    excepción la importación se interrumpe y la transacción queda pendiente de rollback.
+    """
+    resultado = ResultadoImportacion()
+    lectores = ResolutorLectores(db, resultado) if tipo_archivo == "LPR" else None
+    matriculas = ResolutorMatriculas(db)
+    with CargadorLecturas(db, total_filas=filas_estimadas or 0) as cargador:
+        for lecturas_df, errores, filas_bloque in normalizadas:
+            resultado.errores.extend(errores)
+
+            # Los bloques anteriores ya están en la transacción, así que la consulta
+            # también detecta las repeticiones entre bloques del mismo archivo
+            lecturas_df, duplicadas = separar_duplicados(db, caso_id, lecturas_df)
+            resultado.duplicadas.extend(duplicadas)
+
+            if lectores is not None and not lecturas_df.empty:
+                lecturas_df = lectores.resolver(lecturas_df)
+            else:
+                lecturas_df = lecturas_df.assign(ID_Interno_Lector=None)
+            lecturas_df = matriculas.resolver(lecturas_df)
+
+            for inicio in range(0, len(lecturas_df), TAMANO_LOTE_INSERCION):
+                lote_df = lecturas_df.iloc[inicio:inicio + TAMANO_LOTE_INSERCION]
+                cargador.insertar(registros_lectura(lote_df, db_archivo.ID_Archivo, caso_id, tipo_archivo))
+
+            resultado.filas_procesadas += filas_bloque
+            resultado.total = cargador.total
+            if al_procesar_bloque is not None:
+                al_procesar_bloque(resultado)
+    return resultado
+
+
+def importar_bloques(
+    db: Session,
+    caso_id: int,
+    db_archivo: models.ArchivoExcel,
+    bloques: Iterable[pd.DataFrame],
+    tipo_archivo: str,
+    filas_estimadas: Optional[int] = None,
+    al_procesar_bloque: Optional[Callable[[ResultadoImportacion], None]] = None,
+) -> ResultadoImportacion:
+    """
+    Normaliza, descarta duplicados e inserta las lecturas bloque a bloque. Los bloques ya
+    deben venir con las columnas renombradas a los campos internos.
+    """
+    return importar_normalizadas(
+        db, caso_id, db_archivo, normalizar_bloques(bloques, tipo_archivo), tipo_archivo,
+        filas_estimadas=filas_estimadas, al_procesar_bloque=al_procesar_bloque
+    )
+
+
+def preparar_archivo(ruta, map_cliente_a_interno: dict, tipo_archivo: str, directorio_volcado) -> Tuple[List[str], Optional[int]]:
+    """
+    Lee, mapea, valida y normaliza un archivo sin tocar la base de datos, para ejecutarse en
+    un proceso aparte. Cada bloque normalizado se vuelca a un archivo en 'directorio_volcado'
+    en cuanto está listo, así que ni este proceso ni el servidor retienen el archivo completo.
+    Devuelve (rutas_de_los_volcados, filas_estimadas), en orden, para leer_volcados.
+    Lanza ValueError si faltan columnas obligatorias.
+    """
+    map_interno_a_cliente = {v: k for k, v in map_cliente_a_interno.items()}
+    directorio_volcado = pathlib.Path(directorio_volcado)
+    bloques, filas_estimadas = abrir_bloques(ruta)
+    volcados = []
+    for bloque in bloques:
+        bloque = bloque.rename(columns={k: v for k, v in map_interno_a_cliente.items() if k in bloque.columns})
+        if not volcados:
+            faltantes = columnas_faltantes(bloque.columns, tipo_archivo, map_cliente_a_interno)
+            if faltantes:
+                raise ValueError(f"Faltan columnas obligatorias o mapeos incorrectos: {', '.join(faltantes)}")
+        lecturas_df, errores = normalizar_lecturas(bloque, tipo_archivo)
+        destino = directorio_volcado / f"{len(volcados):06d}.pkl"
+        with open(destino, "wb") as salida:
+            pickle.dump((lecturas_df, errores, len(bloque)), salida, protocol=pickle.HIGHEST_PROTOCOL)
+        volcados.append(str(destino))
+    return volcados, filas_estimadas
+
+
+def leer_volcados(rutas: Iterable[str]) -> Iterator[Tuple[pd.DataFrame, List[str], int]]:
+    """Carga uno a uno los bloques volcados por preparar_archivo y borra cada archivo tras leerlo."""
+    for ruta in rutas:
+        with open(ruta, "rb") as entrada:
+            normalizado = pickle.load(entrada)
+        os.remove(ruta)
+        yield normalizado
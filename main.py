@@ -1,22 +1,34 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Request, UploadFile, File, Form, Query, Body
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, Response, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.exceptions import RequestValidationError
 from fastapi.routing import APIRouter
 from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session, joinedload, contains_eager, relationship
 from sqlalchemy.sql import func, extract, select, label
 import models, schemas
-from database import SessionLocal, engine, get_db
+import importacion
+import serializacion
+import estaticos
+import versiones
+import cache_lecturas
+import metricas
+import trabajos_importacion
+from database import SessionLocal, engine, get_db, en_hilo_bd
 import pandas as pd
 from io import BytesIO
 import datetime
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Union
 import json
+import base64
+import itertools
+import asyncio
 from urllib.parse import unquote
 import logging
 import os
 import shutil
+import tempfile
 import pathlib
 from dateutil import parser
 import re
@@ -25,6 +37,7 @@ from sqlalchemy.exc import IntegrityError
 from datetime import timedelta
 from collections import defaultdict
 from contextlib import asynccontextmanager
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy import or_
 from sqlalchemy import and_, not_
 from pydantic import BaseModel
@@ -32,6 +45,7 @@ from datetime import datetime, timedelta, date, time
 from sqlalchemy import func, select, and_, literal_column
 from sqlalchemy.orm import aliased
 from sqlalchemy import over
+from sqlalchemy import tuple_
 import math
 from math import radians, sin, cos, sqrt, asin
 from schemas import Lectura as LecturaSchema
@@ -39,6 +53,8 @@ from gps_capas import router as gps_capas_router
 from models import LocalizacionInteres
 from schemas import LocalizacionInteresCreate, LocalizacionInteresUpdate, LocalizacionInteresOut
 from admin.database_manager import router as admin_database_router
+from admin.metricas import router as admin_metricas_router
+from trabajos_importacion import router as importaciones_router
 
 # Configurar logging básico para ver más detalles
 logging.basicConfig(level=logging.INFO)
@@ -52,13 +68,20 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Ejecutando evento de inicio: Creando tablas si no existen...")
     models.create_db_and_tables()
+    if FRONTEND_INDEX is not None:
+        escritas = await run_in_threadpool(estaticos.precomprimir, DIST_DIR)
+        logger.info(f"Frontend: {escritas} variantes comprimidas generadas.")
     logger.info("Evento de inicio completado.")
     yield
     # Shutdown
     logger.info("Cerrando aplicación...")
+    trabajos_importacion.detener()
 
 app = FastAPI(lifespan=lifespan)
 
+# Contadores de versión (ETag) alimentados por las escrituras en la base de datos
+versiones.registrar(engine)
+
 # Configurar CORS
 app.add_middleware(
     CORSMiddleware,
@@ -71,6 +94,8 @@ app.add_middleware(
 # Incluir routers
 app.include_router(gps_capas_router)
 app.include_router(admin_database_router)
+app.include_router(admin_metricas_router)
+app.include_router(importaciones_router)
 
 # ... existing code ...
 
@@ -138,12 +163,29 @@ app.add_middleware(
     allow_headers=["*"], 
 )
 
+# --- Compresión de respuestas ---
+# gzip para las respuestas de más de COMPRESION_MIN_BYTES (las pequeñas no compensan). Funciona
+# también con StreamingResponse (NDJSON), comprimiendo cada bloque según se envía. Las respuestas
+# que ya traen Content-Encoding (assets precomprimidos) pasan sin tocar.
+COMPRESION_MIN_BYTES = int(os.getenv("COMPRESION_MIN_BYTES", "1024"))
+COMPRESION_NIVEL = int(os.getenv("COMPRESION_NIVEL", "6"))
+app.add_middleware(GZipMiddleware, minimum_size=COMPRESION_MIN_BYTES, compresslevel=COMPRESION_NIVEL)
+
+# --- Métricas (ver /metrics y admin/metricas.py) ---
+# Se añade el último para ser el más externo: mide la latencia completa y los bytes ya comprimidos
+app.add_middleware(metricas.MiddlewareMetricas)
+metricas.registrar_sql(engine)
+
 # --- Directorio para guardar archivos subidos (RUTA ABSOLUTA) ---
 BASE_DIR = pathlib.Path(__file__).resolve().parent
 UPLOADS_DIR = BASE_DIR / "uploads"
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 logger.info(f"Directorio de subidas configurado en: {UPLOADS_DIR}")
 
+# --- Frontend compilado (dist/) servido por el backend ---
+DIST_DIR = pathlib.Path(os.getenv("TRACER_DIST_DIR", BASE_DIR / "dist"))
+FRONTEND_INDEX = estaticos.montar_frontend(app, DIST_DIR)
+
 # === DEFINICIÓN DE PARSEAR_UBICACION ===
 # (Debe estar definida antes de ser usada en update_lector)
 def parsear_ubicacion(ubicacion_str: str) -> Optional[Tuple[float, float]]:
@@ -266,7 +308,10 @@ def translate_plate_pattern(pattern: str) -> str:
 # --- Endpoints API REST ---
 
 @app.get("/")
-def read_root():
+def read_root(request: Request):
+    # Un navegador recibe la aplicación; los clientes de la API, el mensaje de bienvenida
+    if FRONTEND_INDEX is not None and "text/html" in request.headers.get("accept", ""):
+        return estaticos.respuesta_index(FRONTEND_INDEX, request.headers)
     return {"message": "Bienvenido a la API de Tracer"}
 
 # === CASOS ===
@@ -368,6 +413,11 @@ def update_caso_estado(caso_id: int, estado_update: schemas.CasoEstadoUpdate, db
         logger.error(f"[Update Estado Caso] Error al actualizar estado del caso ID {caso_id}. Rollback: {e}", exc_info=True)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Error interno al actualizar el estado del caso.")
 
+def _eliminar_relevancias_de_archivo(db: Session, id_archivo: int):
+    """Las marcas de relevancia apuntan a lecturas: se borran antes para no violar las claves foráneas."""
+    lecturas_archivo = select(models.Lectura.ID_Lectura).where(models.Lectura.ID_Archivo == id_archivo)
+    db.query(models.LecturaRelevante).filter(models.LecturaRelevante.ID_Lectura.in_(lecturas_archivo)).delete(synchronize_session=False)
+
 @app.delete("/casos/{caso_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_caso(caso_id: int, db: Session = Depends(get_db)):
     logger.info(f"Solicitud DELETE para caso ID: {caso_id} (con eliminación en cascada)")
@@ -376,12 +426,14 @@ def delete_caso(caso_id: int, db: Session = Depends(get_db)):
         logger.warning(f"[Delete Caso Casc] Caso con ID {caso_id} no encontrado.")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Caso no encontrado.")
     try:
+        versiones.asignar_caso(db, caso_id)
         archivos_a_eliminar = db.query(models.ArchivoExcel).filter(models.ArchivoExcel.ID_Caso == caso_id).all()
         logger.info(f"[Delete Caso Casc] Se encontraron {len(archivos_a_eliminar)} archivos asociados al caso {caso_id}.")
         for db_archivo in archivos_a_eliminar:
             archivo_id_actual = db_archivo.ID_Archivo
             nombre_archivo_actual = db_archivo.Nombre_del_Archivo
             logger.info(f"[Delete Caso Casc] Procesando archivo ID: {archivo_id_actual} ({nombre_archivo_actual})")
+            _eliminar_relevancias_de_archivo(db, archivo_id_actual)
             lecturas_eliminadas = db.query(models.Lectura).filter(models.Lectura.ID_Archivo == archivo_id_actual).delete(synchronize_session=False)
             logger.info(f"[Delete Caso Casc] {lecturas_eliminadas} lecturas asociadas al archivo {archivo_id_actual} marcadas para eliminar.")
             if nombre_archivo_actual:
@@ -398,6 +450,8 @@ def delete_caso(caso_id: int, db: Session = Depends(get_db)):
                 logger.warning(f"[Delete Caso Casc] Registro ArchivoExcel ID {archivo_id_actual} no tiene nombre, no se puede eliminar archivo físico.")
             db.delete(db_archivo)
             logger.info(f"[Delete Caso Casc] Registro ArchivoExcel ID {archivo_id_actual} marcado para eliminar.")
+        db.query(models.GpsCapa).filter(models.GpsCapa.caso_id == caso_id).delete(synchronize_session=False)
+        db.query(models.LocalizacionInteres).filter(models.LocalizacionInteres.caso_id == caso_id).delete(synchronize_session=False)
         db.delete(db_caso)
         logger.info(f"[Delete Caso Casc] Caso ID {caso_id} marcado para eliminar.")
         db.commit()
@@ -410,14 +464,81 @@ def delete_caso(caso_id: int, db: Session = Depends(get_db)):
 
 
 # === ARCHIVOS EXCEL (Importación, Descarga, Eliminación) ===
+def _eliminar_subida_sin_uso(db: Session, file_location: pathlib.Path):
+    """Borra un archivo recién subido que no se va a importar, salvo que otro ArchivoExcel use esa ruta."""
+    en_uso = db.query(models.ArchivoExcel.ID_Archivo).filter(
+        models.ArchivoExcel.Nombre_del_Archivo == file_location.name
+    ).first()
+    if en_uso is None and os.path.isfile(file_location):
+        os.remove(file_location)
+
+
+def _vincular_archivo_identico(db: Session, caso_id: int, filename: str, hash_contenido: str,
+                               archivo_identico: models.ArchivoExcel) -> schemas.UploadResponse:
+    """Registra el archivo en el caso reutilizando las lecturas de 'archivo_identico' (sin parsear)."""
+    try:
+        db_archivo = models.ArchivoExcel(
+            ID_Caso=caso_id,
+            Nombre_del_Archivo=filename,
+            Tipo_de_Archivo=archivo_identico.Tipo_de_Archivo,
+            Hash_Contenido=hash_contenido
+        )
+        db.add(db_archivo)
+        db.flush()
+        total = importacion.vincular_lecturas(db, archivo_identico.ID_Archivo, db_archivo)
+        db.commit()
+        db.refresh(db_archivo)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error vinculando '{filename}' con el archivo {archivo_identico.ID_Archivo}: {e}", exc_info=True)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error interno al vincular el archivo '{filename}': {e}")
+    logger.info(f"Archivo '{filename}' vinculado a las lecturas del archivo {archivo_identico.ID_Archivo}: {total} lecturas copiadas al caso {caso_id}.")
+    return schemas.UploadResponse(archivo=db_archivo, total_registros=total)
+
+
 @app.post("/casos/{caso_id}/archivos/upload", response_model=schemas.UploadResponse, status_code=status.HTTP_201_CREATED)
 async def upload_excel(
     caso_id: int,
     tipo_archivo: str = Form(..., pattern="^(GPS|LPR)$"),
     excel_file: UploadFile = File(...),
     column_mapping: str = Form(...),
+    en_segundo_plano: bool = Form(False),
+    vincular_existente: bool = Form(False),
     db: Session = Depends(get_db)
 ):
+    """
+    Importa un archivo de lecturas. Con en_segundo_plano=true responde 202 con el estado del
+    trabajo (consultable en /imports/{job_id}); si no, espera al resultado sin bloquear el servidor.
+    Si el contenido ya se importó en otro caso responde 409, salvo con vincular_existente=true,
+    en cuyo caso se copian las lecturas ya importadas sin volver a procesar el archivo.
+    """
+    # Comprobaciones, guardado y apertura del archivo: consultas y E/S síncronas, fuera del bucle de eventos
+    trabajo = await en_hilo_bd(
+        _preparar_importacion, db, caso_id, tipo_archivo, excel_file, column_mapping, vincular_existente
+    )
+    if isinstance(trabajo, schemas.UploadResponse):
+        return trabajo  # Contenido ya importado en otro caso, vinculado sin volver a procesarlo
+    if en_segundo_plano:
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content=jsonable_encoder(trabajo.estado_publico())
+        )
+
+    filename = excel_file.filename
+    try:
+        return await asyncio.wrap_future(trabajo.futuro)
+    except trabajos_importacion.ImportacionCancelada:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"La importación de '{filename}' fue cancelada.")
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error interno al importar el archivo '{filename}': {e}")
+
+def _preparar_importacion(db: Session, caso_id: int, tipo_archivo: str, excel_file: UploadFile, column_mapping: str,
+                          vincular_existente: bool):
+    """
+    Parte síncrona de upload_excel: valida el caso y el nombre, guarda el archivo y su hash,
+    valida el mapeo y encola la importación. Devuelve el trabajo encolado o, si el contenido
+    ya estaba importado en otro caso y se pidió vincularlo, la UploadResponse final.
+    """
     # 1. Verificar caso
     db_caso = db.query(models.Caso).filter(models.Caso.ID_Caso == caso_id).first()
     if db_caso is None:
@@ -440,204 +561,262 @@ async def upload_excel(
     file_location = UPLOADS_DIR / filename
     logger.info(f"Intentando guardar archivo en: {file_location}")
     try:
-        with open(file_location, "wb") as buffer:
-            shutil.copyfileobj(excel_file.file, buffer)
-        logger.info(f"Archivo guardado exitosamente en: {file_location}")
+        hash_contenido = importacion.guardar_con_hash(excel_file.file, file_location)
+        logger.info(f"Archivo guardado exitosamente en: {file_location} (sha256 {hash_contenido})")
     except Exception as e:
         logger.error(f"Error CRÍTICO al guardar el archivo subido {filename} en {file_location}: {e}", exc_info=True)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"No se pudo guardar el archivo subido '{filename}'.")
     finally:
         excel_file.file.close()
-    
-    # --- Leer Excel y Mapeo ---
-    try:
-        df = pd.read_excel(file_location)
-    except Exception as e:
-        logger.error(f"Error al leer el archivo Excel desde {file_location}: {e}", exc_info=True)
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Error al leer el archivo Excel guardado ({filename}).")
+
+    # --- Contenido ya importado (mismo hash, en este u otro caso) ---
+    archivo_identico = importacion.buscar_archivo_identico(db, hash_contenido, caso_id)
+    if archivo_identico is not None:
+        if archivo_identico.ID_Caso == caso_id:
+            _eliminar_subida_sin_uso(db, file_location)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"El contenido de '{filename}' es idéntico al del archivo '{archivo_identico.Nombre_del_Archivo}' ya importado en este caso."
+            )
+        if not vincular_existente:
+            _eliminar_subida_sin_uso(db, file_location)
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"El contenido de '{filename}' es idéntico al del archivo '{archivo_identico.Nombre_del_Archivo}' "
+                       f"(ID {archivo_identico.ID_Archivo}) del caso {archivo_identico.ID_Caso}. "
+                       f"Envíe vincular_existente=true para reutilizar sus lecturas sin volver a procesarlo."
+            )
+        return _vincular_archivo_identico(db, caso_id, filename, hash_contenido, archivo_identico)
+
+    # --- Mapeo y apertura por bloques (Excel, CSV o Parquet según el contenido) ---
     try:
         map_cliente_a_interno = json.loads(column_mapping)
         map_interno_a_cliente = {v: k for k, v in map_cliente_a_interno.items()}
     except json.JSONDecodeError:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="El mapeo de columnas no es un JSON válido.")
-    try:
-        columnas_a_renombrar = {k: v for k, v in map_interno_a_cliente.items() if k in df.columns}
-        df.rename(columns=columnas_a_renombrar, inplace=True)
-    except Exception as e:
-         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Error al aplicar mapeo de columnas: {e}.")
-
-    # --- Validar Columnas Obligatorias ---
-    if tipo_archivo == 'LPR':
-        columnas_obligatorias = ['Matricula', 'Fecha', 'Hora', 'ID_Lector']
-    elif tipo_archivo == 'GPS':
-        columnas_obligatorias = ['Matricula', 'Fecha', 'Hora']
+    # Si hubo vista previa de este contenido, el mapeo se valida sin abrir el archivo: se abre
+    # después, en el hilo de la importación
+    cabecera = importacion.cabecera_en_cache(hash_contenido)
+    if cabecera is not None:
+        columnas_a_renombrar = {k: v for k, v in map_interno_a_cliente.items() if k in cabecera.columnas}
+        columnas_mapeadas = [columnas_a_renombrar.get(c, c) for c in cabecera.columnas]
+        columnas_obligatorias_faltantes = importacion.columnas_faltantes(columnas_mapeadas, tipo_archivo, map_cliente_a_interno)
+        if columnas_obligatorias_faltantes:
+            _eliminar_subida_sin_uso(db, file_location)
+            mensaje_error = f"Faltan columnas obligatorias o mapeos incorrectos: {', '.join(columnas_obligatorias_faltantes)}"
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=mensaje_error)
+        bloques = importacion.bloques_diferidos(file_location, formato=cabecera.formato)
+        bloques_mapeados = (bloque.rename(columns=columnas_a_renombrar) for bloque in bloques)
+        filas_estimadas = cabecera.filas_estimadas
     else:
-        columnas_obligatorias = ['Matricula', 'Fecha', 'Hora']
-    columnas_obligatorias_faltantes = []
-    for campo_interno in columnas_obligatorias:
-        if campo_interno not in df.columns:
-            col_excel_mapeada = map_cliente_a_interno.get(campo_interno)
-            columnas_obligatorias_faltantes.append(f"{campo_interno} (mapeada desde '{col_excel_mapeada}')" if col_excel_mapeada else f"{campo_interno} (no mapeada)")
-    if columnas_obligatorias_faltantes:
-        mensaje_error = f"Faltan columnas obligatorias o mapeos incorrectos: {', '.join(columnas_obligatorias_faltantes)}"
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=mensaje_error)
-
-    # --- Crear Registro ArchivoExcel ---
-    db_archivo = models.ArchivoExcel(
-        ID_Caso=caso_id,
-        Nombre_del_Archivo=filename,
-        Tipo_de_Archivo=tipo_archivo
+        bloques_mapeados, filas_estimadas = _abrir_y_validar(db, file_location, filename, tipo_archivo, map_cliente_a_interno)
+
+    # --- Encolar la importación (se ejecuta en el pool, fuera del bucle de eventos) ---
+    return trabajos_importacion.encolar(
+        caso_id, filename, tipo_archivo, file_location, bloques_mapeados,
+        filas_estimadas=filas_estimadas, hash_contenido=hash_contenido
     )
-    db.add(db_archivo)
-    db.flush()
-    db.refresh(db_archivo)
-
-    # --- Procesar e Insertar Lecturas ---
-    lecturas_a_insertar = []
-    errores_lectura = []
-    lectores_no_encontrados = set()
-    nuevos_lectores_en_sesion = set()
-    lecturas_duplicadas = set()  # Para trackear lecturas duplicadas
-
-    for index, row in df.iterrows():
+
+def _abrir_y_validar(db: Session, file_location: pathlib.Path, filename: str, tipo_archivo: str, map_cliente_a_interno: dict):
+    """
+    Abre el archivo guardado, valida el mapeo con el primer bloque y devuelve (bloques_mapeados,
+    filas_estimadas). Si la validación falla cierra el lector y elimina la subida.
+    """
+    map_interno_a_cliente = {v: k for k, v in map_cliente_a_interno.items()}
+    bloques = None
+    validado = False
+    try:
         try:
-            matricula = str(row['Matricula']).strip() if pd.notna(row['Matricula']) else None
-            if not matricula: raise ValueError("Matrícula vacía")
-            valor_fecha_excel = row['Fecha']
-            valor_hora_excel = row['Hora']
-            fecha_hora_final = None
-            def parse_hora(hora_val):
-                if isinstance(hora_val, time):
-                    return hora_val
-                if isinstance(hora_val, datetime):
-                    return hora_val.time()
-                if isinstance(hora_val, float) and not pd.isna(hora_val):
-                    # Excel puede guardar horas como fracción de día
-                    total_seconds = int(hora_val * 24 * 60 * 60)
-                    h = total_seconds // 3600
-                    m = (total_seconds % 3600) // 60
-                    s = total_seconds % 60
-                    return time(hour=h, minute=m, second=s)
-                if isinstance(hora_val, str):
-                    # Aceptar formatos "HH:MM", "HH:MM:SS", "HH:MM:SS.sss" o "HH:MM:SS,sss"
-                    match = re.match(r"^(\d{1,2}):(\d{2})(?::(\d{2})([.,](\d{1,6}))?)?$", hora_val.strip())
-                    if match:
-                        h = int(match.group(1))
-                        m = int(match.group(2))
-                        s = int(match.group(3) or 0)
-                        ms = match.group(5)
-                        micro = int(float(f'0.{ms}') * 1_000_000) if ms else 0
-                        return time(hour=h, minute=m, second=s, microsecond=micro)
-                raise ValueError(f"Formato de hora no reconocido: {hora_val}")
-            try:
-                # Normalizar hora
-                hora_obj = parse_hora(valor_hora_excel)
-                # Normalizar fecha
-                if isinstance(valor_fecha_excel, datetime):
-                    fecha_obj = valor_fecha_excel.date()
-                elif isinstance(valor_fecha_excel, date):
-                    fecha_obj = valor_fecha_excel
-                elif isinstance(valor_fecha_excel, float) and not pd.isna(valor_fecha_excel):
-                    # Excel puede guardar fechas como número de días desde 1899-12-30
-                    fecha_obj = pd.to_datetime(valor_fecha_excel, unit='d', origin='1899-12-30').date()
-                else:
-                    fecha_obj = pd.to_datetime(str(valor_fecha_excel)).date()
-                fecha_hora_final = datetime.combine(fecha_obj, hora_obj)
-            except Exception as e_comb:
-                raise ValueError(f"Error combinando/parseando Fecha/Hora: {e_comb}")
-
-            id_lector = None
-            coord_x_final = get_optional_float(row.get('Coordenada_X'))
-            coord_y_final = get_optional_float(row.get('Coordenada_Y'))
-
-            if tipo_archivo == 'LPR':
-                id_lector_str = str(row['ID_Lector']).strip() if pd.notna(row['ID_Lector']) else None
-                if not id_lector_str: raise ValueError("Falta ID_Lector para LPR")
-                id_lector = id_lector_str # Guardamos el ID original
-                
-                # Buscar lector existente
-                db_lector = db.query(models.Lector).filter(models.Lector.ID_Lector == id_lector).first()
-                
-                if not db_lector:
-                    # Si no existe Y NO lo hemos añadido ya en esta sesión:
-                    if id_lector not in nuevos_lectores_en_sesion:
-                        lectores_no_encontrados.add(id_lector)
-                        logger.info(f"Lector '{id_lector}' no encontrado, añadiendo a sesión para crear.")
-                        db_lector_nuevo = models.Lector(ID_Lector=id_lector) # Crear con el ID
-                        db.add(db_lector_nuevo)
-                        nuevos_lectores_en_sesion.add(id_lector) # Registrar que lo hemos añadido
-                        # Intentar obtener coordenadas del excel si existen para el nuevo lector
-                        coord_x_nuevo = get_optional_float(row.get('Coordenada_X'))
-                        coord_y_nuevo = get_optional_float(row.get('Coordenada_Y'))
-                        if coord_x_nuevo is not None: db_lector_nuevo.Coordenada_X = coord_x_nuevo
-                        if coord_y_nuevo is not None: db_lector_nuevo.Coordenada_Y = coord_y_nuevo
-                        # Asignar las coordenadas finales para la lectura actual (pueden venir del Excel)
-                        coord_x_final = coord_x_nuevo
-                        coord_y_final = coord_y_nuevo
-                    else:
-                        # Ya añadido a la sesión, solo obtener coords si las hay en esta fila para la lectura
-                        coord_x_final = get_optional_float(row.get('Coordenada_X'))
-                        coord_y_final = get_optional_float(row.get('Coordenada_Y'))
-                        
-                else: # Si el lector SÍ existe
-                    if coord_x_final is None: coord_x_final = db_lector.Coordenada_X
-                    if coord_y_final is None: coord_y_final = db_lector.Coordenada_Y
-
-            carril = get_optional_str(row.get('Carril'))
-            velocidad = get_optional_float(row.get('Velocidad'))
-            lectura_data = {
-                "ID_Archivo": db_archivo.ID_Archivo, "Matricula": matricula,
-                "Fecha_y_Hora": fecha_hora_final, "Carril": carril, "Velocidad": velocidad,
-                "ID_Lector": id_lector,
-                "Coordenada_X": coord_x_final, "Coordenada_Y": coord_y_final,
-                "Tipo_Fuente": tipo_archivo
-            }
+            bloques, filas_estimadas = importacion.abrir_bloques(file_location)
+            primer_bloque = next(bloques)
+        except Exception as e:
+            logger.error(f"Error al leer el archivo desde {file_location}: {e}", exc_info=True)
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Error al leer el archivo guardado ({filename}): {e}")
+        try:
+            columnas_a_renombrar = {k: v for k, v in map_interno_a_cliente.items() if k in primer_bloque.columns}
+            primer_bloque = primer_bloque.rename(columns=columnas_a_renombrar)
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Error al aplicar mapeo de columnas: {e}.")
+
+        # --- Validar Columnas Obligatorias ---
+        columnas_obligatorias_faltantes = importacion.columnas_faltantes(primer_bloque.columns, tipo_archivo, map_cliente_a_interno)
+        if columnas_obligatorias_faltantes:
+            mensaje_error = f"Faltan columnas obligatorias o mapeos incorrectos: {', '.join(columnas_obligatorias_faltantes)}"
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=mensaje_error)
+        validado = True
+    finally:
+        if not validado:
+            cerrar = getattr(bloques, "close", None)
+            if cerrar is not None:
+                cerrar()
+            _eliminar_subida_sin_uso(db, file_location)
+
+    bloques_mapeados = itertools.chain(
+        [primer_bloque],
+        (bloque.rename(columns=columnas_a_renombrar) for bloque in bloques)
+    )
+    return bloques_mapeados, filas_estimadas
 
-            # Verificar si ya existe una lectura duplicada
-            lectura_duplicada = db.query(models.Lectura)\
-                .join(models.ArchivoExcel, models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo)\
-                .filter(
-                    models.ArchivoExcel.ID_Caso == caso_id,
-                    models.Lectura.Matricula == matricula,
-                    models.Lectura.Fecha_y_Hora == fecha_hora_final,
-                    models.Lectura.ID_Lector == id_lector
-                ).first()
+@app.post("/archivos/preview", response_model=schemas.VistaPreviaResponse)
+async def preview_archivo(
+    excel_file: UploadFile = File(...),
+    tipo_archivo: str = Form("LPR", pattern="^(GPS|LPR)$"),
+    column_mapping: Optional[str] = Form(None),
+    filas: int = Form(importacion.FILAS_VISTA_PREVIA, ge=1, le=1000),
+):
+    """
+    Vista previa sin importar: columnas detectadas, tipos inferidos y las primeras filas; con
+    'column_mapping', además las columnas obligatorias que faltan y Fecha_y_Hora ya parseadas.
+    La cabecera se recuerda por hash, así que la importación posterior valida el mapeo al instante.
+    """
+    map_cliente_a_interno = None
+    if column_mapping:
+        try:
+            map_cliente_a_interno = json.loads(column_mapping)
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="El mapeo de columnas no es un JSON válido.")
 
-            if lectura_duplicada:
-                lecturas_duplicadas.add(f"Fila {index+1}: Matrícula {matricula} - {fecha_hora_final}")
-                continue  # Saltar esta lectura duplicada
+    sufijo = pathlib.Path(excel_file.filename or "").suffix
+    with tempfile.NamedTemporaryFile(suffix=sufijo, delete=False) as temporal:
+        ruta_temporal = pathlib.Path(temporal.name)
+    try:
+        # Copia y hash (lectura completa de la subida) y vista previa en un hilo, fuera del bucle de eventos
+        return await run_in_threadpool(
+            _vista_previa_subida, excel_file, ruta_temporal, tipo_archivo, map_cliente_a_interno, filas
+        )
+    except Exception as e:
+        logger.error(f"Error en la vista previa de {excel_file.filename}: {e}", exc_info=True)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Error al leer el archivo ({excel_file.filename}): {e}")
+    finally:
+        excel_file.file.close()
+        os.remove(ruta_temporal)
 
-            # Crear nueva lectura
-            nueva_lectura = models.Lectura(**lectura_data)
-            lecturas_a_insertar.append(nueva_lectura)
+def _vista_previa_subida(excel_file: UploadFile, ruta_temporal: pathlib.Path, tipo_archivo: str,
+                        map_cliente_a_interno: Optional[dict], filas: int) -> dict:
+    hash_contenido = importacion.guardar_con_hash(excel_file.file, ruta_temporal)
+    return importacion.vista_previa(ruta_temporal, hash_contenido, tipo_archivo, map_cliente_a_interno, filas)
 
-        except Exception as e:
-            errores_lectura.append(f"Fila {index+1}: {str(e)}")
-            continue
+@app.post("/casos/{caso_id}/archivos/upload-lote", response_model=schemas.UploadLoteResponse, status_code=status.HTTP_201_CREATED)
+async def upload_excel_lote(
+    caso_id: int,
+    tipo_archivo: str = Form(..., pattern="^(GPS|LPR)$"),
+    excel_files: List[UploadFile] = File(...),
+    column_mappings: str = Form(...),
+    en_segundo_plano: bool = Form(False),
+    db: Session = Depends(get_db)
+):
+    """
+    Importa varios archivos de un caso. 'column_mappings' es una lista JSON con un mapeo por
+    archivo (en el mismo orden), un objeto {nombre_archivo: mapeo} o un único mapeo común.
+    Cada archivo se lee y normaliza en paralelo en el pool de procesos y se inserta como una
+    importación independiente (ver /imports/{job_id}).
+    """
+    # Comprobaciones, guardado y hash de cada archivo: consultas y E/S síncronas, fuera del bucle de eventos
+    trabajos, errores_archivos = await en_hilo_bd(_preparar_lote, db, caso_id, tipo_archivo, excel_files, column_mappings)
 
-    # Insertar todas las lecturas válidas
-    if lecturas_a_insertar:
-        db.add_all(lecturas_a_insertar)
-        db.commit()
+    if en_segundo_plano:
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content=jsonable_encoder([trabajo.estado_publico() for trabajo in trabajos])
+        )
 
-    # Preparar respuesta con información sobre duplicados
-    response_data = schemas.UploadResponse(
-        archivo=db_archivo,
-        total_registros=len(lecturas_a_insertar),
-        errores=errores_lectura if errores_lectura else None,
-        lectores_no_encontrados=list(lectores_no_encontrados) if lectores_no_encontrados else None,
-        lecturas_duplicadas=list(lecturas_duplicadas) if lecturas_duplicadas else None,
-        nuevos_lectores_creados=list(nuevos_lectores_en_sesion) if nuevos_lectores_en_sesion else None
+    respuestas = await asyncio.gather(
+        *(asyncio.wrap_future(trabajo.futuro) for trabajo in trabajos), return_exceptions=True
     )
-    
-    # Loguear lo que se va a devolver
-    logger.info(f"Importación completada. Devolviendo datos: {response_data}")
-    if errores_lectura:
-        logger.warning(f"Importación {filename} completada con {len(errores_lectura)} errores: {errores_lectura}")
-    if lecturas_duplicadas:
-        logger.warning(f"Importación {filename} completada con {len(lecturas_duplicadas)} lecturas duplicadas: {lecturas_duplicadas}")
+    resultados = []
+    for trabajo, respuesta in zip(trabajos, respuestas):
+        if isinstance(respuesta, trabajos_importacion.ImportacionCancelada):
+            errores_archivos[trabajo.nombre_archivo] = "Importación cancelada."
+        elif isinstance(respuesta, Exception):
+            errores_archivos[trabajo.nombre_archivo] = str(respuesta)
+        else:
+            resultados.append(respuesta)
+    return schemas.UploadLoteResponse(resultados=resultados, errores_archivos=errores_archivos or None)
 
-    return response_data
+def _preparar_lote(db: Session, caso_id: int, tipo_archivo: str, excel_files: List[UploadFile], column_mappings: str):
+    """
+    Parte síncrona de upload_excel_lote: valida el caso, los mapeos y los nombres, guarda cada
+    archivo con su hash y encola los que no estaban ya importados.
+    Devuelve (trabajos_encolados, errores_por_archivo).
+    """
+    db_caso = db.query(models.Caso).filter(models.Caso.ID_Caso == caso_id).first()
+    if db_caso is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Caso no encontrado")
+
+    # --- Mapeos por archivo ---
+    nombres = [f.filename for f in excel_files]
+    try:
+        mapeos = json.loads(column_mappings)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="El mapeo de columnas no es un JSON válido.")
+    if isinstance(mapeos, list):
+        if len(mapeos) != len(excel_files):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Se recibieron {len(excel_files)} archivos y {len(mapeos)} mapeos de columnas.")
+    elif isinstance(mapeos, dict) and mapeos and all(isinstance(v, dict) for v in mapeos.values()):
+        sin_mapeo = [n for n in nombres if n not in mapeos]
+        if sin_mapeo:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Falta el mapeo de columnas para: {', '.join(sin_mapeo)}")
+        mapeos = [mapeos[n] for n in nombres]
+    elif isinstance(mapeos, dict):
+        mapeos = [mapeos] * len(excel_files)
+    else:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="El mapeo de columnas no es un JSON válido.")
+
+    # --- Nombres repetidos (en el lote o ya importados en el caso) ---
+    repetidos = sorted({n for n in nombres if nombres.count(n) > 1})
+    if repetidos:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Archivos repetidos en el lote: {', '.join(repetidos)}")
+    existentes = [a for (a,) in db.query(models.ArchivoExcel.Nombre_del_Archivo).filter(
+        models.ArchivoExcel.ID_Caso == caso_id,
+        models.ArchivoExcel.Nombre_del_Archivo.in_(nombres)
+    ).all()]
+    if existentes:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Ya existen archivos con estos nombres en este caso: {', '.join(existentes)}"
+        )
+
+    # --- Guardar archivos (lectura/normalización en paralelo, escritura serializada) ---
+    # Los archivos con contenido ya importado (o repetido en el lote) no se procesan. Solo se
+    # encola cuando todo el lote está guardado: si falla un archivo no queda nada del lote.
+    guardados = []
+    errores_archivos = {}
+    hashes_lote = {}
+    try:
+        for excel_file, mapeo in zip(excel_files, mapeos):
+            file_location = UPLOADS_DIR / excel_file.filename
+            try:
+                hash_contenido = importacion.guardar_con_hash(excel_file.file, file_location)
+            except Exception as e:
+                logger.error(f"Error CRÍTICO al guardar el archivo subido {excel_file.filename} en {file_location}: {e}", exc_info=True)
+                _eliminar_subida_sin_uso(db, file_location)
+                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"No se pudo guardar el archivo subido '{excel_file.filename}'.")
+            finally:
+                excel_file.file.close()
+            archivo_identico = importacion.buscar_archivo_identico(db, hash_contenido, caso_id)
+            if archivo_identico is not None or hash_contenido in hashes_lote:
+                original = archivo_identico.Nombre_del_Archivo if archivo_identico is not None else hashes_lote[hash_contenido]
+                caso_original = archivo_identico.ID_Caso if archivo_identico is not None else caso_id
+                errores_archivos[excel_file.filename] = f"Contenido idéntico al del archivo '{original}' del caso {caso_original}."
+                logger.warning(f"[Lote] {excel_file.filename} omitido: {errores_archivos[excel_file.filename]}")
+                _eliminar_subida_sin_uso(db, file_location)
+                continue
+            hashes_lote[hash_contenido] = excel_file.filename
+            guardados.append((excel_file.filename, file_location, mapeo, hash_contenido))
+    except Exception:
+        for _, file_location, _, _ in guardados:
+            _eliminar_subida_sin_uso(db, file_location)
+        logger.warning(f"[Lote] Subida del caso {caso_id} interrumpida; eliminados {len(guardados)} archivos ya guardados.")
+        raise
+
+    trabajos = [
+        trabajos_importacion.encolar_preparado(
+            caso_id, filename, tipo_archivo, file_location, mapeo, hash_contenido=hash_contenido
+        )
+        for filename, file_location, mapeo, hash_contenido in guardados
+    ]
+    logger.info(f"Lote de {len(trabajos)} archivos encolado para el caso {caso_id}.")
+    return trabajos, errores_archivos
 
 @app.get("/casos/{caso_id}/archivos", response_model=List[schemas.ArchivoExcel]) # Schema ya incluye Total_Registros
 def read_archivos_por_caso(caso_id: int, db: Session = Depends(get_db)):
@@ -688,6 +867,9 @@ def read_archivos_por_caso(caso_id: int, db: Session = Depends(get_db)):
 
 @app.get("/archivos/{id_archivo}/download")
 async def download_archivo(id_archivo: int, db: Session = Depends(get_db)):
+    return await en_hilo_bd(_respuesta_descarga, db, id_archivo)
+
+def _respuesta_descarga(db: Session, id_archivo: int) -> FileResponse:
     logger.info(f"Solicitud de descarga para archivo ID: {id_archivo}")
     archivo_db = db.query(models.ArchivoExcel).filter(models.ArchivoExcel.ID_Archivo == id_archivo).first()
     if archivo_db is None:
@@ -714,11 +896,16 @@ async def download_archivo(id_archivo: int, db: Session = Depends(get_db)):
             media_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
         elif archivo_db.Nombre_del_Archivo.lower().endswith('.csv'):
             media_type = 'text/csv'
+        elif archivo_db.Nombre_del_Archivo.lower().endswith('.parquet'):
+            media_type = 'application/vnd.apache.parquet'
     logger.info(f"[Download] Devolviendo: {file_path} ({media_type})")
     return FileResponse(path=file_path, filename=archivo_db.Nombre_del_Archivo, media_type=media_type)
 
 @app.delete("/archivos/{id_archivo}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_archivo(id_archivo: int, db: Session = Depends(get_db)):
+    await en_hilo_bd(_eliminar_archivo, db, id_archivo)
+
+def _eliminar_archivo(db: Session, id_archivo: int) -> None:
     logger.info(f"Solicitud DELETE para archivo ID: {id_archivo}")
     archivo_db = db.query(models.ArchivoExcel).filter(models.ArchivoExcel.ID_Archivo == id_archivo).first()
     if archivo_db is None:
@@ -731,6 +918,8 @@ async def delete_archivo(id_archivo: int, db: Session = Depends(get_db)):
     else:
         logger.warning(f"[Delete] Registro ID {id_archivo} sin nombre, no se borra archivo físico.")
     try:
+        versiones.asignar_caso(db, archivo_db.ID_Caso)
+        _eliminar_relevancias_de_archivo(db, id_archivo)
         lecturas_eliminadas = db.query(models.Lectura).filter(models.Lectura.ID_Archivo == id_archivo).delete()
         logger.info(f"[Delete] {lecturas_eliminadas} lecturas asociadas marcadas para eliminar.")
         if file_path_to_delete and os.path.isfile(file_path_to_delete):
@@ -829,17 +1018,22 @@ def read_lectores(
     
     # Aplicar paginación
     query = query.offset(skip).limit(limit)
-    lectores = query.all()
+    lectores = serializacion.lista_lectores(db, query.statement)
     logger.info(f"Devolviendo {len(lectores)} lectores para la página actual.")
     
-    return schemas.LectoresResponse(total_count=total_count or 0, lectores=lectores)
+    return serializacion.RespuestaJSONRapida({"total_count": total_count or 0, "lectores": lectores})
 
 # --- Rutas específicas ANTES de la ruta con parámetro {lector_id} ---
 
 @app.get("/lectores/coordenadas", response_model=List[schemas.LectorCoordenadas])
-def read_lectores_coordenadas(db: Session = Depends(get_db)):
+def read_lectores_coordenadas(request: Request, response: Response, db: Session = Depends(get_db)):
     """Devuelve una lista de lectores con coordenadas válidas para el mapa."""
     logger.info("Solicitud GET /lectores/coordenadas")
+    valor_etag = versiones.etag_tablas("lector")
+    no_modificado = versiones.no_modificado(request, valor_etag)
+    if no_modificado is not None:
+        return no_modificado
+    response.headers.update(versiones.cabeceras(valor_etag))
 
     # Consultar todos los lectores que tengan Coordenada_X Y Coordenada_Y no nulas
     lectores_con_coords = db.query(models.Lector).filter(
@@ -853,9 +1047,14 @@ def read_lectores_coordenadas(db: Session = Depends(get_db)):
     return lectores_con_coords
 
 @app.get("/lectores/sugerencias", response_model=schemas.LectorSugerenciasResponse)
-def get_lector_sugerencias(db: Session = Depends(get_db)):
+def get_lector_sugerencias(request: Request, response: Response, db: Session = Depends(get_db)):
     """Obtiene listas de valores únicos existentes para campos de Lector."""
     logger.info("Solicitud GET /lectores/sugerencias")
+    valor_etag = versiones.etag_tablas("lector")
+    no_modificado = versiones.no_modificado(request, valor_etag)
+    if no_modificado is not None:
+        return no_modificado
+    response.headers.update(versiones.cabeceras(valor_etag))
     sugerencias = {
         "provincias": [], "localidades": [], "carreteras": [], "organismos": [], "contactos": []
     }
@@ -943,14 +1142,26 @@ def delete_lector(lector_id: str, db: Session = Depends(get_db)):
     db_lector = db.query(models.Lector).filter(models.Lector.ID_Lector == lector_id).first()
     if db_lector is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Lector no encontrado")
-    lecturas_asociadas = db.query(models.Lectura).filter(models.Lectura.ID_Lector == lector_id).count()
+    lecturas_asociadas = db.query(models.Lectura).filter(models.Lectura.ID_Interno_Lector == db_lector.ID_Interno).count()
     if lecturas_asociadas > 0:
          raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"No se puede eliminar '{lector_id}', tiene {lecturas_asociadas} lecturas asociadas.")
     db.delete(db_lector)
     db.commit()
     return None
 
+def _filtro_lector(condicion):
+    """Lecturas cuyo lector cumple 'condicion' (sobre models.Lector), por su clave interna entera; para consultas sin JOIN a Lector."""
+    return models.Lectura.ID_Interno_Lector.in_(select(models.Lector.ID_Interno).where(condicion))
+
+def _lectores_del_caso(caso_id: int):
+    """Subconsulta con las claves internas de los lectores que tienen lecturas en el caso."""
+    return select(models.Lectura.ID_Interno_Lector).where(models.Lectura.ID_Caso == caso_id).distinct()
+
 # === VEHICULOS ===
+def _filtro_matricula(condicion):
+    """Lecturas cuya matrícula cumple 'condicion' (sobre models.Matricula.Matricula), resuelta en el diccionario."""
+    return models.Lectura.ID_Matricula.in_(select(models.Matricula.ID_Matricula).where(condicion))
+
 @app.post("/vehiculos", response_model=schemas.Vehiculo, status_code=status.HTTP_201_CREATED, tags=["Vehículos"])
 def create_vehiculo(vehiculo: schemas.VehiculoCreate, db: Session = Depends(get_db)):
     """Crea un nuevo vehículo o devuelve el existente si la matrícula ya existe."""
@@ -1017,38 +1228,30 @@ def get_vehiculos_por_caso(caso_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Caso con ID {caso_id} no encontrado")
 
     # Subconsulta para obtener las matrículas únicas de las lecturas de este caso
-    matriculas_en_caso_query = db.query(models.Lectura.Matricula)\
-        .join(models.ArchivoExcel, models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo)\
-        .filter(models.ArchivoExcel.ID_Caso == caso_id)\
-        .distinct()
+    matriculas_en_caso_query = select(models.Matricula.Matricula)\
+        .where(models.Matricula.ID_Matricula.in_(
+            select(models.Lectura.ID_Matricula).where(models.Lectura.ID_Caso == caso_id)
+        ))
 
     # Obtener los vehículos cuya matrícula está en la subconsulta
-    vehiculos_db = db.query(models.Vehiculo)\
-        .filter(models.Vehiculo.Matricula.in_(matriculas_en_caso_query))\
-        .order_by(models.Vehiculo.Matricula)\
+    vehiculos_query = select(models.Vehiculo)\
+        .where(models.Vehiculo.Matricula.in_(matriculas_en_caso_query))\
+        .order_by(models.Vehiculo.Matricula)
+
+    # Conteo de lecturas LPR por matrícula DENTRO del caso, agrupando por el ID entero
+    conteos_lpr = dict(
+        db.query(models.Matricula.Matricula, func.count(models.Lectura.ID_Lectura))
+        .join(models.Lectura, models.Lectura.ID_Matricula == models.Matricula.ID_Matricula)
+        .filter(models.Lectura.ID_Caso == caso_id, models.Lectura.Tipo_Fuente == 'LPR')
+        .group_by(models.Lectura.ID_Matricula)
         .all()
+    )
 
-    # --- NUEVO: Calcular conteo de lecturas LPR por vehículo DENTRO del caso --- 
-    vehiculos_con_conteo = []
-    for vehiculo in vehiculos_db:
-        # Contar lecturas LPR para esta matrícula DENTRO de este caso
-        count_lpr = db.query(func.count(models.Lectura.ID_Lectura))\
-                      .join(models.ArchivoExcel, models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo)\
-                      .filter(
-                          models.ArchivoExcel.ID_Caso == caso_id, 
-                          models.Lectura.Matricula == vehiculo.Matricula,
-                          models.Lectura.Tipo_Fuente == 'LPR' # Solo contar LPR
-                      ).scalar() or 0
-        
-        # Convertir el objeto SQLAlchemy a un diccionario o usar el schema
-        vehiculo_schema = schemas.Vehiculo.model_validate(vehiculo, from_attributes=True)
-        vehiculo_schema.total_lecturas_lpr_caso = count_lpr # Asignar el conteo
-        vehiculos_con_conteo.append(vehiculo_schema)
-        logger.debug(f"Vehículo {vehiculo.Matricula}: Conteo LPR en caso {caso_id} = {count_lpr}")
-    # --- FIN NUEVO ---
+    # Vehículos con el conteo de lecturas LPR del caso en total_lecturas_lpr_caso
+    vehiculos_con_conteo = serializacion.lista_vehiculos(db, vehiculos_query, conteos_lpr)
     
     logger.info(f"Encontrados {len(vehiculos_con_conteo)} vehículos para el caso ID {caso_id} con conteo LPR.")
-    return vehiculos_con_conteo # Devolver la lista con el conteo añadido
+    return serializacion.RespuestaJSONRapida(vehiculos_con_conteo) # Devolver la lista con el conteo añadido
 
 @app.get("/vehiculos/{vehiculo_id}/lecturas", response_model=List[schemas.Lectura], tags=["Vehículos"])
 def get_lecturas_por_vehiculo(
@@ -1064,18 +1267,16 @@ def get_lecturas_por_vehiculo(
     if not db_vehiculo:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Vehículo con ID {vehiculo_id} no encontrado")
 
-    query = db.query(models.Lectura).filter(models.Lectura.Matricula == db_vehiculo.Matricula)
+    query = db.query(models.Lectura).filter(_filtro_matricula(models.Matricula.Matricula == db_vehiculo.Matricula))
 
     if caso_id is not None:
-        # Si se proporciona caso_id, necesitamos unir con ArchivoExcel para filtrar
-        query = query.join(models.ArchivoExcel, models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo)\
-                     .filter(models.ArchivoExcel.ID_Caso == caso_id)
+        query = query.filter(models.Lectura.ID_Caso == caso_id)
 
-    lecturas = query.order_by(models.Lectura.Fecha_y_Hora.asc()).all()
+    lecturas = serializacion.SerializadorLecturas(db).lista(query.order_by(models.Lectura.Fecha_y_Hora.asc()))
     
     logger.info(f"Encontradas {len(lecturas)} lecturas para el vehículo ID {vehiculo_id} (Matrícula: {db_vehiculo.Matricula})" + (f" en caso ID {caso_id}" if caso_id else ""))
-    # Devolvemos las lecturas con el lector asociado cargado (si existe)
-    return [schemas.Lectura.model_validate(lect, from_attributes=True) for lect in lecturas]
+    # Devolvemos las lecturas con el lector asociado (si existe)
+    return serializacion.RespuestaJSONRapida(lecturas)
 
 @app.delete("/vehiculos/{vehiculo_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Vehículos"])
 def delete_vehiculo(vehiculo_id: int, db: Session = Depends(get_db)):
@@ -1100,9 +1301,135 @@ def delete_vehiculo(vehiculo_id: int, db: Session = Depends(get_db)):
 
 
 # === LECTURAS ===
-@app.get("/lecturas", response_model=List[schemas.Lectura])
+def _minuto_del_dia(hora: str) -> int:
+    """'HH:MM' -> minutos desde medianoche. Lanza ValueError si el formato no es válido."""
+    hora_time = datetime.strptime(hora, "%H:%M").time()
+    return hora_time.hour * 60 + hora_time.minute
+
+def _franja_horaria(hora_inicio: Optional[str], hora_fin: Optional[str]):
+    """
+    Condición por rango sobre Lectura.Minuto_del_Dia (indexable), o None sin filtro horario.
+    Si hora_inicio > hora_fin la franja cruza la medianoche: 22:00-04:00 es >= 22:00 o <= 04:00.
+    """
+    columna = models.Lectura.Minuto_del_Dia
+    desde = _minuto_del_dia(hora_inicio) if hora_inicio else None
+    hasta = _minuto_del_dia(hora_fin) if hora_fin else None
+    if desde is not None and hasta is not None:
+        if desde <= hasta:
+            return columna.between(desde, hasta)
+        return or_(columna >= desde, columna <= hasta)
+    if desde is not None:
+        return columna >= desde
+    if hasta is not None:
+        return columna <= hasta
+    return None
+
+TAMANO_PAGINA_LECTURAS = 1000
+TAMANO_PAGINA_LECTURAS_MAX = 10000
+
+def _codificar_cursor(lectura: dict) -> str:
+    """Cursor opaco con la clave (Fecha_y_Hora en microsegundos, ID_Lectura) de la última lectura de la página."""
+    clave = json.dumps([models.a_epoch(lectura["Fecha_y_Hora"]), lectura["ID_Lectura"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(clave.encode()).decode().rstrip("=")
+
+def _decodificar_cursor(cursor: str) -> Tuple[int, int]:
+    try:
+        fecha, id_lectura = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return int(fecha), int(id_lectura)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor de paginación inválido.")
+
+def _pagina_lecturas(query, cursor: Optional[str], tamano_pagina: Optional[int], incluir_total: bool, descendente: bool,
+                     normalizado: bool = False) -> dict:
+    """
+    Paginación por clave (keyset) sobre (Fecha_y_Hora, ID_Lectura): en lugar de OFFSET, cada página
+    continúa tras la última clave devuelta, así que su coste no depende de la profundidad.
+    Devuelve el contenido de schemas.LecturasPagina (o LecturasNormalizadas), ya serializado (ver serializacion).
+    El total exacto recorre todo el conjunto filtrado: solo se calcula si se pide (incluir_total)
+    y en la primera página; si no, es None.
+    """
+    tamano_pagina = tamano_pagina or TAMANO_PAGINA_LECTURAS
+    total = None
+    if incluir_total and cursor is None:
+        # COUNT directo sobre los filtros, sin envolver la consulta completa en una subconsulta
+        total = query.with_entities(func.count(models.Lectura.ID_Lectura)).order_by(None).scalar()
+
+    clave = tuple_(models.Lectura.Fecha_y_Hora, models.Lectura.ID_Lectura)
+    if cursor is not None:
+        posicion = tuple_(*_decodificar_cursor(cursor))
+        query = query.filter(clave < posicion if descendente else clave > posicion)
+    if descendente:
+        query = query.order_by(models.Lectura.Fecha_y_Hora.desc(), models.Lectura.ID_Lectura.desc())
+    else:
+        query = query.order_by(models.Lectura.Fecha_y_Hora.asc(), models.Lectura.ID_Lectura.asc())
+
+    # Una fila de más indica si hay página siguiente sin necesidad de contar
+    serializador = serializacion.SerializadorLecturas(query.session, normalizado=normalizado)
+    lecturas = serializador.lista(query.limit(tamano_pagina + 1))
+    hay_mas = len(lecturas) > tamano_pagina
+    lecturas = lecturas[:tamano_pagina]
+    next_cursor = _codificar_cursor(lecturas[-1]) if hay_mas else None
+    if normalizado:
+        return serializador.envoltorio(lecturas, next_cursor=next_cursor, total=total)
+    return {"lecturas": lecturas, "next_cursor": next_cursor, "total": total}
+
+def _lista_lecturas(query, normalizado: bool):
+    """Todas las lecturas de 'query': lista de schemas.Lectura o, normalizadas, schemas.LecturasNormalizadas."""
+    serializador = serializacion.SerializadorLecturas(query.session, normalizado=normalizado)
+    lecturas = serializador.lista(query)
+    return serializador.envoltorio(lecturas) if normalizado else lecturas
+
+def _respuesta_cacheada(endpoint: str, caso_ids: Optional[List[int]], filtros: dict, generar, descripcion: str) -> Response:
+    """
+    Cuerpo JSON desde la caché de resultados (cache_lecturas) o, si no está, el de 'generar()'
+    (contenido ya con la forma del response_model), que se guarda para la próxima vez.
+    """
+    clave = cache_lecturas.clave(endpoint, caso_ids, filtros)
+    contenido = cache_lecturas.cache.obtener(clave)
+    if contenido is not None:
+        logger.info(f"{descripcion} - Respuesta servida desde la caché ({len(contenido)} bytes).")
+    else:
+        contenido = serializacion.dumps(generar())
+        cache_lecturas.cache.guardar(clave, contenido, caso_ids)
+    return Response(contenido, media_type="application/json")
+
+def _respuesta_ndjson(query, descripcion: str) -> StreamingResponse:
+    """
+    Envía las lecturas de 'query' como NDJSON (una lectura por línea) a medida que se leen con
+    yield_per, sin materializar la lista completa. Usa su propia sesión: la de get_db se cierra
+    al salir del endpoint, antes de que termine el envío. Cada bloque enviado es un lote entero,
+    para que el middleware de compresión trabaje con bloques grandes y no línea a línea.
+    """
+    def generar():
+        sesion = SessionLocal()
+        enviadas = 0
+        try:
+            for lote in serializacion.SerializadorLecturas(sesion).lotes(query):
+                yield b"".join(serializacion.dumps(lectura) + b"\n" for lectura in lote)
+                enviadas += len(lote)
+            logger.info(f"{descripcion} - Enviadas {enviadas} lecturas en NDJSON.")
+        except Exception as e:
+            logger.error(f"{descripcion} - Error tras enviar {enviadas} lecturas en NDJSON: {e}", exc_info=True)
+            raise
+        finally:
+            sesion.close()
+    return StreamingResponse(generar(), media_type="application/x-ndjson")
+
+def _comprobar_formato(formato: str, cursor: Optional[str], tamano_pagina: Optional[int], normalizado: bool = False) -> None:
+    if formato == "ndjson" and (cursor is not None or tamano_pagina is not None):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="El formato ndjson envía todas las lecturas; no admite cursor ni tamano_pagina.")
+    if formato == "ndjson" and normalizado:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="El formato ndjson no admite la respuesta normalizada.")
+
+@app.get("/lecturas", response_model=Union[List[schemas.Lectura], schemas.LecturasPagina, schemas.LecturasNormalizadas])
 def read_lecturas(
     skip: int = 0, limit: int = 100000,  # Aumentado de 2000 a 100000
+    # Paginación por cursor: si se indica cursor o tamano_pagina se devuelve schemas.LecturasPagina
+    cursor: Optional[str] = None,
+    tamano_pagina: Optional[int] = Query(None, ge=1, le=TAMANO_PAGINA_LECTURAS_MAX),
+    incluir_total: bool = False,
+    # Respuesta normalizada (schemas.LecturasNormalizadas): lectores, archivos y casos una sola vez
+    normalizado: bool = False,
     # Filtros de Fecha/Hora
     fecha_inicio: Optional[str] = None,
     fecha_fin: Optional[str] = None,
@@ -1127,9 +1454,9 @@ def read_lecturas(
     
     # --- Aplicar filtros comunes ---
     if caso_ids:
-        base_query = base_query.join(models.ArchivoExcel).filter(models.ArchivoExcel.ID_Caso.in_(caso_ids))
+        base_query = base_query.filter(models.Lectura.ID_Caso.in_(caso_ids))
     if lector_ids:
-        base_query = base_query.filter(models.Lectura.ID_Lector.in_(lector_ids))
+        base_query = base_query.filter(models.Lector.ID_Lector.in_(lector_ids))
     if carretera_ids:
         base_query = base_query.filter(models.Lector.Carretera.in_(carretera_ids))
     if sentido:
@@ -1147,12 +1474,8 @@ def read_lecturas(
         if fecha_fin:
             fecha_fin_dt = datetime.strptime(fecha_fin, "%Y-%m-%d").date() + timedelta(days=1)
             base_query = base_query.filter(models.Lectura.Fecha_y_Hora < fecha_fin_dt)
-        if hora_inicio:
-            hora_inicio_time = datetime.strptime(hora_inicio, "%H:%M").time()
-            base_query = base_query.filter(extract('hour', models.Lectura.Fecha_y_Hora) * 100 + extract('minute', models.Lectura.Fecha_y_Hora) >= hora_inicio_time.hour * 100 + hora_inicio_time.minute)
-        if hora_fin:
-            hora_fin_time = datetime.strptime(hora_fin, "%H:%M").time()
-            base_query = base_query.filter(extract('hour', models.Lectura.Fecha_y_Hora) * 100 + extract('minute', models.Lectura.Fecha_y_Hora) <= hora_fin_time.hour * 100 + hora_fin_time.minute)
+        if hora_inicio or hora_fin:
+            base_query = base_query.filter(_franja_horaria(hora_inicio, hora_fin))
     except ValueError:
         logger.warning("Formato de fecha/hora inválido recibido.")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Formato de fecha/hora inválido.")
@@ -1163,9 +1486,9 @@ def read_lecturas(
         for m in matricula:
             sql_pattern = m.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_').replace('?', '_').replace('*', '%')
             if '*' in m or '%' in m or '?' in m or '_' in m:
-                condiciones.append(models.Lectura.Matricula.ilike(sql_pattern))
+                condiciones.append(_filtro_matricula(models.Matricula.Matricula.ilike(sql_pattern)))
             else:
-                condiciones.append(models.Lectura.Matricula == m)
+                condiciones.append(_filtro_matricula(models.Matricula.Matricula == m))
         if condiciones:
             base_query = base_query.filter(or_(*condiciones))
 
@@ -1173,15 +1496,15 @@ def read_lecturas(
     if min_pasos is not None or max_pasos is not None:
         # Crear una subconsulta con los mismos filtros para contar pasos
         pasos_subquery = (
-            db.query(models.Lectura.Matricula, func.count('*').label('num_pasos'))
+            db.query(models.Lectura.ID_Matricula, func.count('*').label('num_pasos'))
             .join(models.Lector)
         )
         
         # Aplicar los mismos filtros a la subconsulta
         if caso_ids:
-            pasos_subquery = pasos_subquery.join(models.ArchivoExcel).filter(models.ArchivoExcel.ID_Caso.in_(caso_ids))
+            pasos_subquery = pasos_subquery.filter(models.Lectura.ID_Caso.in_(caso_ids))
         if lector_ids:
-            pasos_subquery = pasos_subquery.filter(models.Lectura.ID_Lector.in_(lector_ids))
+            pasos_subquery = pasos_subquery.filter(models.Lector.ID_Lector.in_(lector_ids))
         if carretera_ids:
             pasos_subquery = pasos_subquery.filter(models.Lector.Carretera.in_(carretera_ids))
         if sentido:
@@ -1199,19 +1522,15 @@ def read_lecturas(
             if fecha_fin:
                 fecha_fin_dt = datetime.strptime(fecha_fin, "%Y-%m-%d").date() + timedelta(days=1)
                 pasos_subquery = pasos_subquery.filter(models.Lectura.Fecha_y_Hora < fecha_fin_dt)
-            if hora_inicio:
-                hora_inicio_time = datetime.strptime(hora_inicio, "%H:%M").time()
-                pasos_subquery = pasos_subquery.filter(extract('hour', models.Lectura.Fecha_y_Hora) * 100 + extract('minute', models.Lectura.Fecha_y_Hora) >= hora_inicio_time.hour * 100 + hora_inicio_time.minute)
-            if hora_fin:
-                hora_fin_time = datetime.strptime(hora_fin, "%H:%M").time()
-                pasos_subquery = pasos_subquery.filter(extract('hour', models.Lectura.Fecha_y_Hora) * 100 + extract('minute', models.Lectura.Fecha_y_Hora) <= hora_fin_time.hour * 100 + hora_fin_time.minute)
+            if hora_inicio or hora_fin:
+                pasos_subquery = pasos_subquery.filter(_franja_horaria(hora_inicio, hora_fin))
         except ValueError:
             logger.warning("Formato de fecha/hora inválido recibido en subconsulta de pasos.")
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Formato de fecha/hora inválido.")
 
         # Agrupar y filtrar por número de pasos
         pasos_subquery = (
-            pasos_subquery.group_by(models.Lectura.Matricula)
+            pasos_subquery.group_by(models.Lectura.ID_Matricula)
             .having(and_(
                 func.count('*') >= min_pasos if min_pasos is not None else True,
                 func.count('*') <= max_pasos if max_pasos is not None else True
@@ -1220,18 +1539,21 @@ def read_lecturas(
 
         # Filtrar la consulta principal para incluir solo las matrículas que cumplen con los criterios de pasos
         base_query = base_query.filter(
-            models.Lectura.Matricula.in_(
-                pasos_subquery.with_entities(models.Lectura.Matricula)
+            models.Lectura.ID_Matricula.in_(
+                pasos_subquery.with_entities(models.Lectura.ID_Matricula)
             )
         )
 
     # Ordenar y aplicar paginación
+    if cursor is not None or tamano_pagina is not None:
+        pagina = _pagina_lecturas(base_query, cursor, tamano_pagina, incluir_total, descendente=True, normalizado=normalizado)
+        logger.info(f"GET /lecturas - Página de {len(pagina['lecturas'])} lecturas tras aplicar filtros.")
+        return serializacion.RespuestaJSONRapida(pagina)
     query = base_query.order_by(models.Lectura.Fecha_y_Hora.desc())
-    query = query.options(joinedload(models.Lectura.lector))
-    lecturas = query.offset(skip).limit(limit).all()
+    lecturas = _lista_lecturas(query.offset(skip).limit(limit), normalizado)
 
-    logger.info(f"GET /lecturas - Encontradas {len(lecturas)} lecturas tras aplicar filtros.")
-    return lecturas
+    logger.info(f"GET /lecturas - Encontradas {len(lecturas['lecturas'] if normalizado else lecturas)} lecturas tras aplicar filtros.")
+    return serializacion.RespuestaJSONRapida(lecturas)
 
 
 # === NUEVO: Endpoints para Lecturas Relevantes ===
@@ -1259,6 +1581,7 @@ def marcar_lectura_relevante(
              logger.info(f"Validación de caso OK: Lectura {id_lectura} pertenece a caso {payload.caso_id}.")
     # --- Fin Validación --- 
     
+    versiones.asignar_caso(db, db_lectura.ID_Caso)
     # Verificar si ya está marcada
     db_relevante_existente = db.query(models.LecturaRelevante).filter(models.LecturaRelevante.ID_Lectura == id_lectura).first()
     if db_relevante_existente:
@@ -1296,6 +1619,7 @@ def desmarcar_lectura_relevante(id_lectura: int, db: Session = Depends(get_db)):
     if not db_relevante:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="La lectura no estaba marcada como relevante.")
 
+    versiones.asignar_caso(db, db.query(models.Lectura.ID_Caso).filter(models.Lectura.ID_Lectura == id_lectura).scalar())
     db.delete(db_relevante)
     try:
         db.commit()
@@ -1313,6 +1637,7 @@ def actualizar_nota_relevante(id_relevante: int, nota_update: schemas.LecturaRel
     if not db_relevante:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Registro de lectura relevante no encontrado.")
 
+    versiones.asignar_caso(db, db.query(models.Lectura.ID_Caso).filter(models.Lectura.ID_Lectura == db_relevante.ID_Lectura).scalar())
     # Actualizar la nota (permitir string vacío o null para borrarla)
     db_relevante.Nota = nota_update.Nota
     try:
@@ -1326,6 +1651,18 @@ def actualizar_nota_relevante(id_relevante: int, nota_update: schemas.LecturaRel
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Error al actualizar la nota.")
 
 
+@app.get("/cache/estadisticas", tags=["Admin"])
+def get_estadisticas_cache():
+    """Aciertos, fallos, expulsiones y ocupación de la caché de resultados de lecturas."""
+    return cache_lecturas.cache.estadisticas()
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False, dependencies=[Depends(metricas.comprobar_cliente)])
+def get_metrics():
+    """Métricas en formato de texto de Prometheus (solo para metricas.CLIENTES_PERMITIDOS)."""
+    return PlainTextResponse(metricas.registro.prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # === ENDPOINT DE PRUEBA ===
 @app.get("/ping")
 async def pong():
@@ -1353,14 +1690,13 @@ def read_lecturas_por_matriculas(
                   .options(joinedload(models.Lectura.lector)) # Eager load lector
         
         # Filtrar por las matrículas proporcionadas
-        query = query.filter(models.Lectura.Matricula.in_(request_data.matriculas))
+        query = query.filter(_filtro_matricula(models.Matricula.Matricula.in_(request_data.matriculas)))
 
         # Filtrar por tipo de fuente
         query = query.filter(models.Lectura.Tipo_Fuente == request_data.tipo_fuente)
 
-        # Filtrar por caso_id (requiere join)
-        query = query.join(models.ArchivoExcel)\
-                     .filter(models.ArchivoExcel.ID_Caso == request_data.caso_id)
+        # Filtrar por caso_id
+        query = query.filter(models.Lectura.ID_Caso == request_data.caso_id)
         
         # Podríamos añadir aquí filtros adicionales si vinieran en el request_data (fechas, etc.)
         
@@ -1379,30 +1715,29 @@ def read_lecturas_por_matriculas(
 
 # --- NUEVO: Endpoint para obtener filtros disponibles para un caso específico ---
 @app.get("/casos/{caso_id}/filtros_disponibles", response_model=schemas.FiltrosDisponiblesResponse)
-async def get_filtros_disponibles_por_caso(caso_id: int, db: Session = Depends(get_db)):
+async def get_filtros_disponibles_por_caso(caso_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
     logger.info(f"GET /casos/{caso_id}/filtros_disponibles - Obteniendo lectores y carreteras únicos.")
+    # Depende de las lecturas del caso y de los datos de los lectores
+    valor_etag = versiones.etag_caso(caso_id, "lector")
+    no_modificado = versiones.no_modificado(request, valor_etag)
+    if no_modificado is not None:
+        return no_modificado
+    response.headers.update(versiones.cabeceras(valor_etag))
+    return await en_hilo_bd(_filtros_disponibles, db, caso_id)
+
+def _filtros_disponibles(db: Session, caso_id: int) -> schemas.FiltrosDisponiblesResponse:
     try:
-        # 1. Encontrar ID_Lector únicos para el caso
-        distinct_lector_ids = db.query(models.Lectura.ID_Lector)\
-                                .join(models.ArchivoExcel, models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo)\
-                                .filter(models.ArchivoExcel.ID_Caso == caso_id)\
-                                .distinct()\
-                                .all()
-        
-        # Extraer los IDs de la lista de tuplas
-        lector_ids_list = [lector_id[0] for lector_id in distinct_lector_ids if lector_id[0] is not None]
-        logger.debug(f"Lectores únicos encontrados para caso {caso_id}: {lector_ids_list}")
-        
-        if not lector_ids_list:
-            # Si no hay lecturas/lectores para este caso, devolver listas vacías
-            logger.warning(f"No se encontraron lectores con lecturas para el caso {caso_id}.")
-            return schemas.FiltrosDisponiblesResponse(lectores=[], carreteras=[])
-
-        # 2. Obtener detalles de esos lectores (incluyendo la carretera)
+        # 1-2. Lectores con lecturas en el caso (incluyendo la carretera), por su clave interna
         lectores_en_caso = db.query(models.Lector)\
-                             .filter(models.Lector.ID_Lector.in_(lector_ids_list))\
+                             .filter(models.Lector.ID_Interno.in_(_lectores_del_caso(caso_id)))\
                              .order_by(models.Lector.Nombre)\
                              .all()
+        logger.debug(f"Lectores únicos encontrados para caso {caso_id}: {[l.ID_Lector for l in lectores_en_caso]}")
+
+        if not lectores_en_caso:
+            # Si no hay lecturas/lectores para este caso, devolver listas vacías
+            logger.warning(f"No se encontraron lectores con lecturas para el caso {caso_id}.")
+            return schemas.FiltrosDisponiblesResponse(lectores=[], carreteras=[])
 
         # 3. Formatear lectores para SelectOption
         lectores_options: List[schemas.SelectOption] = [
@@ -1431,16 +1766,15 @@ async def get_lecturas_relevantes_por_caso(caso_id: int, db: Session = Depends(g
     """
     logger.info(f"GET /casos/{caso_id}/lecturas_relevantes - Obteniendo lecturas relevantes.")
     try:
-        lecturas_relevantes = db.query(models.Lectura)\
-            .options(joinedload(models.Lectura.lector), joinedload(models.Lectura.relevancia))\
+        query = db.query(models.Lectura)\
             .join(models.LecturaRelevante, models.Lectura.ID_Lectura == models.LecturaRelevante.ID_Lectura)\
-            .join(models.ArchivoExcel, models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo)\
-            .filter(models.ArchivoExcel.ID_Caso == caso_id)\
-            .order_by(models.Lectura.Fecha_y_Hora)\
-            .all()
-        
+            .filter(models.Lectura.ID_Caso == caso_id)\
+            .order_by(models.Lectura.Fecha_y_Hora)
+        # Consulta y serialización en un hilo (sin cargas perezosas posteriores en el bucle de eventos)
+        lecturas_relevantes = await en_hilo_bd(serializacion.SerializadorLecturas(db).lista, query)
+
         logger.info(f"Encontradas {len(lecturas_relevantes)} lecturas relevantes para el caso {caso_id}.")
-        return lecturas_relevantes
+        return serializacion.RespuestaJSONRapida(lecturas_relevantes)
 
     except Exception as e:
         logger.error(f"Error al obtener lecturas relevantes para caso {caso_id}: {e}", exc_info=True)
@@ -1527,7 +1861,7 @@ def delete_saved_search(search_id: int, db: Session = Depends(get_db)):
 
 # === NUEVO ENDPOINT PARA LECTURAS DEL MAPA ===
 @app.get("/casos/{caso_id}/lecturas_para_mapa", response_model=List[schemas.LectorCoordenadas], tags=["Casos"])
-def get_lecturas_para_mapa(caso_id: int, db: Session = Depends(get_db)):
+def get_lecturas_para_mapa(caso_id: int, request: Request, db: Session = Depends(get_db)):
     """
     Obtiene una lista de lectores únicos con coordenadas válidas 
     asociados a las lecturas de un caso específico.
@@ -1541,39 +1875,26 @@ def get_lecturas_para_mapa(caso_id: int, db: Session = Depends(get_db)):
         logger.warning(f"Caso ID {caso_id} no encontrado para obtener lecturas de mapa.")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Caso no encontrado")
 
-    try:
-        # Consultar Lecturas asociadas al caso a través de ArchivoExcel, cargando el Lector
-        lecturas_con_lector = db.query(models.Lectura)\
-            .join(models.ArchivoExcel, models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo)\
-            .options(joinedload(models.Lectura.lector))\
-            .filter(models.ArchivoExcel.ID_Caso == caso_id)\
-            .all()
+    # Depende de las lecturas del caso y de las coordenadas de los lectores
+    valor_etag = versiones.etag_caso(caso_id, "lector")
+    no_modificado = versiones.no_modificado(request, valor_etag)
+    if no_modificado is not None:
+        return no_modificado
 
-        lectores_unicos_mapa = {} # Usar dict para asegurar unicidad por ID_Lector
-
-        for lectura in lecturas_con_lector:
-            lector = lectura.lector
-            # Verificar si el lector existe, tiene coordenadas válidas y aún no está en nuestro dict
-            if (lector and 
-                lector.Coordenada_X is not None and 
-                lector.Coordenada_Y is not None and
-                lector.ID_Lector not in lectores_unicos_mapa):
-                
-                # Crear una instancia del schema Pydantic para la respuesta
-                lector_data = schemas.LectorCoordenadas(
-                    ID_Lector=lector.ID_Lector,
-                    Nombre=lector.Nombre,
-                    Coordenada_Y=lector.Coordenada_Y, # Latitud
-                    Coordenada_X=lector.Coordenada_X, # Longitud
-                    Provincia=lector.Provincia,
-                    Carretera=lector.Carretera,
-                    Organismo_Regulador=lector.Organismo_Regulador # Campo añadido a LectorCoordenadas
-                )
-                lectores_unicos_mapa[lector.ID_Lector] = lector_data
-
-        lista_lectores = list(lectores_unicos_mapa.values())
+    try:
+        # Lectores con lecturas en el caso y coordenadas válidas, resueltos en la base de datos
+        # (ya únicos: sin cargar cada lectura con su lector)
+        lista_lectores = serializacion.lista_lectores(
+            db,
+            select(models.Lector).where(
+                models.Lector.ID_Interno.in_(_lectores_del_caso(caso_id)),
+                models.Lector.Coordenada_X.isnot(None),
+                models.Lector.Coordenada_Y.isnot(None)
+            ).order_by(models.Lector.ID_Lector),
+            esquema=schemas.LectorCoordenadas
+        )
         logger.info(f"Encontrados {len(lista_lectores)} lectores únicos con coordenadas para el caso {caso_id}.")
-        return lista_lectores
+        return serializacion.RespuestaJSONRapida(lista_lectores, headers=versiones.cabeceras(valor_etag))
 
     except Exception as e:
         db.rollback()
@@ -1588,25 +1909,12 @@ def get_lectores_por_caso(caso_id: int, db: Session = Depends(get_db)):
     logger.info(f"GET /casos/{caso_id}/lectores - Obteniendo lectores asociados al caso.")
     
     try:
-        # Obtener IDs de lectores únicos que tienen lecturas en este caso
-        lectores_ids = db.query(models.Lectura.ID_Lector)\
-            .join(models.ArchivoExcel, models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo)\
-            .filter(models.ArchivoExcel.ID_Caso == caso_id)\
-            .distinct()\
-            .all()
-        
-        # Extraer los IDs de la lista de tuplas
-        lector_ids = [id[0] for id in lectores_ids if id[0] is not None]
-        
-        if not lector_ids:
-            return []
-            
-        # Obtener los detalles completos de los lectores
-        lectores = db.query(models.Lector)\
-            .filter(models.Lector.ID_Lector.in_(lector_ids))\
-            .all()
+        # Detalles completos de los lectores que tienen lecturas en este caso
+        lectores = serializacion.lista_lectores(
+            db, select(models.Lector).where(models.Lector.ID_Interno.in_(_lectores_del_caso(caso_id)))
+        )
             
-        return lectores
+        return serializacion.RespuestaJSONRapida(lectores)
         
     except Exception as e:
         logger.error(f"Error al obtener lectores para caso {caso_id}: {e}", exc_info=True)
@@ -1615,7 +1923,7 @@ def get_lectores_por_caso(caso_id: int, db: Session = Depends(get_db)):
             detail=f"Error interno al obtener lectores: {str(e)}"
         )
 
-@app.get("/casos/{caso_id}/lecturas", response_model=List[schemas.Lectura])
+@app.get("/casos/{caso_id}/lecturas", response_model=Union[List[schemas.Lectura], schemas.LecturasPagina, schemas.LecturasNormalizadas])
 def get_lecturas_por_caso(
     caso_id: int,
     matricula: Optional[str] = None,
@@ -1629,10 +1937,17 @@ def get_lecturas_por_caso(
     velocidad_min: Optional[float] = None,
     velocidad_max: Optional[float] = None,
     duracion_parada: Optional[int] = None,
+    cursor: Optional[str] = None,
+    tamano_pagina: Optional[int] = Query(None, ge=1, le=TAMANO_PAGINA_LECTURAS_MAX),
+    incluir_total: bool = False,
+    formato: str = Query("json", pattern="^(json|ndjson)$"),
+    normalizado: bool = False,
     db: Session = Depends(get_db)
 ):
     """
     Obtiene las lecturas de un caso específico con filtros opcionales.
+    Con cursor o tamano_pagina devuelve una página (schemas.LecturasPagina) en orden cronológico;
+    con formato=ndjson las envía en streaming, una por línea (no combinable con duracion_parada).
     """
     try:
         # Verificar si el caso existe
@@ -1642,12 +1957,11 @@ def get_lecturas_por_caso(
 
         # Construir la consulta base
         query = db.query(models.Lectura)\
-            .join(models.ArchivoExcel, models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo)\
-            .filter(models.ArchivoExcel.ID_Caso == caso_id)
+            .filter(models.Lectura.ID_Caso == caso_id)
 
         # Aplicar filtros
         if matricula:
-            query = query.filter(models.Lectura.Matricula == matricula)
+            query = query.filter(_filtro_matricula(models.Matricula.Matricula == matricula))
 
         if fecha_inicio:
             try:
@@ -1665,28 +1979,15 @@ def get_lecturas_por_caso(
                 logger.error(f"Error al parsear fecha_fin: {e}")
                 raise HTTPException(status_code=400, detail=f"Formato de fecha_fin inválido: {fecha_fin}. Use YYYY-MM-DD")
 
-        if hora_inicio:
+        if hora_inicio or hora_fin:
             try:
-                hora_time = datetime.strptime(hora_inicio, "%H:%M").time()
-                query = query.filter(extract('hour', models.Lectura.Fecha_y_Hora) * 100 + 
-                                  extract('minute', models.Lectura.Fecha_y_Hora) >= 
-                                  hora_time.hour * 100 + hora_time.minute)
+                query = query.filter(_franja_horaria(hora_inicio, hora_fin))
             except ValueError as e:
-                logger.error(f"Error al parsear hora_inicio: {e}")
-                raise HTTPException(status_code=400, detail=f"Formato de hora_inicio inválido: {hora_inicio}. Use HH:MM")
-
-        if hora_fin:
-            try:
-                hora_time = datetime.strptime(hora_fin, "%H:%M").time()
-                query = query.filter(extract('hour', models.Lectura.Fecha_y_Hora) * 100 + 
-                                  extract('minute', models.Lectura.Fecha_y_Hora) <= 
-                                  hora_time.hour * 100 + hora_time.minute)
-            except ValueError as e:
-                logger.error(f"Error al parsear hora_fin: {e}")
-                raise HTTPException(status_code=400, detail=f"Formato de hora_fin inválido: {hora_fin}. Use HH:MM")
+                logger.error(f"Error al parsear hora_inicio/hora_fin: {e}")
+                raise HTTPException(status_code=400, detail=f"Formato de hora inválido: {hora_inicio} - {hora_fin}. Use HH:MM")
 
         if lector_id:
-            query = query.filter(models.Lectura.ID_Lector == lector_id)
+            query = query.filter(_filtro_lector(models.Lector.ID_Lector == lector_id))
 
         if tipo_fuente:
             query = query.filter(models.Lectura.Tipo_Fuente == tipo_fuente)
@@ -1702,10 +2003,33 @@ def get_lecturas_por_caso(
         if velocidad_max is not None:
             query = query.filter(models.Lectura.Velocidad <= velocidad_max)
 
+        _comprobar_formato(formato, cursor, tamano_pagina, normalizado)
+        if normalizado and duracion_parada is not None:
+            raise HTTPException(status_code=400, detail="El filtro duracion_parada no admite la respuesta normalizada.")
+        if formato == "ndjson" and duracion_parada is not None:
+            raise HTTPException(status_code=400, detail="El filtro duracion_parada no admite el formato ndjson.")
+        if formato == "ndjson":
+            return _respuesta_ndjson(query.order_by(models.Lectura.Fecha_y_Hora, models.Lectura.ID_Lectura), f"GET /casos/{caso_id}/lecturas")
+
+        filtros_cache = {
+            "matricula": matricula, "fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin, "hora_inicio": hora_inicio,
+            "hora_fin": hora_fin, "lector_id": lector_id, "tipo_fuente": tipo_fuente, "solo_relevantes": solo_relevantes,
+            "velocidad_min": velocidad_min, "velocidad_max": velocidad_max, "cursor": cursor, "tamano_pagina": tamano_pagina,
+            "incluir_total": incluir_total, "normalizado": normalizado,
+        }
+        if cursor is not None or tamano_pagina is not None:
+            if duracion_parada is not None:
+                raise HTTPException(status_code=400, detail="El filtro duracion_parada no admite paginación por cursor.")
+            def generar_pagina():
+                pagina = _pagina_lecturas(query, cursor, tamano_pagina, incluir_total, descendente=False, normalizado=normalizado)
+                logger.info(f"Página de {len(pagina['lecturas'])} lecturas para el caso {caso_id}")
+                return pagina
+            return _respuesta_cacheada("casos/lecturas", [caso_id], filtros_cache, generar_pagina, f"GET /casos/{caso_id}/lecturas")
+
         # Filtro de duración de parada
         if duracion_parada is not None:
             # Obtener todas las lecturas ordenadas por matrícula y fecha/hora
-            lecturas_all = query.order_by(models.Lectura.Matricula, models.Lectura.Fecha_y_Hora).all()
+            lecturas_all = query.order_by(models.Lectura.ID_Matricula, models.Lectura.Fecha_y_Hora).all()
             paradas = []
             def haversine(lat1, lon1, lat2, lon2):
                 R = 6371000  # metros
@@ -1740,7 +2064,11 @@ def get_lecturas_por_caso(
                 paradas.append(LecturaSchema(**l1_dict))
             lecturas = paradas
         else:
-            lecturas = query.all()
+            def generar_lista():
+                lecturas = _lista_lecturas(query, normalizado)
+                logger.info(f"Encontradas {len(lecturas['lecturas'] if normalizado else lecturas)} lecturas para el caso {caso_id}")
+                return lecturas
+            return _respuesta_cacheada("casos/lecturas", [caso_id], filtros_cache, generar_lista, f"GET /casos/{caso_id}/lecturas")
 
         logger.info(f"Encontradas {len(lecturas)} lecturas para el caso {caso_id}")
         return lecturas
@@ -1765,15 +2093,17 @@ def get_sugerencias_matriculas(
     logger.info(f"GET /casos/{caso_id}/matriculas/sugerencias - query: {query}, limit: {limit}")
     
     try:
-        # Subconsulta optimizada para obtener matrículas únicas del caso
-        matriculas = db.query(models.Lectura.Matricula)\
-            .join(models.ArchivoExcel, models.Lectura.ID_Archivo == models.ArchivoExcel.ID_Archivo)\
+        # Buscar en el diccionario de matrículas (una fila por matrícula) las que tienen lecturas en el caso
+        en_caso = select(models.Lectura.ID_Lectura).where(
+            models.Lectura.ID_Caso == caso_id,
+            models.Lectura.ID_Matricula == models.Matricula.ID_Matricula
+        ).exists()
+        matriculas = db.query(models.Matricula.Matricula)\
             .filter(
-                models.ArchivoExcel.ID_Caso == caso_id,
-                models.Lectura.Matricula.ilike(f"%{query}%")
+                models.Matricula.Matricula.ilike(f"%{query}%"),
+                en_caso
             )\
-            .distinct()\
-            .order_by(models.Lectura.Matricula)\
+            .order_by(models.Matricula.Matricula)\
             .limit(limit)\
             .all()
         
@@ -1857,7 +2187,7 @@ def update_caso(caso_id: int, caso_update: schemas.CasoUpdate, db: Session = Dep
     db.refresh(db_caso)
     return db_caso
 
-@app.post("/lecturas/por_filtros", response_model=List[schemas.Lectura])
+@app.post("/lecturas/por_filtros", response_model=Union[List[schemas.Lectura], schemas.LecturasPagina, schemas.LecturasNormalizadas])
 def read_lecturas_por_filtros(
     # Filtros de Fecha/Hora
     fecha_inicio: Optional[str] = None,
@@ -1875,18 +2205,23 @@ def read_lecturas_por_filtros(
     solo_relevantes: Optional[bool] = False,
     min_pasos: Optional[int] = None,
     max_pasos: Optional[int] = None,
+    cursor: Optional[str] = None,
+    tamano_pagina: Optional[int] = Query(None, ge=1, le=TAMANO_PAGINA_LECTURAS_MAX),
+    incluir_total: bool = False,
+    formato: str = Query("json", pattern="^(json|ndjson)$"),
+    normalizado: bool = False,
     db: Session = Depends(get_db)
 ):
     logger.info(f"POST /lecturas/por_filtros - Filtros: matricula={matricula} matriculas={matriculas} min_pasos={min_pasos} max_pasos={max_pasos} carreteras={carretera_ids}")
     
     # Base query
-    base_query = db.query(models.Lectura).join(models.Lector).join(models.ArchivoExcel)
+    base_query = db.query(models.Lectura).join(models.Lector)
     
     # --- Aplicar filtros comunes ---
     if caso_ids:
-        base_query = base_query.filter(models.ArchivoExcel.ID_Caso.in_(caso_ids))
+        base_query = base_query.filter(models.Lectura.ID_Caso.in_(caso_ids))
     if lector_ids:
-        base_query = base_query.filter(models.Lectura.ID_Lector.in_(lector_ids))
+        base_query = base_query.filter(models.Lector.ID_Lector.in_(lector_ids))
     if carretera_ids:
         base_query = base_query.filter(models.Lector.Carretera.in_(carretera_ids))
     if sentido:
@@ -1904,12 +2239,8 @@ def read_lecturas_por_filtros(
         if fecha_fin:
             fecha_fin_dt = datetime.strptime(fecha_fin, "%Y-%m-%d").date() + timedelta(days=1)
             base_query = base_query.filter(models.Lectura.Fecha_y_Hora < fecha_fin_dt)
-        if hora_inicio:
-            hora_inicio_time = datetime.strptime(hora_inicio, "%H:%M").time()
-            base_query = base_query.filter(extract('hour', models.Lectura.Fecha_y_Hora) * 100 + extract('minute', models.Lectura.Fecha_y_Hora) >= hora_inicio_time.hour * 100 + hora_inicio_time.minute)
-        if hora_fin:
-            hora_fin_time = datetime.strptime(hora_fin, "%H:%M").time()
-            base_query = base_query.filter(extract('hour', models.Lectura.Fecha_y_Hora) * 100 + extract('minute', models.Lectura.Fecha_y_Hora) <= hora_fin_time.hour * 100 + hora_fin_time.minute)
+        if hora_inicio or hora_fin:
+            base_query = base_query.filter(_franja_horaria(hora_inicio, hora_fin))
     except ValueError:
         logger.warning("Formato de fecha/hora inválido recibido.")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Formato de fecha/hora inválido.")
@@ -1920,26 +2251,43 @@ def read_lecturas_por_filtros(
     if matricula:
         sql_pattern = matricula.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_').replace('?', '_').replace('*', '%')
         if '*' in matricula or '%' in matricula or '?' in matricula or '_' in matricula:
-            condiciones.append(models.Lectura.Matricula.ilike(sql_pattern))
+            condiciones.append(_filtro_matricula(models.Matricula.Matricula.ilike(sql_pattern)))
         else:
-            condiciones.append(models.Lectura.Matricula == matricula)
+            condiciones.append(_filtro_matricula(models.Matricula.Matricula == matricula))
     if matriculas:
         for m in matriculas:
             sql_pattern = m.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_').replace('?', '_').replace('*', '%')
             if '*' in m or '%' in m or '?' in m or '_' in m:
-                condiciones.append(models.Lectura.Matricula.ilike(sql_pattern))
+                condiciones.append(_filtro_matricula(models.Matricula.Matricula.ilike(sql_pattern)))
             else:
-                condiciones.append(models.Lectura.Matricula == m)
+                condiciones.append(_filtro_matricula(models.Matricula.Matricula == m))
     if condiciones:
         base_query = base_query.filter(or_(*condiciones))
 
     # Ordenar y aplicar paginación
-    query = base_query.order_by(models.Lectura.Fecha_y_Hora.desc())
-    query = query.options(joinedload(models.Lectura.lector), joinedload(models.Lectura.archivo).joinedload(models.ArchivoExcel.caso))
-    lecturas = query.all()
-
-    logger.info(f"POST /lecturas/por_filtros - Encontradas {len(lecturas)} lecturas tras aplicar filtros.")
-    return lecturas
+    _comprobar_formato(formato, cursor, tamano_pagina, normalizado)
+    if formato == "ndjson":
+        return _respuesta_ndjson(base_query.order_by(models.Lectura.Fecha_y_Hora.desc(), models.Lectura.ID_Lectura.desc()), "POST /lecturas/por_filtros")
+    filtros_cache = {
+        "fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin, "hora_inicio": hora_inicio, "hora_fin": hora_fin,
+        "lector_ids": lector_ids, "carretera_ids": carretera_ids, "sentido": sentido, "matricula": matricula,
+        "matriculas": matriculas, "tipo_fuente": tipo_fuente, "solo_relevantes": solo_relevantes,
+        "min_pasos": min_pasos, "max_pasos": max_pasos, "cursor": cursor, "tamano_pagina": tamano_pagina,
+        "incluir_total": incluir_total, "normalizado": normalizado,
+    }
+    if cursor is not None or tamano_pagina is not None:
+        def generar_pagina():
+            pagina = _pagina_lecturas(base_query, cursor, tamano_pagina, incluir_total, descendente=True, normalizado=normalizado)
+            logger.info(f"POST /lecturas/por_filtros - Página de {len(pagina['lecturas'])} lecturas tras aplicar filtros.")
+            return pagina
+        return _respuesta_cacheada("lecturas/por_filtros", caso_ids, filtros_cache, generar_pagina, "POST /lecturas/por_filtros")
+
+    def generar_lista():
+        query = base_query.order_by(models.Lectura.Fecha_y_Hora.desc())
+        lecturas = _lista_lecturas(query, normalizado)
+        logger.info(f"POST /lecturas/por_filtros - Encontradas {len(lecturas['lecturas'] if normalizado else lecturas)} lecturas tras aplicar filtros.")
+        return lecturas
+    return _respuesta_cacheada("lecturas/por_filtros", caso_ids, filtros_cache, generar_lista, "POST /lecturas/por_filtros")
 
 # --- NUEVO ENDPOINT PARA LECTURAS POR PERIODO (LANZADERA) ---
 # Removed as part of cleanup
@@ -1954,12 +2302,11 @@ def detectar_vehiculos_lanzadera(
     db: Session = Depends(get_db)
 ):
     # 1. Obtener todas las lecturas del vehículo objetivo en el rango de fechas
+    id_matricula = db.query(models.Matricula.ID_Matricula)\
+        .filter(models.Matricula.Matricula == request.matricula).scalar()
     query = db.query(models.Lectura).filter(
-        models.Lectura.ID_Archivo.in_(
-            db.query(models.ArchivoExcel.ID_Archivo)
-            .filter(models.ArchivoExcel.ID_Caso == caso_id)
-        ),
-        models.Lectura.Matricula == request.matricula
+        models.Lectura.ID_Caso == caso_id,
+        models.Lectura.ID_Matricula == id_matricula
     )
     if request.fecha_inicio:
         query = query.filter(models.Lectura.Fecha_y_Hora >= request.fecha_inicio)
@@ -1983,14 +2330,11 @@ def detectar_vehiculos_lanzadera(
         
         # Buscar lecturas en la misma ventana temporal y lector
         lecturas_acompanantes = db.query(models.Lectura).filter(
-            models.Lectura.ID_Archivo.in_(
-                db.query(models.ArchivoExcel.ID_Archivo)
-                .filter(models.ArchivoExcel.ID_Caso == caso_id)
-            ),
-            models.Lectura.ID_Lector == lectura_objetivo.ID_Lector,
+            models.Lectura.ID_Caso == caso_id,
+            models.Lectura.ID_Interno_Lector == lectura_objetivo.ID_Interno_Lector,
             models.Lectura.Fecha_y_Hora >= ventana_inicio,
             models.Lectura.Fecha_y_Hora <= ventana_fin,
-            models.Lectura.Matricula != request.matricula
+            models.Lectura.ID_Matricula != id_matricula
         ).all()
         
         # Registrar las coincidencias
@@ -2070,7 +2414,7 @@ def get_estadisticas_globales(db: Session = Depends(get_db)):
         # Contar total de lecturas
         total_lecturas = db.query(func.count(models.Lectura.ID_Lectura)).scalar() or 0
         # Contar vehículos únicos
-        total_vehiculos = db.query(func.count(func.distinct(models.Lectura.Matricula))).scalar() or 0
+        total_vehiculos = db.query(func.count(func.distinct(models.Lectura.ID_Matricula))).scalar() or 0
         # Detectar si es SQLite y calcular tamaño del archivo
         tamanio_bd = 'No disponible'
         try:
@@ -2131,14 +2475,14 @@ def buscar_vehiculos_multicaso(request: BusquedaMulticasoRequest, db: Session =
         )
 
     # Obtener todas las lecturas de los casos seleccionados
-    lecturas = db.query(models.Lectura).join(models.ArchivoExcel).filter(
-        models.ArchivoExcel.ID_Caso.in_(casos)
+    lecturas = db.query(models.Lectura).filter(
+        models.Lectura.ID_Caso.in_(casos)
     ).all()
 
     # Agrupar lecturas por matrícula
     lecturas_por_matricula = defaultdict(lambda: defaultdict(list))
     for lectura in lecturas:
-        lecturas_por_matricula[lectura.Matricula][lectura.archivo.ID_Caso].append(lectura)
+        lecturas_por_matricula[lectura.Matricula][lectura.ID_Caso].append(lectura)
 
     # Filtrar solo las matrículas que aparecen en al menos 2 casos
     coincidencias = []
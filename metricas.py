@@ -0,0 +1,323 @@
+"""
+Métricas de rendimiento por endpoint: latencia, tamaño de respuesta, peticiones en curso y
+sentencias SQL (número y tiempo) por petición.
+
+MiddlewareMetricas es ASGI puro (no BaseHTTPMiddleware), así que mide también las respuestas
+en streaming hasta el último bloque. Las rutas se etiquetan con su plantilla
+('/casos/{caso_id}/lecturas'), no con la URL, para acotar el número de series. Las sentencias
+SQL se cuentan con los eventos before/after_cursor_execute del motor y se atribuyen a la
+petición en curso mediante una ContextVar (los hilos de run_in_threadpool heredan el contexto);
+las de hilos sin petición (importaciones en segundo plano) solo suman a los totales.
+
+Sin dependencias: texto de exposición de Prometheus (/metrics) y un resumen JSON para la
+administración (/api/admin/metricas, en admin/metricas.py). Ambos exponen las rutas, los
+códigos de estado y los tiempos de SQL, así que solo responden a los clientes de
+METRICAS_CLIENTES_PERMITIDOS (por defecto, la propia máquina); ver comprobar_cliente.
+"""
+import bisect
+import contextvars
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+from sqlalchemy import event
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+PREFIJO = "tracer"
+
+# Límites superiores de los cubos de los histogramas
+CUBOS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CUBOS_TAMANO = (1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+CUBOS_SENTENCIAS = (0, 1, 2, 5, 10, 25, 50, 100, 500, 1000)
+CUBOS_TIEMPO_SQL = CUBOS_LATENCIA
+
+RUTA_DESCONOCIDA = "sin_ruta"
+
+# Direcciones de cliente que pueden leer las métricas, separadas por comas ("*" = cualquiera).
+# Detrás de un proxy inverso el cliente es el proxy: restringir allí el acceso a /metrics
+CLIENTES_PERMITIDOS = {
+    cliente.strip() for cliente in os.getenv("METRICAS_CLIENTES_PERMITIDOS", "127.0.0.1,::1").split(",") if cliente.strip()
+}
+
+# Contador SQL de la petición en curso: {"sentencias": n, "segundos": s}
+_sql_peticion: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("sql_peticion", default=None)
+
+
+class Histograma:
+    """Histograma acumulativo al estilo Prometheus (cubos 'le', suma y número de observaciones)."""
+
+    def __init__(self, cubos: Tuple[float, ...]):
+        self.cubos = cubos
+        self.conteos = [0] * (len(cubos) + 1)  # el último es +Inf
+        self.suma = 0.0
+        self.total = 0
+        self.minimo = 0.0
+        self.maximo = 0.0
+
+    def observar(self, valor: float) -> None:
+        self.conteos[bisect.bisect_left(self.cubos, valor)] += 1
+        self.suma += valor
+        self.minimo = valor if self.total == 0 else min(self.minimo, valor)
+        self.total += 1
+        self.maximo = max(self.maximo, valor)
+
+    def cuantil(self, q: float) -> Optional[float]:
+        """
+        Estimación por interpolación lineal dentro del cubo, como histogram_quantile(), acotada a
+        los valores observados (la interpolación puede pasar del máximo real del cubo).
+        """
+        if self.total == 0:
+            return None
+        objetivo = q * self.total
+        acumulado = 0
+        for i, conteo in enumerate(self.conteos):
+            if conteo and acumulado + conteo >= objetivo:
+                if i == len(self.cubos):
+                    return self.maximo
+                inferior = self.cubos[i - 1] if i > 0 else 0.0
+                estimacion = inferior + (self.cubos[i] - inferior) * (objetivo - acumulado) / conteo
+                return min(max(estimacion, self.minimo), self.maximo)
+            acumulado += conteo
+        return self.maximo
+
+    def lineas(self, nombre: str, etiquetas: str) -> List[str]:
+        separador = "," if etiquetas else ""
+        lineas = []
+        acumulado = 0
+        for limite, conteo in zip(self.cubos, self.conteos):
+            acumulado += conteo
+            lineas.append(f'{nombre}_bucket{{{etiquetas}{separador}le="{limite:g}"}} {acumulado}')
+        lineas.append(f'{nombre}_bucket{{{etiquetas}{separador}le="+Inf"}} {self.total}')
+        lineas.append(f"{nombre}_sum{{{etiquetas}}} {self.suma:.6f}")
+        lineas.append(f"{nombre}_count{{{etiquetas}}} {self.total}")
+        return lineas
+
+
+class MetricasRuta:
+    def __init__(self):
+        self.latencia = Histograma(CUBOS_LATENCIA)
+        self.tamano = Histograma(CUBOS_TAMANO)
+        self.sentencias = Histograma(CUBOS_SENTENCIAS)
+        self.tiempo_sql = Histograma(CUBOS_TIEMPO_SQL)
+        self.estados: Dict[int, int] = defaultdict(int)
+
+
+class RegistroMetricas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rutas: Dict[Tuple[str, str], MetricasRuta] = defaultdict(MetricasRuta)
+        self.en_curso = 0
+        self.sql_sentencias_total = 0
+        self.sql_segundos_total = 0.0
+        self.inicio = time.time()
+
+    def empezar(self) -> None:
+        with self._lock:
+            self.en_curso += 1
+
+    def terminar(self, metodo: str, ruta: str, estado: int, segundos: float, tamano: int, sql: dict) -> None:
+        with self._lock:
+            self.en_curso -= 1
+            metricas = self._rutas[(metodo, ruta)]
+            metricas.latencia.observar(segundos)
+            metricas.tamano.observar(tamano)
+            metricas.sentencias.observar(sql["sentencias"])
+            metricas.tiempo_sql.observar(sql["segundos"])
+            metricas.estados[estado] += 1
+
+    def sumar_sql(self, segundos: float) -> None:
+        with self._lock:
+            self.sql_sentencias_total += 1
+            self.sql_segundos_total += segundos
+
+    def prometheus(self) -> str:
+        """Formato de exposición de texto de Prometheus (version 0.0.4)."""
+        lineas = []
+        with self._lock:
+            rutas = sorted(self._rutas.items())
+            lineas += [
+                f"# HELP {PREFIJO}_http_requests_total Peticiones HTTP atendidas por método, ruta y código de estado.",
+                f"# TYPE {PREFIJO}_http_requests_total counter",
+            ]
+            for (metodo, ruta), metricas in rutas:
+                for estado, conteo in sorted(metricas.estados.items()):
+                    lineas.append(f'{PREFIJO}_http_requests_total{{method="{metodo}",route="{_escapar(ruta)}",status="{estado}"}} {conteo}')
+            for nombre, atributo, ayuda in (
+                ("http_request_duration_seconds", "latencia", "Latencia de las peticiones hasta el último byte de la respuesta."),
+                ("http_response_size_bytes", "tamano", "Tamaño del cuerpo de la respuesta enviado (tras la compresión)."),
+                ("http_request_sql_statements", "sentencias", "Sentencias SQL ejecutadas por petición."),
+                ("http_request_sql_seconds", "tiempo_sql", "Tiempo total en SQL por petición."),
+            ):
+                lineas += [f"# HELP {PREFIJO}_{nombre} {ayuda}", f"# TYPE {PREFIJO}_{nombre} histogram"]
+                for (metodo, ruta), metricas in rutas:
+                    etiquetas = f'method="{metodo}",route="{_escapar(ruta)}"'
+                    lineas += getattr(metricas, atributo).lineas(f"{PREFIJO}_{nombre}", etiquetas)
+            lineas += [
+                f"# HELP {PREFIJO}_http_requests_in_progress Peticiones HTTP en curso.",
+                f"# TYPE {PREFIJO}_http_requests_in_progress gauge",
+                f"{PREFIJO}_http_requests_in_progress {self.en_curso}",
+                f"# HELP {PREFIJO}_sql_statements_total Sentencias SQL ejecutadas (incluidas las de trabajos en segundo plano).",
+                f"# TYPE {PREFIJO}_sql_statements_total counter",
+                f"{PREFIJO}_sql_statements_total {self.sql_sentencias_total}",
+                f"# HELP {PREFIJO}_sql_seconds_total Tiempo total en SQL.",
+                f"# TYPE {PREFIJO}_sql_seconds_total counter",
+                f"{PREFIJO}_sql_seconds_total {self.sql_segundos_total:.6f}",
+                f"# HELP {PREFIJO}_process_start_time_seconds Inicio del proceso (epoch).",
+                f"# TYPE {PREFIJO}_process_start_time_seconds gauge",
+                f"{PREFIJO}_process_start_time_seconds {self.inicio:.3f}",
+            ]
+        return "\n".join(lineas) + "\n"
+
+    def resumen(self) -> dict:
+        """Por ruta: peticiones, errores, latencias (media, p50/p95/p99, máxima), bytes y SQL; las más costosas primero."""
+        with self._lock:
+            rutas = []
+            for (metodo, ruta), metricas in self._rutas.items():
+                latencia = metricas.latencia
+                total = latencia.total
+                rutas.append({
+                    "metodo": metodo,
+                    "ruta": ruta,
+                    "peticiones": total,
+                    "errores": sum(conteo for estado, conteo in metricas.estados.items() if estado >= 500),
+                    "estados": dict(metricas.estados),
+                    "tiempo_total_s": round(latencia.suma, 4),
+                    "latencia_media_ms": round(1000 * latencia.suma / total, 2),
+                    "latencia_p50_ms": _ms(latencia.cuantil(0.5)),
+                    "latencia_p95_ms": _ms(latencia.cuantil(0.95)),
+                    "latencia_p99_ms": _ms(latencia.cuantil(0.99)),
+                    "latencia_max_ms": _ms(latencia.maximo),
+                    "bytes_medios": round(metricas.tamano.suma / total),
+                    "bytes_max": int(metricas.tamano.maximo),
+                    "sql_sentencias_medias": round(metricas.sentencias.suma / total, 2),
+                    "sql_sentencias_max": int(metricas.sentencias.maximo),
+                    "sql_ms_medios": round(1000 * metricas.tiempo_sql.suma / total, 2),
+                })
+            rutas.sort(key=lambda r: r["tiempo_total_s"], reverse=True)
+            return {
+                "desde": self.inicio,
+                "en_curso": self.en_curso,
+                "sql_sentencias_total": self.sql_sentencias_total,
+                "sql_segundos_total": round(self.sql_segundos_total, 4),
+                "rutas": rutas,
+            }
+
+
+def _ms(segundos: Optional[float]) -> Optional[float]:
+    return None if segundos is None else round(1000 * segundos, 2)
+
+
+def _escapar(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace('"', '\\"')
+
+
+registro = RegistroMetricas()
+
+
+def comprobar_cliente(request: Request) -> None:
+    """Dependencia de los endpoints de métricas: 403 si el cliente no está en CLIENTES_PERMITIDOS."""
+    if "*" in CLIENTES_PERMITIDOS:
+        return
+    cliente = request.client.host if request.client else None
+    if cliente not in CLIENTES_PERMITIDOS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Las métricas solo están disponibles desde los clientes permitidos.")
+
+
+def _plantilla_ruta(scope: Scope) -> str:
+    plantilla = getattr(scope.get("route"), "path", None)
+    if plantilla:
+        return plantilla
+    # Las aplicaciones montadas (/assets) no fijan 'route', pero sí amplían root_path
+    raiz, raiz_app = scope.get("root_path", ""), scope.get("app_root_path", "")
+    if raiz != raiz_app and raiz.startswith(raiz_app):
+        return raiz[len(raiz_app):] + "/{path}"
+    return RUTA_DESCONOCIDA
+
+
+class MiddlewareMetricas:
+    """Registra cada petición HTTP en 'registro' al enviarse el último bloque de la respuesta."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        sql = {"sentencias": 0, "segundos": 0.0}
+        token = _sql_peticion.set(sql)
+        estado = 500
+        tamano = 0
+        terminada = False
+
+        def registrar():
+            nonlocal terminada
+            if not terminada:
+                terminada = True
+                registro.terminar(scope["method"], _plantilla_ruta(scope), estado, time.perf_counter() - inicio, tamano, sql)
+
+        async def enviar(mensaje: Message) -> None:
+            nonlocal estado, tamano
+            if mensaje["type"] == "http.response.start":
+                estado = mensaje["status"]
+            elif mensaje["type"] == "http.response.body":
+                tamano += len(mensaje.get("body", b""))
+            await send(mensaje)
+            if mensaje["type"] == "http.response.body" and not mensaje.get("more_body", False):
+                registrar()
+
+        registro.empezar()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            # Si la respuesta no llegó a completarse (excepción, cliente desconectado)
+            registrar()
+            _sql_peticion.reset(token)
+
+
+# --- Sentencias SQL ---
+# after_cursor_execute no se emite si la sentencia falla: el inicio se guarda en el contexto de
+# ejecución de la propia sentencia (se descarta con él) y no en la conexión, que vive en el pool.
+# Solo las sentencias internas sin contexto usan la pila de conn.info, que handle_error vacía.
+def _antes_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    inicio = time.perf_counter()
+    if context is not None:
+        context.metricas_inicio_sql = inicio
+    else:
+        conn.info.setdefault("metricas_inicio_sql", []).append(inicio)
+
+
+def _despues_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        inicio = getattr(context, "metricas_inicio_sql", None)
+    else:
+        inicios = conn.info.get("metricas_inicio_sql")
+        inicio = inicios.pop() if inicios else None
+    if inicio is None:
+        return
+    segundos = time.perf_counter() - inicio
+    registro.sumar_sql(segundos)
+    sql = _sql_peticion.get()
+    if sql is not None:
+        sql["sentencias"] += 1
+        sql["segundos"] += segundos
+
+
+def _al_fallar(contexto_error) -> None:
+    conexion = contexto_error.connection
+    if contexto_error.execution_context is None and conexion is not None:
+        inicios = conexion.info.get("metricas_inicio_sql")
+        if inicios:
+            inicios.pop()
+
+
+def registrar_sql(engine) -> None:
+    """Instala los eventos que miden las sentencias de 'engine'."""
+    event.listen(engine, "before_cursor_execute", _antes_de_ejecutar)
+    event.listen(engine, "after_cursor_execute", _despues_de_ejecutar)
+    event.listen(engine, "handle_error", _al_fallar)
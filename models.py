@@ -1,10 +1,39 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, Date, DateTime, Float, ForeignKey, CheckConstraint, Index, Enum as SQLAlchemyEnum, Boolean, JSON
-from sqlalchemy.orm import relationship, Session
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Text, Date, DateTime, Float, ForeignKey, CheckConstraint, Index, Enum as SQLAlchemyEnum, Boolean, JSON
+from sqlalchemy import select
+from sqlalchemy.orm import column_property, relationship, Session
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.sql import func
 import datetime
 import enum # Importar enum
 from database import engine, Base # Importar Base desde database.py
 
+EPOCH = datetime.datetime(1970, 1, 1)
+
+def a_epoch(valor):
+    """datetime, date o texto ISO -> microsegundos desde EPOCH (sin zona horaria). Los enteros pasan tal cual."""
+    if valor is None or isinstance(valor, int):
+        return valor
+    if isinstance(valor, str):
+        valor = datetime.datetime.fromisoformat(valor)
+    elif not isinstance(valor, datetime.datetime):
+        valor = datetime.datetime.combine(valor, datetime.time())
+    return (valor.replace(tzinfo=None) - EPOCH) // datetime.timedelta(microseconds=1)
+
+class FechaHoraEpoch(TypeDecorator):
+    """
+    datetime guardado como entero (microsegundos desde 1970-01-01). En SQLite el DateTime es
+    texto ISO: así las comparaciones y ordenaciones son numéricas y leer una fila no exige parsear
+    texto. En Python se sigue viendo un datetime y admite los mismos valores al comparar.
+    """
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return a_epoch(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else EPOCH + datetime.timedelta(microseconds=value)
+
 # Definir el Enum para los estados del caso
 class EstadoCasoEnum(enum.Enum):
     NUEVO = "Nuevo"
@@ -33,6 +62,7 @@ class ArchivoExcel(Base):
     Nombre_del_Archivo = Column(Text, nullable=False)
     Tipo_de_Archivo = Column(Text, CheckConstraint("Tipo_de_Archivo IN ('GPS', 'LPR')"), nullable=False)
     Fecha_de_Importacion = Column(Date, nullable=False, default=datetime.date.today)
+    Hash_Contenido = Column(String(64), nullable=True, index=True) # SHA-256 del archivo subido
 
     caso = relationship("Caso", back_populates="archivos")
     lecturas = relationship("Lectura", back_populates="archivo", cascade="all, delete-orphan")
@@ -40,7 +70,9 @@ class ArchivoExcel(Base):
 class Lector(Base):
     __tablename__ = 'lector'
 
-    ID_Lector = Column(String(50), primary_key=True, index=True)
+    # Clave interna entera para las FK y los índices de 'lectura'; ID_Lector sigue siendo el identificador público
+    ID_Interno = Column(Integer, primary_key=True)
+    ID_Lector = Column(String(50), unique=True, nullable=False, index=True)
     Nombre = Column(String(100), nullable=True)
     Carretera = Column(String(100), nullable=True)
     Provincia = Column(String(50), nullable=True)
@@ -57,17 +89,28 @@ class Lector(Base):
     # Relación con Lectura: Un lector puede tener muchas lecturas
     lecturas = relationship("Lectura", back_populates="lector")
 
+class Matricula(Base):
+    """Diccionario de matrículas: cada texto distinto tiene un ID entero, el único que guarda 'lectura'."""
+    __tablename__ = 'matriculas'
+
+    ID_Matricula = Column(Integer, primary_key=True)
+    Matricula = Column(String(20), unique=True, nullable=False)
+
 class Lectura(Base):
     __tablename__ = 'lectura'
 
     ID_Lectura = Column(Integer, primary_key=True, index=True)
     ID_Archivo = Column(Integer, ForeignKey('ArchivosExcel.ID_Archivo'), nullable=False)
-    Matricula = Column(String(20), index=True, nullable=False)
-    Fecha_y_Hora = Column(DateTime, index=True, nullable=False)
+    # Copia de ArchivosExcel.ID_Caso: evita el JOIN en las consultas por caso
+    ID_Caso = Column(Integer, ForeignKey("Casos.ID_Caso"), nullable=False)
+    # El texto de la matrícula está solo en 'matriculas' (ver Lectura.Matricula tras la clase)
+    ID_Matricula = Column(Integer, ForeignKey("matriculas.ID_Matricula"), nullable=False, index=True)
+    Fecha_y_Hora = Column(FechaHoraEpoch, index=True, nullable=False)
+    Minuto_del_Dia = Column(Integer, nullable=False)  # hora*60 + minuto de Fecha_y_Hora, para franjas horarias
     Carril = Column(String(50), nullable=True)
     Velocidad = Column(Float, nullable=True)
-    # Asegurar que ForeignKey coincide con el tipo y longitud de Lector.ID_Lector
-    ID_Lector = Column(String(50), ForeignKey('lector.ID_Lector'), nullable=True, index=True) 
+    # Igual que la matrícula: el ID_Lector público está solo en 'lector' (ver Lectura.ID_Lector tras la clase)
+    ID_Interno_Lector = Column(Integer, ForeignKey('lector.ID_Interno'), nullable=True, index=True)
     Coordenada_X = Column(Float, nullable=True)
     Coordenada_Y = Column(Float, nullable=True)
     Tipo_Fuente = Column(String(10), nullable=False) # 'LPR' o 'GPS'
@@ -79,6 +122,27 @@ class Lectura(Base):
     # Relación con LecturaRelevante (uno a uno o cero)
     relevancia = relationship("LecturaRelevante", back_populates="lectura", uselist=False, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_lectura_caso_matricula_fecha", "ID_Caso", "ID_Matricula", "Fecha_y_Hora"),
+        Index("ix_lectura_caso_lector_fecha", "ID_Caso", "ID_Interno_Lector", "Fecha_y_Hora"),
+        Index("ix_lectura_caso_fecha", "ID_Caso", "Fecha_y_Hora"),
+        Index("ix_lectura_caso_minuto", "ID_Caso", "Minuto_del_Dia"),
+        Index("ix_lectura_caso_lector_minuto", "ID_Caso", "ID_Interno_Lector", "Minuto_del_Dia"),
+    )
+
+# Texto de la matrícula y del lector para los objetos ORM (una subconsulta por clave primaria,
+# sin correlacionar con 'lector'/'matriculas' aunque la consulta ya haga JOIN con ellas).
+# Los filtros deben ir por ID_Matricula / ID_Interno_Lector y las lecturas masivas los
+# resuelven en serializacion.py
+Lectura.Matricula = column_property(
+    select(Matricula.Matricula).where(Matricula.ID_Matricula == Lectura.ID_Matricula)
+    .correlate_except(Matricula).scalar_subquery()
+)
+Lectura.ID_Lector = column_property(
+    select(Lector.ID_Lector).where(Lector.ID_Interno == Lectura.ID_Interno_Lector)
+    .correlate_except(Lector).scalar_subquery()
+)
+
 # Nueva tabla para lecturas relevantes
 class LecturaRelevante(Base):
     __tablename__ = "LecturasRelevantes"
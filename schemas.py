@@ -156,6 +156,7 @@ class ArchivoExcel(ArchivoExcelBase):
     ID_Caso: int
     Fecha_de_Importacion: datetime.date
     Total_Registros: int = Field(0, description="Número total de lecturas en este archivo")
+    Hash_Contenido: Optional[str] = Field(None, description="SHA-256 del contenido del archivo subido")
     caso: Optional[Caso] = None  # <-- Añadido para exponer el caso relacionado
     # lecturas: List['Lectura'] = []
 
@@ -217,11 +218,70 @@ class UploadResponse(BaseModel):
     lecturas_duplicadas: Optional[List[str]] = None
     nuevos_lectores_creados: Optional[List[str]] = None
 
+# --- Schema para la vista previa de un archivo antes de importarlo ---
+class VistaPreviaResponse(BaseModel):
+    hash_contenido: str
+    formato: str = Field(..., example="xlsx", description="xlsx | xls | csv | parquet (detectado por el contenido)")
+    columnas: List[str]
+    tipos: Dict[str, str] = Field(..., description="Tipo inferido por columna en las filas leídas")
+    filas_estimadas: Optional[int] = None
+    muestra: List[Dict[str, Any]]
+    columnas_faltantes: Optional[List[str]] = None
+    lecturas: Optional[List[Dict[str, Any]]] = Field(None, description="Filas de muestra normalizadas con el mapeo propuesto")
+    errores: Optional[List[str]] = None
+
+# --- Schema para el estado de una importación en segundo plano ---
+class ImportacionEstado(BaseModel):
+    job_id: str
+    estado: str = Field(..., example="en_curso", description="pendiente | en_curso | completado | error | cancelado")
+    caso_id: int
+    nombre_archivo: str
+    tipo_archivo: str
+    id_archivo: Optional[int] = None
+    filas_estimadas: Optional[int] = None
+    filas_procesadas: int = 0
+    lecturas_insertadas: int = 0
+    errores: int = 0
+    lecturas_duplicadas: int = 0
+    progreso: Optional[float] = Field(None, description="Fracción procesada (0-1) si se conoce el total de filas")
+    eta_segundos: Optional[float] = None
+    creado: datetime.datetime
+    inicio: Optional[datetime.datetime] = None
+    fin: Optional[datetime.datetime] = None
+    mensaje: Optional[str] = None
+    resultado: Optional[UploadResponse] = None
+
+# --- Schema para respuesta de subida por lotes (un UploadResponse por archivo importado) ---
+class UploadLoteResponse(BaseModel):
+    resultados: List[UploadResponse]
+    errores_archivos: Optional[Dict[str, str]] = Field(None, description="Archivos no importados y motivo")
+
 # --- NUEVO: Schema para respuesta paginada de lectores ---
 class LectoresResponse(BaseModel):
     total_count: int
     lectores: List[Lector]
 
+# --- Página de lecturas con paginación por cursor (Fecha_y_Hora, ID_Lectura) ---
+class LecturasPagina(BaseModel):
+    lecturas: List[Lectura]
+    next_cursor: Optional[str] = Field(None, description="Cursor opaco para pedir la página siguiente; null en la última página")
+    total: Optional[int] = Field(None, description="Total de lecturas con los filtros; solo en la primera página y si se pide incluir_total")
+
+# --- Respuesta normalizada de lecturas: lectores, archivos y casos se envían una sola vez ---
+class LecturaNormalizada(LecturaBase):
+    ID_Lectura: int
+    ID_Archivo: int
+    ID_Caso: int
+    relevancia: Optional['LecturaRelevante'] = None
+
+class LecturasNormalizadas(BaseModel):
+    lecturas: List[LecturaNormalizada]
+    lectores: Dict[str, Lector] = Field(default_factory=dict, description="Lectores referenciados, por ID_Lector")
+    archivos: Dict[str, ArchivoExcel] = Field(default_factory=dict, description="Archivos referenciados, por ID_Archivo (sin 'caso': ver casos)")
+    casos: Dict[str, Caso] = Field(default_factory=dict, description="Casos referenciados, por ID_Caso")
+    next_cursor: Optional[str] = Field(None, description="Como en LecturasPagina, si se pidió paginación por cursor")
+    total: Optional[int] = Field(None, description="Como en LecturasPagina, si se pidió paginación por cursor")
+
 # === NUEVO: Esquema para datos de lector en el mapa ===
 class LectorCoordenadas(BaseModel):
     ID_Lector: str
@@ -0,0 +1,205 @@
+"""
+Serialización rápida de las respuestas de lectura masiva (lecturas, lectores, vehículos).
+
+En lugar de validar cada objeto ORM con Pydantic, se leen tuplas de columnas con consultas
+Core y se codifican con orjson (si está instalado). El JSON resultante tiene la misma forma
+que los esquemas de schemas.py, que siguen declarados como response_model para OpenAPI.
+Los objetos relacionados de cada lectura (lector, archivo con su caso, relevancia) son pocos
+y se validan con Pydantic una sola vez por objeto distinto.
+"""
+import datetime
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.orm import Query, Session, joinedload
+
+import models
+import schemas
+
+try:  # Opcional: codificador JSON rápido; sin él se usa json de la biblioteca estándar
+    import orjson
+except ImportError:
+    orjson = None
+
+# Filas por lote al recorrer resultados grandes (yield_per)
+TAMANO_LOTE = 1000
+# Límite de parámetros por consulta IN (SQLite antiguo admite 999 variables)
+TAMANO_CONSULTA = 500
+
+# Campos de schemas.Lectura que 'lectura' guarda como ID de otra tabla: se selecciona el ID y
+# el texto se resuelve por lote con una caché (sin JOIN ni subconsulta por fila)
+CAMPOS_POR_ID = {"Matricula": models.Lectura.ID_Matricula, "ID_Lector": models.Lectura.ID_Interno_Lector}
+# Campos de schemas.Lectura que se leen de 'lectura', en el orden del esquema
+CAMPOS_LECTURA = [
+    nombre for nombre in schemas.Lectura.model_fields
+    if nombre in models.Lectura.__table__.c or nombre in CAMPOS_POR_ID
+]
+
+
+def _por_defecto(valor):
+    if isinstance(valor, (datetime.datetime, datetime.date, datetime.time)):
+        return valor.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(valor).__name__}")
+
+
+def dumps(datos: Any) -> bytes:
+    """JSON compacto en bytes, con las fechas en ISO 8601 igual que Pydantic."""
+    if orjson is not None:
+        return orjson.dumps(datos)
+    return json.dumps(datos, default=_por_defecto, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class RespuestaJSONRapida(JSONResponse):
+    """JSONResponse que codifica con dumps; el contenido ya tiene la forma del response_model."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def columnas(esquema, modelo) -> list:
+    """Columnas de 'modelo' que corresponden a campos de 'esquema', en el orden del esquema."""
+    tabla = modelo.__table__
+    return [tabla.c[nombre] for nombre in esquema.model_fields if nombre in tabla.c]
+
+
+def filas(db: Session, consulta) -> List[dict]:
+    """Ejecuta una consulta Core de columnas y devuelve cada fila como diccionario."""
+    resultado = db.execute(consulta)
+    nombres = list(resultado.keys())
+    return [dict(zip(nombres, fila)) for fila in resultado]
+
+
+class SerializadorLecturas:
+    """
+    Convierte una consulta ORM de lecturas en diccionarios con la forma de schemas.Lectura.
+    Guarda en caché lectores, archivos y matrículas ya vistos, así que en una respuesta grande
+    cada uno se consulta (y valida) una sola vez.
+
+    Con normalizado=True cada lectura tiene la forma de schemas.LecturaNormalizada (solo los
+    IDs de lector, archivo y caso) y envoltorio() añade una sola vez los objetos referenciados.
+    """
+
+    def __init__(self, db: Session, normalizado: bool = False):
+        self.db = db
+        self.normalizado = normalizado
+        self._lectores: Dict[int, dict] = {}
+        self._archivos: Dict[int, dict] = {}
+        self._casos: Dict[int, dict] = {}
+        self._matriculas: Dict[int, str] = {}
+
+    def _cargar_lectores(self, ids: Iterable[int]) -> None:
+        pendientes = [i for i in set(ids) if i is not None and i not in self._lectores]
+        for inicio in range(0, len(pendientes), TAMANO_CONSULTA):
+            lote = pendientes[inicio:inicio + TAMANO_CONSULTA]
+            for lector in self.db.query(models.Lector).filter(models.Lector.ID_Interno.in_(lote)):
+                self._lectores[lector.ID_Interno] = schemas.Lector.model_validate(lector).model_dump(mode="json")
+
+    def _cargar_archivos(self, ids: Iterable[int]) -> None:
+        pendientes = [i for i in set(ids) if i not in self._archivos]
+        for inicio in range(0, len(pendientes), TAMANO_CONSULTA):
+            lote = pendientes[inicio:inicio + TAMANO_CONSULTA]
+            archivos = self.db.query(models.ArchivoExcel).options(joinedload(models.ArchivoExcel.caso))\
+                .filter(models.ArchivoExcel.ID_Archivo.in_(lote))
+            for archivo in archivos:
+                datos = schemas.ArchivoExcel.model_validate(archivo).model_dump(mode="json")
+                self._archivos[archivo.ID_Archivo] = datos
+                self._casos[archivo.ID_Caso] = datos["caso"]
+
+    def _cargar_matriculas(self, ids: Iterable[int]) -> None:
+        pendientes = [i for i in set(ids) if i not in self._matriculas]
+        for inicio in range(0, len(pendientes), TAMANO_CONSULTA):
+            lote = pendientes[inicio:inicio + TAMANO_CONSULTA]
+            consulta = select(models.Matricula.ID_Matricula, models.Matricula.Matricula)\
+                .where(models.Matricula.ID_Matricula.in_(lote))
+            self._matriculas.update(self.db.execute(consulta).all())
+
+    def _relevancias(self, ids: List[int]) -> Dict[int, dict]:
+        relevancias = {}
+        for inicio in range(0, len(ids), TAMANO_CONSULTA):
+            lote = ids[inicio:inicio + TAMANO_CONSULTA]
+            for relevante in self.db.query(models.LecturaRelevante).filter(models.LecturaRelevante.ID_Lectura.in_(lote)):
+                relevancias[relevante.ID_Lectura] = schemas.LecturaRelevante.model_validate(relevante).model_dump(mode="json")
+        return relevancias
+
+    def _lote(self, tuplas: List[tuple]) -> List[dict]:
+        posicion_lector = CAMPOS_LECTURA.index("ID_Lector")
+        posicion_matricula = CAMPOS_LECTURA.index("Matricula")
+        self._cargar_lectores(fila[posicion_lector] for fila in tuplas)
+        self._cargar_archivos(fila[CAMPOS_LECTURA.index("ID_Archivo")] for fila in tuplas)
+        self._cargar_matriculas(fila[posicion_matricula] for fila in tuplas)
+        relevancias = self._relevancias([fila[CAMPOS_LECTURA.index("ID_Lectura")] for fila in tuplas])
+        if self.normalizado:
+            return self._lote_normalizado(tuplas, relevancias)
+        lecturas = []
+        for fila in tuplas:
+            lectura = self._lectura(fila)
+            lectura["archivo"] = self._archivos.get(lectura["ID_Archivo"])
+            lectura["relevancia"] = relevancias.get(lectura["ID_Lectura"])
+            lectura["lector"] = self._lectores.get(fila[posicion_lector])
+            lectura["duracion_parada_min"] = None
+            lecturas.append(lectura)
+        return lecturas
+
+    def _lectura(self, fila: tuple) -> dict:
+        lectura = dict(zip(CAMPOS_LECTURA, fila))
+        lectura["Matricula"] = self._matriculas.get(lectura["Matricula"])
+        lector = self._lectores.get(lectura["ID_Lector"])
+        lectura["ID_Lector"] = lector["ID_Lector"] if lector is not None else None
+        return lectura
+
+    def _lote_normalizado(self, tuplas: List[tuple], relevancias: Dict[int, dict]) -> List[dict]:
+        n = len(CAMPOS_LECTURA)
+        lecturas = []
+        for fila in tuplas:
+            lectura = self._lectura(fila)
+            lectura["ID_Caso"] = fila[n]
+            lectura["relevancia"] = relevancias.get(lectura["ID_Lectura"])
+            lecturas.append(lectura)
+        return lecturas
+
+    def envoltorio(self, lecturas: List[dict], next_cursor: Optional[str] = None, total: Optional[int] = None) -> dict:
+        """Contenido de schemas.LecturasNormalizadas: las lecturas y, una vez, lo que referencian."""
+        lectores = {lector["ID_Lector"]: lector for lector in self._lectores.values()}
+        ids_lector = {lectura["ID_Lector"] for lectura in lecturas} & lectores.keys()
+        ids_archivo = {lectura["ID_Archivo"] for lectura in lecturas}
+        ids_caso = {lectura["ID_Caso"] for lectura in lecturas}
+        return {
+            "lecturas": lecturas,
+            "lectores": {i: lectores[i] for i in ids_lector},
+            "archivos": {str(i): dict(self._archivos[i], caso=None) for i in ids_archivo},
+            "casos": {str(i): self._casos[i] for i in ids_caso},
+            "next_cursor": next_cursor,
+            "total": total,
+        }
+
+    def _consulta(self, query: Query):
+        """Misma consulta (filtros, JOIN y orden) pero solo con las columnas que se serializan."""
+        return query.with_entities(
+            *[CAMPOS_POR_ID.get(nombre) or getattr(models.Lectura, nombre) for nombre in CAMPOS_LECTURA],
+            models.Lectura.ID_Caso
+        ).statement
+
+    def lista(self, query: Query) -> List[dict]:
+        tuplas = [tuple(fila) for fila in self.db.execute(self._consulta(query))]
+        return self._lote(tuplas)
+
+    def lotes(self, query: Query) -> Iterator[List[dict]]:
+        """Recorre el resultado por lotes en el servidor (yield_per) sin materializarlo entero."""
+        resultado = self.db.execute(self._consulta(query).execution_options(yield_per=TAMANO_LOTE))
+        for particion in resultado.partitions():
+            yield self._lote([tuple(fila) for fila in particion])
+
+
+def lista_lectores(db: Session, consulta, esquema=schemas.Lector) -> List[dict]:
+    """'consulta' es un select ORM de Lector (con filtros, orden y paginación); 'esquema' fija los campos."""
+    return filas(db, consulta.with_only_columns(*columnas(esquema, models.Lector)))
+
+
+def lista_vehiculos(db: Session, consulta, conteos_lpr: Optional[Dict[str, int]] = None) -> List[dict]:
+    """Vehículos con la forma de schemas.Vehiculo; 'conteos_lpr' rellena total_lecturas_lpr_caso."""
+    vehiculos = filas(db, consulta.with_only_columns(*columnas(schemas.Vehiculo, models.Vehiculo)))
+    for vehiculo in vehiculos:
+        vehiculo["total_lecturas_lpr_caso"] = None if conteos_lpr is None else conteos_lpr.get(vehiculo["Matricula"], 0)
+    return vehiculos
@@ -0,0 +1,118 @@
+"""
+Regresión del motor de importación: la normalización vectorizada de Fecha/Hora debe dar
+el mismo resultado que el importador original, que recorría el DataFrame fila a fila.
+"""
+import datetime
+import re
+
+import pandas as pd
+import pytest
+
+import importacion
+
+
+def _hora_por_fila(hora_val):
+    # Copia de parse_hora del importador original (upload_excel fila a fila)
+    if isinstance(hora_val, datetime.time):
+        return hora_val
+    if isinstance(hora_val, datetime.datetime):
+        return hora_val.time()
+    if isinstance(hora_val, float) and not pd.isna(hora_val):
+        total_seconds = int(hora_val * 24 * 60 * 60)
+        h = total_seconds // 3600
+        m = (total_seconds % 3600) // 60
+        s = total_seconds % 60
+        return datetime.time(hour=h, minute=m, second=s)
+    if isinstance(hora_val, str):
+        match = re.match(r"^(\d{1,2}):(\d{2})(?::(\d{2})([.,](\d{1,6}))?)?$", hora_val.strip())
+        if match:
+            h = int(match.group(1))
+            m = int(match.group(2))
+            s = int(match.group(3) or 0)
+            ms = match.group(5)
+            micro = int(float(f'0.{ms}') * 1_000_000) if ms else 0
+            return datetime.time(hour=h, minute=m, second=s, microsecond=micro)
+    raise ValueError(f"Formato de hora no reconocido: {hora_val}")
+
+
+def _fecha_por_fila(valor_fecha_excel):
+    # Copia de la normalización de Fecha del importador original (unidad en mayúscula: pandas 3 ya no acepta 'd')
+    if isinstance(valor_fecha_excel, datetime.datetime):
+        return valor_fecha_excel.date()
+    if isinstance(valor_fecha_excel, datetime.date):
+        return valor_fecha_excel
+    if isinstance(valor_fecha_excel, float) and not pd.isna(valor_fecha_excel):
+        return pd.to_datetime(valor_fecha_excel, unit='D', origin='1899-12-30').date()
+    return pd.to_datetime(str(valor_fecha_excel)).date()
+
+
+def _vectorizado(fechas, horas):
+    df = pd.DataFrame({"Fecha": pd.Series(fechas, dtype=object), "Hora": pd.Series(horas, dtype=object)})
+    dias = importacion.fechas_normalizadas(df["Fecha"])
+    micro = importacion.microsegundos_hora(df["Hora"])
+    return list(dias + pd.to_timedelta(micro, unit="us"))
+
+
+FECHAS = [
+    "01/02/2024",               # ambigua: mes primero, como el original (2 de enero)
+    "12/11/2023",
+    "2024-03-05",
+    "2024-03-05 17:45:00",
+    45292.0,                    # serie de Excel (2024-01-01)
+    45366.0,
+    datetime.datetime(2024, 6, 7, 9, 30),
+    datetime.date(2023, 12, 31),
+]
+
+HORAS = [
+    "08:15",
+    "08:15:30",
+    "08:15:30.250",             # HH:MM:SS.fff
+    "23:59:59,5",
+    "7:05:09.123456",
+    0.5,                        # fracción de día de Excel
+    0.7535185185185185,         # se trunca al segundo
+    datetime.time(6, 1, 2, 345000),
+]
+
+
+@pytest.mark.parametrize("fechas", [FECHAS, list(reversed(FECHAS)), FECHAS[:2] * 40])
+def test_fecha_y_hora_coinciden_con_el_importador_por_filas(fechas):
+    horas = (HORAS * (len(fechas) // len(HORAS) + 1))[:len(fechas)]
+    esperado = [
+        pd.Timestamp(datetime.datetime.combine(_fecha_por_fila(f), _hora_por_fila(h)))
+        for f, h in zip(fechas, horas)
+    ]
+    assert _vectorizado(fechas, horas) == esperado
+
+
+def test_fecha_ambigua_se_lee_con_el_mes_primero():
+    dias = importacion.fechas_normalizadas(pd.Series(["01/02/2024", "03/04/2024"], dtype=object))
+    assert list(dias) == [pd.Timestamp(2024, 1, 2), pd.Timestamp(2024, 3, 4)]
+
+
+def _csv_con_saltos_en_comillas(ruta, filas):
+    lineas = ["Matricula;Fecha;Hora;Notas"]
+    for i in range(filas):
+        notas = f'"linea 1\nlinea 2 ({i})"' if i % 3 == 0 else f"nota {i}"
+        lineas.append(f"{i:04d}ABC;2024-01-01;08:{i % 60:02d};{notas}")
+    ruta.write_text("\n".join(lineas) + "\n\n", encoding="utf-8")
+
+
+def test_conteo_csv_respeta_saltos_de_linea_entre_comillas(tmp_path):
+    ruta = tmp_path / "lecturas.csv"
+    _csv_con_saltos_en_comillas(ruta, 300)
+    bloques, filas = importacion.abrir_bloques(ruta)
+    assert filas == 300 == sum(len(bloque) for bloque in bloques)
+
+
+def test_vista_previa_estima_las_filas_de_un_csv_grande(tmp_path, monkeypatch):
+    ruta = tmp_path / "lecturas.csv"
+    _csv_con_saltos_en_comillas(ruta, 3000)
+    # Muestra menor que el archivo: se estima en lugar de recorrerlo
+    monkeypatch.setattr(importacion, "TAMANO_MUESTRA_CSV", 4096)
+    monkeypatch.setattr(importacion, "_contar_filas_csv", lambda *args: pytest.fail("la vista previa no debe contar el CSV entero"))
+    vista = importacion.vista_previa(ruta, "hash-prueba", "GPS")
+    assert len(vista["muestra"]) == importacion.FILAS_VISTA_PREVIA
+    # Estimación por líneas físicas: los campos con saltos de línea la inflan
+    assert 3000 * 0.5 <= vista["filas_estimadas"] <= 3000 * 1.5
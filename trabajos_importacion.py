@@ -0,0 +1,354 @@
+"""
+Importaciones en segundo plano.
+
+La subida valida el archivo y encola un trabajo; la normalización y la inserción se
+ejecutan en un pool de hilos con su propia sesión, fuera del bucle de eventos.
+El estado se consulta en /imports/{job_id} y el trabajo se puede cancelar: toda la
+importación ocurre en una única transacción, así que cancelar deshace también el ArchivoExcel.
+
+En las subidas por lotes la lectura y normalización de cada archivo se hace en un pool de
+procesos (usa todos los núcleos) y los hilos de importación solo escriben en la base de datos.
+Se preparan a la vez como mucho tantos archivos como procesos, y cada proceso vuelca los bloques
+normalizados a disco según los termina; el hilo de importación los lee de uno en uno, así que la
+memoria del servidor no crece con el tamaño del lote.
+"""
+import datetime
+import logging
+import multiprocessing
+import os
+import pathlib
+import shutil
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Deque, Dict, Iterable, Optional, Tuple
+
+import pandas as pd
+from fastapi import APIRouter, HTTPException, status
+
+import importacion
+import models
+import schemas
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# SQLite admite un único escritor: con más hilos las importaciones solo esperarían al bloqueo
+MAX_IMPORTACIONES_SIMULTANEAS = int(os.getenv("IMPORT_WORKERS", "1"))
+# Procesos para leer y normalizar archivos de las subidas por lotes
+MAX_PROCESOS_PREPARACION = int(os.getenv("IMPORT_PROCESSES", str(os.cpu_count() or 1)))
+# Tiempo que se conserva en memoria el estado de un trabajo terminado
+RETENCION_TRABAJOS = datetime.timedelta(hours=1)
+
+ESTADOS_FINALES = ("completado", "error", "cancelado")
+
+router = APIRouter()
+
+_pool = ThreadPoolExecutor(max_workers=MAX_IMPORTACIONES_SIMULTANEAS, thread_name_prefix="importacion")
+_pool_procesos: Optional[ProcessPoolExecutor] = None
+# Preparaciones a la espera de un proceso libre: (trabajo, mapeo de columnas)
+_preparaciones_pendientes: Deque[Tuple["TrabajoImportacion", dict]] = deque()
+_preparaciones_activas = 0
+_trabajos: Dict[str, "TrabajoImportacion"] = {}
+_lock = threading.Lock()
+
+
+class ImportacionCancelada(Exception):
+    """Se lanza en el hilo de la importación cuando se ha solicitado cancelarla."""
+
+
+class TrabajoImportacion:
+    def __init__(self, caso_id: int, nombre_archivo: str, tipo_archivo: str, ruta: pathlib.Path,
+                 bloques: Optional[Iterable[pd.DataFrame]], filas_estimadas: Optional[int],
+                 hash_contenido: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.caso_id = caso_id
+        self.nombre_archivo = nombre_archivo
+        self.tipo_archivo = tipo_archivo
+        self.ruta = ruta
+        self.bloques = bloques
+        self.filas_estimadas = filas_estimadas
+        self.hash_contenido = hash_contenido
+        self.estado = "pendiente"
+        self.creado = datetime.datetime.now()
+        self.inicio: Optional[datetime.datetime] = None
+        self.fin: Optional[datetime.datetime] = None
+        self.id_archivo: Optional[int] = None
+        self.progreso = importacion.ResultadoImportacion()
+        self.mensaje: Optional[str] = None
+        self.resultado: Optional[schemas.UploadResponse] = None
+        self.cancelacion = threading.Event()
+        self.futuro: Optional[Future] = None
+        # Lectura/normalización en el pool de procesos (subidas por lotes); sustituye a 'bloques'.
+        # Se resuelve con (rutas_de_los_bloques_volcados, filas_estimadas)
+        self.preparacion: Optional[Future] = None
+        self.directorio_volcado: Optional[pathlib.Path] = None
+        self._t_inicio: Optional[float] = None
+
+    def eta_segundos(self) -> Optional[float]:
+        procesadas = self.progreso.filas_procesadas
+        if self.estado != "en_curso" or not self.filas_estimadas or not procesadas:
+            return None
+        transcurrido = time.monotonic() - self._t_inicio
+        restantes = max(self.filas_estimadas - procesadas, 0)
+        return round(transcurrido / procesadas * restantes, 1)
+
+    def estado_publico(self) -> schemas.ImportacionEstado:
+        progreso = None
+        if self.estado == "completado":
+            progreso = 1.0
+        elif self.filas_estimadas:
+            progreso = round(min(self.progreso.filas_procesadas / self.filas_estimadas, 1.0), 4)
+        return schemas.ImportacionEstado(
+            job_id=self.id,
+            estado=self.estado,
+            caso_id=self.caso_id,
+            nombre_archivo=self.nombre_archivo,
+            tipo_archivo=self.tipo_archivo,
+            id_archivo=self.id_archivo,
+            filas_estimadas=self.filas_estimadas,
+            filas_procesadas=self.progreso.filas_procesadas,
+            lecturas_insertadas=self.progreso.total,
+            errores=len(self.progreso.errores),
+            lecturas_duplicadas=len(self.progreso.duplicadas),
+            progreso=progreso,
+            eta_segundos=self.eta_segundos(),
+            creado=self.creado,
+            inicio=self.inicio,
+            fin=self.fin,
+            mensaje=self.mensaje,
+            resultado=self.resultado,
+        )
+
+
+def _eliminar_archivo_subido(trabajo: TrabajoImportacion) -> None:
+    try:
+        if os.path.isfile(trabajo.ruta):
+            os.remove(trabajo.ruta)
+            logger.info(f"[Importación {trabajo.id}] Archivo físico eliminado: {trabajo.ruta}")
+    except OSError as e:
+        logger.error(f"[Importación {trabajo.id}] No se pudo eliminar {trabajo.ruta}: {e}", exc_info=True)
+
+
+def _ejecutar(trabajo: TrabajoImportacion) -> schemas.UploadResponse:
+    trabajo.estado = "en_curso"
+    trabajo.inicio = datetime.datetime.now()
+    trabajo._t_inicio = time.monotonic()
+    db = SessionLocal()
+    try:
+        if trabajo.cancelacion.is_set():
+            raise ImportacionCancelada()
+        if trabajo.preparacion is not None:
+            try:
+                volcados, trabajo.filas_estimadas = trabajo.preparacion.result()
+            except CancelledError:
+                raise ImportacionCancelada()
+            if trabajo.cancelacion.is_set():
+                raise ImportacionCancelada()
+            normalizadas = importacion.leer_volcados(volcados)
+        else:
+            normalizadas = importacion.normalizar_bloques(trabajo.bloques, trabajo.tipo_archivo)
+
+        # --- PRAGMAs de SQLite para la carga (antes de la primera escritura) ---
+        importacion.activar_pragmas_importacion(db)
+
+        # --- Crear Registro ArchivoExcel ---
+        db_archivo = models.ArchivoExcel(
+            ID_Caso=trabajo.caso_id,
+            Nombre_del_Archivo=trabajo.nombre_archivo,
+            Tipo_de_Archivo=trabajo.tipo_archivo,
+            Hash_Contenido=trabajo.hash_contenido
+        )
+        db.add(db_archivo)
+        db.flush()
+        db.refresh(db_archivo)
+        trabajo.id_archivo = db_archivo.ID_Archivo
+
+        def al_procesar_bloque(resultado: importacion.ResultadoImportacion):
+            trabajo.progreso = resultado
+            if trabajo.cancelacion.is_set():
+                raise ImportacionCancelada()
+
+        resultado = importacion.importar_normalizadas(
+            db, trabajo.caso_id, db_archivo, normalizadas, trabajo.tipo_archivo,
+            filas_estimadas=trabajo.filas_estimadas, al_procesar_bloque=al_procesar_bloque
+        )
+        trabajo.progreso = resultado
+        if trabajo.cancelacion.is_set():
+            raise ImportacionCancelada()
+
+        # Confirmar todas las lecturas válidas en una única transacción
+        if resultado.total:
+            db.commit()
+
+        respuesta = schemas.UploadResponse(
+            archivo=db_archivo,
+            total_registros=resultado.total,
+            errores=resultado.errores if resultado.errores else None,
+            lectores_no_encontrados=list(resultado.lectores_no_encontrados) if resultado.lectores_no_encontrados else None,
+            lecturas_duplicadas=resultado.duplicadas if resultado.duplicadas else None,
+            nuevos_lectores_creados=list(resultado.nuevos_lectores) if resultado.nuevos_lectores else None
+        )
+        logger.info(f"Importación completada. Devolviendo datos: {respuesta}")
+        if resultado.errores:
+            logger.warning(f"Importación {trabajo.nombre_archivo} completada con {len(resultado.errores)} errores: {resultado.errores}")
+        if resultado.duplicadas:
+            logger.warning(f"Importación {trabajo.nombre_archivo} completada con {len(resultado.duplicadas)} lecturas duplicadas: {resultado.duplicadas}")
+        trabajo.resultado = respuesta
+        trabajo.estado = "completado"
+        return respuesta
+    except ImportacionCancelada:
+        db.rollback()
+        trabajo.estado = "cancelado"
+        trabajo.id_archivo = None
+        trabajo.mensaje = "Importación cancelada. No se ha guardado ninguna lectura."
+        logger.info(f"[Importación {trabajo.id}] Cancelada tras {trabajo.progreso.filas_procesadas} filas. Rollback realizado.")
+        _eliminar_archivo_subido(trabajo)
+        raise
+    except Exception as e:
+        db.rollback()
+        trabajo.estado = "error"
+        trabajo.id_archivo = None
+        trabajo.mensaje = str(e)
+        logger.error(f"[Importación {trabajo.id}] Error importando {trabajo.nombre_archivo} para el caso {trabajo.caso_id}. Rollback realizado: {e}", exc_info=True)
+        _eliminar_archivo_subido(trabajo)
+        raise
+    finally:
+        trabajo.fin = datetime.datetime.now()
+        trabajo.bloques = None
+        trabajo.preparacion = None
+        if trabajo.directorio_volcado is not None:
+            shutil.rmtree(trabajo.directorio_volcado, ignore_errors=True)
+        db.close()
+
+
+def _purgar_terminados() -> None:
+    limite = datetime.datetime.now() - RETENCION_TRABAJOS
+    for job_id in [t.id for t in _trabajos.values() if t.estado in ESTADOS_FINALES and t.fin and t.fin < limite]:
+        del _trabajos[job_id]
+
+
+def encolar(caso_id: int, nombre_archivo: str, tipo_archivo: str, ruta: pathlib.Path,
+            bloques: Iterable[pd.DataFrame], filas_estimadas: Optional[int] = None,
+            hash_contenido: Optional[str] = None) -> TrabajoImportacion:
+    """Registra un trabajo de importación y lo envía al pool. Los bloques ya deben venir mapeados."""
+    trabajo = TrabajoImportacion(caso_id, nombre_archivo, tipo_archivo, ruta, bloques, filas_estimadas, hash_contenido)
+    with _lock:
+        _purgar_terminados()
+        _trabajos[trabajo.id] = trabajo
+    trabajo.futuro = _pool.submit(_ejecutar, trabajo)
+    logger.info(f"[Importación {trabajo.id}] Encolada: {nombre_archivo} ({tipo_archivo}) para el caso {caso_id}, ~{filas_estimadas} filas.")
+    return trabajo
+
+
+def _procesos() -> ProcessPoolExecutor:
+    global _pool_procesos
+    with _lock:
+        if _pool_procesos is None:
+            # 'spawn': el proceso del servidor tiene hilos y conexiones SQLite abiertas
+            _pool_procesos = ProcessPoolExecutor(
+                max_workers=MAX_PROCESOS_PREPARACION, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool_procesos
+
+
+def _lanzar_preparaciones() -> None:
+    """Envía al pool de procesos las preparaciones pendientes mientras haya procesos libres."""
+    global _preparaciones_activas
+    lanzar = []
+    with _lock:
+        while _preparaciones_pendientes and _preparaciones_activas < MAX_PROCESOS_PREPARACION:
+            trabajo, mapeo = _preparaciones_pendientes.popleft()
+            # Falso si se canceló mientras esperaba turno
+            if trabajo.preparacion.set_running_or_notify_cancel():
+                _preparaciones_activas += 1
+                lanzar.append((trabajo, mapeo))
+    # Fuera del bloqueo: add_done_callback llama en el acto si el futuro ya ha terminado
+    for trabajo, mapeo in lanzar:
+        try:
+            futuro = _procesos().submit(
+                importacion.preparar_archivo, str(trabajo.ruta), mapeo, trabajo.tipo_archivo, str(trabajo.directorio_volcado)
+            )
+        except Exception as e:
+            _preparacion_terminada(trabajo, None, e)
+            continue
+        futuro.add_done_callback(lambda f, trabajo=trabajo: _preparacion_terminada(trabajo, f))
+
+
+def _preparacion_terminada(trabajo: "TrabajoImportacion", futuro: Optional[Future], error: Optional[BaseException] = None) -> None:
+    global _preparaciones_activas
+    if futuro is not None:
+        error = futuro.exception() if not futuro.cancelled() else CancelledError()
+    if error is not None:
+        trabajo.preparacion.set_exception(error)
+    else:
+        trabajo.preparacion.set_result(futuro.result())
+    with _lock:
+        _preparaciones_activas -= 1
+    _lanzar_preparaciones()
+
+
+def encolar_preparado(caso_id: int, nombre_archivo: str, tipo_archivo: str, ruta: pathlib.Path,
+                      map_cliente_a_interno: dict, hash_contenido: Optional[str] = None) -> TrabajoImportacion:
+    """
+    Como encolar, pero la lectura, validación y normalización del archivo se ejecutan en el
+    pool de procesos (cuando hay uno libre); el hilo de importación espera a que termine y
+    escribe en la BD los bloques volcados a disco, de uno en uno.
+    """
+    trabajo = TrabajoImportacion(caso_id, nombre_archivo, tipo_archivo, ruta, None, None, hash_contenido)
+    trabajo.directorio_volcado = ruta.with_name(f".{ruta.name}.{trabajo.id}.bloques")
+    trabajo.directorio_volcado.mkdir()
+    trabajo.preparacion = Future()
+    with _lock:
+        _purgar_terminados()
+        _trabajos[trabajo.id] = trabajo
+        _preparaciones_pendientes.append((trabajo, map_cliente_a_interno))
+    _lanzar_preparaciones()
+    trabajo.futuro = _pool.submit(_ejecutar, trabajo)
+    logger.info(f"[Importación {trabajo.id}] Encolada (lote): {nombre_archivo} ({tipo_archivo}) para el caso {caso_id}.")
+    return trabajo
+
+
+def detener() -> None:
+    """Cancela los trabajos en curso y espera a que terminen (cierre de la aplicación)."""
+    with _lock:
+        activos = [t for t in _trabajos.values() if t.estado not in ESTADOS_FINALES]
+    for trabajo in activos:
+        trabajo.cancelacion.set()
+    wait([trabajo.futuro for trabajo in activos if trabajo.futuro is not None])
+    global _pool_procesos
+    with _lock:
+        for trabajo, _ in _preparaciones_pendientes:
+            trabajo.preparacion.cancel()
+        _preparaciones_pendientes.clear()
+        if _pool_procesos is not None:
+            _pool_procesos.shutdown(wait=False, cancel_futures=True)
+            _pool_procesos = None
+
+
+def _obtener(job_id: str) -> TrabajoImportacion:
+    with _lock:
+        trabajo = _trabajos.get(job_id)
+    if trabajo is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Importación no encontrada")
+    return trabajo
+
+
+@router.get("/imports/{job_id}", response_model=schemas.ImportacionEstado)
+def get_importacion(job_id: str):
+    return _obtener(job_id).estado_publico()
+
+
+@router.delete("/imports/{job_id}", response_model=schemas.ImportacionEstado, status_code=status.HTTP_202_ACCEPTED)
+def cancelar_importacion(job_id: str):
+    trabajo = _obtener(job_id)
+    if trabajo.estado in ESTADOS_FINALES:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"La importación ya ha terminado (estado: {trabajo.estado}).")
+    trabajo.cancelacion.set()
+    preparacion = trabajo.preparacion
+    if preparacion is not None:
+        preparacion.cancel()
+    logger.info(f"[Importación {job_id}] Cancelación solicitada.")
+    return trabajo.estado_publico()
@@ -0,0 +1,191 @@
+"""
+Contadores de versión para las respuestas condicionales (ETag / If-None-Match).
+
+Hay un contador por tabla seguida y otro por caso para las lecturas y sus marcas de relevancia. Los
+incrementa un evento del motor que observa cada INSERT/UPDATE/DELETE, así que cubre cualquier
+escritura (importaciones, update_lector, borrados, el panel de administración) sin tener que
+acordarse en cada endpoint. El incremento se aplica al devolver la conexión al pool tras el
+COMMIT: un lector que calculara la versión antes del commit vería los datos antiguos con la
+versión antigua. Una escritura en 'lectura' o 'LecturasRelevantes' cuyo caso no está en los
+parámetros se atribuye al caso indicado con asignar_caso() para la transacción; si no se ha
+indicado, incrementa la generación común a todos los casos.
+
+Los contadores viven en memoria; el ETag incluye un identificador de la instancia, así que
+tras reiniciar el servidor los ETag anteriores dejan de coincidir.
+"""
+import logging
+import re
+import threading
+import uuid
+from collections import defaultdict
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+INSTANCIA = uuid.uuid4().hex[:12]
+
+# Tablas cuyas escrituras se siguen (en minúsculas) y, de ellas, las que tienen versión por caso
+TABLAS_VERSIONADAS = {"lector", "lectura", "lecturasrelevantes", "archivosexcel", "casos"}
+TABLAS_POR_CASO = {"lectura", "lecturasrelevantes"}
+
+_SENTENCIA_DML = re.compile(r'^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|UPDATE|DELETE\s+FROM)\s+["`\[]?(\w+)', re.IGNORECASE)
+
+_lock = threading.Lock()
+_tablas = defaultdict(int)
+_casos = defaultdict(int)
+_generacion_casos = 0
+# Se incrementa con cualquier cambio de caso: versión de las consultas que abarcan todos los casos
+_version_total = 0
+# Funciones llamadas con el ID del caso modificado (None = todos), p. ej. para purgar cachés
+_observadores = []
+
+# Claves en el info de la conexión del pool
+_PENDIENTES = "versiones_pendientes"
+_CONFIRMADAS = "versiones_confirmadas"
+
+
+def version_tabla(tabla: str) -> int:
+    return _tablas[tabla]
+
+
+def version_caso(caso_id: int) -> tuple:
+    return _generacion_casos, _casos[caso_id]
+
+
+def version_total() -> int:
+    return _version_total
+
+
+def al_cambiar_caso(funcion) -> None:
+    """Registra 'funcion(caso_id)', llamada tras cada incremento de caso (None = todos)."""
+    _observadores.append(funcion)
+
+
+def incrementar_tabla(tabla: str) -> None:
+    with _lock:
+        _tablas[tabla] += 1
+
+
+def incrementar_caso(caso_id: Optional[int]) -> None:
+    """Incrementa la versión de un caso; con None, la de todos."""
+    global _generacion_casos, _version_total
+    with _lock:
+        if caso_id is None:
+            _generacion_casos += 1
+        else:
+            _casos[caso_id] += 1
+        _version_total += 1
+    for funcion in _observadores:
+        funcion(caso_id)
+
+
+def incrementar_todo() -> None:
+    """Para cambios que no pasan por sentencias DML (restaurar copia, recrear tablas)."""
+    for tabla in TABLAS_VERSIONADAS:
+        incrementar_tabla(tabla)
+    incrementar_caso(None)
+
+
+def etag(*partes) -> str:
+    return '"' + "-".join(str(p) for p in (INSTANCIA, *partes)) + '"'
+
+
+def etag_tablas(*tablas: str) -> str:
+    return etag(*(version_tabla(t) for t in tablas))
+
+
+def etag_caso(caso_id: int, *tablas: str) -> str:
+    return etag(caso_id, *version_caso(caso_id), *(version_tabla(t) for t in tablas))
+
+
+def no_modificado(request: Request, valor_etag: str) -> Optional[Response]:
+    """304 si If-None-Match incluye 'valor_etag' (o es '*'); None si hay que generar la respuesta."""
+    cabecera = request.headers.get("if-none-match")
+    if not cabecera:
+        return None
+    candidatos = {c.strip().removeprefix("W/") for c in cabecera.split(",")}
+    if valor_etag in candidatos or "*" in candidatos:
+        return Response(status_code=304, headers=cabeceras(valor_etag))
+    return None
+
+
+def cabeceras(valor_etag: str) -> dict:
+    # no-cache: el navegador guarda la respuesta pero la revalida siempre con el ETag
+    return {"ETag": valor_etag, "Cache-Control": "no-cache"}
+
+
+# --- Seguimiento de escrituras en el motor ---
+def _pendientes(info: dict) -> dict:
+    return info.setdefault(_PENDIENTES, {"tablas": set(), "casos": set(), "caso": None})
+
+
+def asignar_caso(db, caso_id: int) -> None:
+    """Atribuye a 'caso_id' las escrituras de la transacción en curso de 'db' sin caso en los parámetros."""
+    _pendientes(db.connection().info)["caso"] = caso_id
+
+
+def _casos_afectados(context) -> Optional[set]:
+    """ID_Caso de los parámetros de la sentencia, o None si alguna fila no lo indica."""
+    parametros = getattr(context, "compiled_parameters", None) or []
+    casos = set()
+    for fila in parametros:
+        if fila.get("ID_Caso") is None:
+            return None
+        casos.add(fila["ID_Caso"])
+    return casos or None
+
+
+def _despues_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    coincidencia = _SENTENCIA_DML.match(statement)
+    if not coincidencia:
+        return
+    tabla = coincidencia.group(1).lower()
+    if tabla not in TABLAS_VERSIONADAS:
+        return
+    pendientes = _pendientes(conn.info)
+    pendientes["tablas"].add(tabla)
+    if tabla in TABLAS_POR_CASO:
+        casos = _casos_afectados(context) if statement.lstrip()[:6].upper() == "INSERT" else None
+        if casos is None:
+            casos = {pendientes["caso"]}
+        pendientes["casos"].update(casos)
+
+
+def _al_confirmar(conn):
+    pendientes = conn.info.pop(_PENDIENTES, None)
+    if pendientes:
+        confirmadas = conn.info.setdefault(_CONFIRMADAS, {"tablas": set(), "casos": set()})
+        confirmadas["tablas"] |= pendientes["tablas"]
+        confirmadas["casos"] |= pendientes["casos"]
+
+
+def _al_deshacer(conn):
+    conn.info.pop(_PENDIENTES, None)
+
+
+def _aplicar(dbapi_connection, connection_record):
+    confirmadas = connection_record.info.pop(_CONFIRMADAS, None)
+    # Lo no confirmado al devolver la conexión se ha descartado (el pool hace rollback)
+    connection_record.info.pop(_PENDIENTES, None)
+    if not confirmadas:
+        return
+    for tabla in confirmadas["tablas"]:
+        incrementar_tabla(tabla)
+    if None in confirmadas["casos"]:
+        incrementar_caso(None)
+    else:
+        for caso_id in confirmadas["casos"]:
+            incrementar_caso(caso_id)
+
+
+def registrar(engine) -> None:
+    """Instala los eventos que siguen las escrituras de 'engine'."""
+    event.listen(engine, "after_cursor_execute", _despues_de_ejecutar)
+    event.listen(engine, "commit", _al_confirmar)
+    event.listen(engine, "rollback", _al_deshacer)
+    # Sobre el motor y no sobre engine.pool: así se conserva al recrear el pool (engine.dispose)
+    event.listen(engine, "checkin", _aplicar)